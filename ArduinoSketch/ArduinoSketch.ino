@@ -32,6 +32,36 @@ float lastX = 0;
 float lastZ = 0;
 unsigned long lastUpdateTime = 0;
 const unsigned long MOVEMENT_TIMEOUT = 100; // 100ms timeout for movement updates
+const unsigned long LINK_TIMEOUT = 500;     // halt if a host that sends keep-alives goes quiet this long
+unsigned long lastMessageTime = 0;
+bool keepaliveSeen = false;
+bool linkLost = false;
+
+// -----------------------------
+// Serial Protocol
+// -----------------------------
+// Text:   "x,y,z,rx,ry,rz\n", or "KEEPALIVE\n" / "STOP\n"
+//         "PING\n" is answered with "PONG"; "READY" is printed once setup()
+//         is done, so the host knows when the board listens
+// Binary: AA 55 | type | len | seq(u16) | timestamp(u32) | payload[len] | crc16
+//         little-endian, CRC-16/CCITT-FALSE over type..payload.
+//         Pose payload: tag id(u16), x,y,z (mm, i16), rx,ry,rz (1e-4 rad, i16)
+//         Multi-pose payload: count(u8), then count pose entries, highest
+//         priority first
+//         Keep-alive and stop frames have no payload
+const uint8_t SYNC1 = 0xAA;
+const uint8_t SYNC2 = 0x55;
+const uint8_t MSG_POSE = 0x01;
+const uint8_t MSG_MULTI_POSE = 0x02;
+const uint8_t MSG_KEEPALIVE = 0x03;
+const uint8_t MSG_STOP = 0x04;
+const uint8_t POSE_SIZE = 14;
+const uint8_t HEADER_SIZE = 10;
+const uint8_t MAX_PAYLOAD = 1 + 8 * POSE_SIZE;
+uint8_t frameBuf[HEADER_SIZE + MAX_PAYLOAD + 2];
+uint8_t frameLen = 0;
+char textBuf[64];
+uint8_t textLen = 0;
 
 // -----------------------------
 // Function Prototypes
@@ -39,6 +69,9 @@ const unsigned long MOVEMENT_TIMEOUT = 100; // 100ms timeout for movement update
 void moveProportional(float x, float z);
 void haltMotors();
 void updateMotors(float leftSpeed, float rightSpeed);
+void handleSerialByte(uint8_t b, unsigned long currentTime);
+void applyPose(float x, float z, unsigned long currentTime);
+void handleControl(uint8_t type, unsigned long currentTime);
 
 void setup() {
   Serial.begin(115200);
@@ -51,6 +84,8 @@ void setup() {
   
   // Initialize motors to stopped state
   haltMotors();
+  
+  Serial.println("READY");
 }
 
 // -----------------------------
@@ -134,6 +169,15 @@ void haltMotors() {
 void loop() {
   unsigned long currentTime = millis();
   
+  // A host that sends keep-alives never goes quiet while it runs, so
+  // silence means the link or the host is gone
+  if (keepaliveSeen && !linkLost && currentTime - lastMessageTime > LINK_TIMEOUT) {
+    Serial.println("Link timeout. Halting...");
+    linkLost = true;
+    lastZ = 0;
+    haltMotors();
+  }
+  
   // Check if we need to maintain last movement command
   if (currentTime - lastUpdateTime > MOVEMENT_TIMEOUT) {
     // If no new data received, maintain last movement
@@ -142,49 +186,153 @@ void loop() {
     }
   }
   
-  // Check if Serial data is available
-  if (Serial.available()) {
-    // Read the incoming data until newline character
-    String data = Serial.readStringUntil('\n');
+  // Handle whatever serial data is available without blocking
+  while (Serial.available()) {
+    handleSerialByte(Serial.read(), currentTime);
+  }
+}
+
+uint16_t crc16(const uint8_t* data, uint8_t len) {
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+int16_t readInt16(const uint8_t* p) {
+  return (int16_t)(p[0] | ((uint16_t)p[1] << 8));
+}
+
+void handleBinaryFrame(unsigned long currentTime) {
+  uint8_t payloadLen = frameBuf[3];
+  uint16_t crc = frameBuf[HEADER_SIZE + payloadLen] | ((uint16_t)frameBuf[HEADER_SIZE + payloadLen + 1] << 8);
+  if (crc != crc16(frameBuf + 2, HEADER_SIZE - 2 + payloadLen)) {
+    Serial.println("CRC error");
+    return;
+  }
+  
+  uint16_t seq = frameBuf[4] | ((uint16_t)frameBuf[5] << 8);
+  const uint8_t* payload = frameBuf + HEADER_SIZE;
+  if (frameBuf[2] == MSG_POSE && payloadLen >= POSE_SIZE) {
+    float x = readInt16(payload + 2) / 1000.0;
+    float z = readInt16(payload + 6) / 1000.0;
+    applyPose(x, z, currentTime);
+  } else if (frameBuf[2] == MSG_MULTI_POSE && payloadLen >= 1 + POSE_SIZE && payload[0] > 0) {
+    // Drive towards the first (highest priority) target
+    const uint8_t* pose = payload + 1;
+    float x = readInt16(pose + 2) / 1000.0;
+    float z = readInt16(pose + 6) / 1000.0;
+    applyPose(x, z, currentTime);
+  } else if (frameBuf[2] == MSG_KEEPALIVE || frameBuf[2] == MSG_STOP) {
+    handleControl(frameBuf[2], currentTime);
+  }
+  lastMessageTime = currentTime;
+  linkLost = false;
+  
+  // Lets the host measure latency and count dropped frames
+  Serial.print("ACK ");
+  Serial.println(seq);
+}
+
+void handleTextLine(String data, unsigned long currentTime) {
+  if (data == "PING") {
+    Serial.println("PONG");
+    lastMessageTime = currentTime;
+    linkLost = false;
+    return;
+  }
+  
+  if (data == "KEEPALIVE" || data == "STOP") {
+    handleControl(data == "STOP" ? MSG_STOP : MSG_KEEPALIVE, currentTime);
+    lastMessageTime = currentTime;
+    linkLost = false;
+    return;
+  }
+  
+  // Parse the comma-separated values
+  int comma1 = data.indexOf(',');
+  int comma2 = data.indexOf(',', comma1 + 1);
+  int comma3 = data.indexOf(',', comma2 + 1);
+  int comma4 = data.indexOf(',', comma3 + 1);
+  int comma5 = data.indexOf(',', comma4 + 1);
+  
+  if (comma1 > 0 && comma2 > comma1 && comma3 > comma2 &&
+      comma4 > comma3 && comma5 > comma4) {
     
-    // Parse the comma-separated values
-    int comma1 = data.indexOf(',');
-    int comma2 = data.indexOf(',', comma1 + 1);
-    int comma3 = data.indexOf(',', comma2 + 1);
-    int comma4 = data.indexOf(',', comma3 + 1);
-    int comma5 = data.indexOf(',', comma4 + 1);
+    String x_str  = data.substring(0, comma1);
+    String y_str  = data.substring(comma1 + 1, comma2);
+    String z_str  = data.substring(comma2 + 1, comma3);
     
-    if (comma1 > 0 && comma2 > comma1 && comma3 > comma2 &&
-        comma4 > comma3 && comma5 > comma4) {
-      
-      String x_str  = data.substring(0, comma1);
-      String y_str  = data.substring(comma1 + 1, comma2);
-      String z_str  = data.substring(comma2 + 1, comma3);
+    if (x_str.length() > 0 && y_str.length() > 0 && z_str.length() > 0) {
+      // Convert strings to float values
+      float x = x_str.toFloat();
+      float y = y_str.toFloat();
+      float z = z_str.toFloat();
       
-      if (x_str.length() > 0 && y_str.length() > 0 && z_str.length() > 0) {
-        // Convert strings to float values
-        float x = x_str.toFloat();
-        float y = y_str.toFloat();
-        float z = z_str.toFloat();
-        
-        // Update last known position
-        lastX = x;
-        lastZ = z;
-        lastUpdateTime = currentTime;
-        
-        // Navigation Decision:
-        if (z > approachThreshold) {
-          moveProportional(x, z);
-        } else {
-          // Tag is close enough, so stop.
-          Serial.println("Tag reached. Halting...");
-          haltMotors();
-        }
-      }
+      applyPose(x, z, currentTime);
+      lastMessageTime = currentTime;
+      linkLost = false;
     }
   }
 }
 
+void handleControl(uint8_t type, unsigned long currentTime) {
+  keepaliveSeen = true;
+  if (type == MSG_STOP) {
+    // Target lost: halt now instead of coasting on the last command
+    if (lastZ != 0) {
+      Serial.println("Stop received. Halting...");
+    }
+    lastZ = 0;
+    haltMotors();
+  }
+}
+
+void handleSerialByte(uint8_t b, unsigned long currentTime) {
+  // Binary frames start with 0xAA, which never appears in the text format
+  if (frameLen > 0 || (b == SYNC1 && textLen == 0)) {
+    frameBuf[frameLen++] = b;
+    // Drop bad headers: wrong second sync byte or an oversized payload
+    if ((frameLen == 2 && b != SYNC2) || (frameLen == 4 && b > MAX_PAYLOAD)) {
+      frameLen = 0;
+      return;
+    }
+    if (frameLen >= HEADER_SIZE && frameLen == HEADER_SIZE + frameBuf[3] + 2) {
+      handleBinaryFrame(currentTime);
+      frameLen = 0;
+    }
+    return;
+  }
+  
+  if (b == '\n') {
+    textBuf[textLen] = '\0';
+    handleTextLine(String(textBuf), currentTime);
+    textLen = 0;
+  } else if (textLen < sizeof(textBuf) - 1) {
+    textBuf[textLen++] = b;
+  }
+}
+
+void applyPose(float x, float z, unsigned long currentTime) {
+  // Update last known position
+  lastX = x;
+  lastZ = z;
+  lastUpdateTime = currentTime;
+  
+  // Navigation Decision:
+  if (z > approachThreshold) {
+    moveProportional(x, z);
+  } else {
+    // Tag is close enough, so stop.
+    Serial.println("Tag reached. Halting...");
+    haltMotors();
+  }
+}
+
 void moveProportional(float x, float z) {
   // Calculate base speed based on distance (closer = slower)
   float baseSpeed = map(z, approachThreshold, 1.0, minSpeed, maxSpeed);
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 def dh_transform(theta_deg, d, a, alpha_deg):
     theta = np.radians(theta_deg)
@@ -11,17 +10,226 @@ def dh_transform(theta_deg, d, a, alpha_deg):
         [0,              0,                            0,                           1]
     ])
 
-def forward_kinematics(theta1, theta2, theta3):
-    T0 = np.identity(4)
-    T1 = T0 @ dh_transform(theta1, 0, 0, 90)
-    T2 = T1 @ dh_transform(theta2, 0, 102.72, 0)
-    T3 = T2 @ dh_transform(theta3, 0, 145, 0)
-    T4 = T3 @ dh_transform(0, 0, 50, 0)
+class DHChain:
+    """
+    Serial chain built from a DH parameter table, evaluated for many joint
+    configurations at once.
+
+    Each table row is (theta_deg, d, a, alpha_deg, revolute). For revolute
+    links theta_deg is an offset added to the joint angle; other links are
+    fixed and their transform is computed once up front. Lengths are in
+    whatever unit the table uses (mm for the arm below).
+    """
+
+    def __init__(self, table, chunk_size=8192):
+        self.chunk_size = chunk_size
+        self.table = [tuple(row) for row in table]
+        self.joint_links = [i for i, row in enumerate(self.table) if row[4]]
+        self.num_joints = len(self.joint_links)
+        # Constant parts of each link transform
+        self._theta0 = np.radians([row[0] for row in self.table])
+        self._d = np.array([row[1] for row in self.table], dtype=np.float64)
+        self._a = np.array([row[2] for row in self.table], dtype=np.float64)
+        alpha = np.radians([row[3] for row in self.table])
+        self._ca = np.cos(alpha)
+        self._sa = np.sin(alpha)
+        self._fixed = {i for i, row in enumerate(self.table) if not row[4]}
+
+    def _joint_array(self, thetas, degrees):
+        thetas = np.asarray(thetas, dtype=np.float64)
+        if thetas.shape[-1] != self.num_joints:
+            raise ValueError(f"Expected {self.num_joints} joint values, got shape {thetas.shape}")
+        thetas = thetas.reshape((-1, self.num_joints))
+        return np.radians(thetas) if degrees else thetas
+
+    def _walk(self, thetas):
+        """
+        Yield (X, Y, Z, p) for the base and every link frame: the three
+        rotation columns and the origin, each stored as a (3, N) array.
+
+        A DH link transform has a fixed last row, so composing it with the
+        previous frame reduces to a few broadcast multiply-adds per column
+        instead of a full batched 4x4 matrix product.
+        """
+        n = thetas.shape[0]
+        X = np.zeros((3, n))
+        Y = np.zeros((3, n))
+        Z = np.zeros((3, n))
+        X[0] = Y[1] = Z[2] = 1.0
+        p = np.zeros((3, n))
+        yield X, Y, Z, p
+        joint = 0
+        for link in range(len(self.table)):
+            if link in self._fixed:
+                c = np.cos(self._theta0[link])
+                s = np.sin(self._theta0[link])
+                if c == 1.0:
+                    # theta = 0: the rotation about z is the identity
+                    c = s = None
+            else:
+                theta = thetas[:, joint] + self._theta0[link]
+                c = np.cos(theta)
+                s = np.sin(theta)
+                joint += 1
+            ca, sa, a, d = self._ca[link], self._sa[link], self._a[link], self._d[link]
+            if c is None:
+                u, v = X, Y
+            else:
+                u = c * X + s * Y
+                v = c * Y - s * X
+            X = u
+            # d is along the z axis before the alpha twist (Rz Tz Tx Rx)
+            Z_prev = Z
+            if sa == 0.0:
+                Y = v if ca == 1.0 else ca * v
+            else:
+                Y = ca * v + sa * Z
+                Z = ca * Z - sa * v
+            if a != 0.0:
+                p = p + a * u
+            if d != 0.0:
+                p = p + d * Z_prev
+            yield X, Y, Z, p
+
+    def _chunks(self, thetas):
+        # Work through large batches in slices that stay in cache
+        for start in range(0, thetas.shape[0], self.chunk_size):
+            yield start, thetas[start:start + self.chunk_size]
+
+    def frames(self, thetas, degrees=True):
+        """
+        Transforms of every link frame for N joint configurations.
+
+        Parameters:
+          thetas (array): (N, num_joints) joint angles, or a single configuration.
+          degrees (bool): Whether the angles are in degrees.
+
+        Returns:
+          np.ndarray: (N, links + 1, 4, 4) base-to-frame transforms; index 0 is the base.
+        """
+        thetas = self._joint_array(thetas, degrees)
+        out = np.zeros((thetas.shape[0], len(self.table) + 1, 4, 4))
+        out[:, :, 3, 3] = 1.0
+        for start, chunk in self._chunks(thetas):
+            block = out[start:start + chunk.shape[0]]
+            for i, (X, Y, Z, p) in enumerate(self._walk(chunk)):
+                block[:, i, :3, 0] = X.T
+                block[:, i, :3, 1] = Y.T
+                block[:, i, :3, 2] = Z.T
+                block[:, i, :3, 3] = p.T
+        return out
+
+    def forward(self, thetas, degrees=True):
+        """
+        End-effector transforms, shape (N, 4, 4).
+        """
+        thetas = self._joint_array(thetas, degrees)
+        out = np.zeros((thetas.shape[0], 4, 4))
+        out[:, 3, 3] = 1.0
+        for start, chunk in self._chunks(thetas):
+            for X, Y, Z, p in self._walk(chunk):
+                pass
+            block = out[start:start + chunk.shape[0]]
+            block[:, :3, 0] = X.T
+            block[:, :3, 1] = Y.T
+            block[:, :3, 2] = Z.T
+            block[:, :3, 3] = p.T
+        return out
 
-    positions = [T0[:3, 3], T1[:3, 3], T2[:3, 3], T3[:3, 3], T4[:3, 3]]
-    return np.array(positions)
+    def end_position(self, thetas, degrees=True):
+        """
+        End-effector positions only, shape (N, 3). The cheapest query.
+        """
+        thetas = self._joint_array(thetas, degrees)
+        out = np.empty((thetas.shape[0], 3))
+        for start, chunk in self._chunks(thetas):
+            for X, Y, Z, p in self._walk(chunk):
+                pass
+            out[start:start + chunk.shape[0]] = p.T
+        return out
+
+    def positions(self, thetas, degrees=True):
+        """
+        Origins of every frame, shape (N, links + 1, 3).
+        """
+        thetas = self._joint_array(thetas, degrees)
+        out = np.empty((thetas.shape[0], len(self.table) + 1, 3))
+        for start, chunk in self._chunks(thetas):
+            for i, (X, Y, Z, p) in enumerate(self._walk(chunk)):
+                out[start:start + chunk.shape[0], i] = p.T
+        return out
+
+    def jacobian(self, thetas, degrees=True):
+        """
+        Analytic geometric Jacobian of the end effector.
+
+        Returns:
+          np.ndarray: (N, 6, num_joints); rows are linear velocity (length
+          unit per radian) followed by angular velocity.
+        """
+        thetas = self._joint_array(thetas, degrees)
+        J = np.empty((thetas.shape[0], 6, self.num_joints))
+        for start, chunk in self._chunks(thetas):
+            axes = []
+            origins = []
+            for link, (X, Y, Z, p) in enumerate(self._walk(chunk)):
+                # A revolute joint rotates about the z axis of the previous frame
+                if link in self.joint_links:
+                    axes.append(Z)
+                    origins.append(p)
+            block = J[start:start + chunk.shape[0]]
+            for joint, (axis, origin) in enumerate(zip(axes, origins)):
+                r = p - origin
+                block[:, 0, joint] = axis[1] * r[2] - axis[2] * r[1]
+                block[:, 1, joint] = axis[2] * r[0] - axis[0] * r[2]
+                block[:, 2, joint] = axis[0] * r[1] - axis[1] * r[0]
+                block[:, 3:, joint] = axis.T
+        return J
+
+# 3-DOF arm: base yaw, two planar links and a fixed 50 mm end link (mm)
+ARM_DH_TABLE = [
+    (0, 0, 0,      90, True),
+    (0, 0, 102.72, 0,  True),
+    (0, 0, 145,    0,  True),
+    (0, 0, 50,     0,  False),
+]
+ARM = DHChain(ARM_DH_TABLE)
+
+def reference_check(table=None, count=200, seed=0):
+    """
+    Compare DHChain.forward with the product of dh_transform matrices for
+    random joint angles. The default table has rows with both d and alpha
+    nonzero, which the arm's own table never exercises.
+
+    Returns:
+      float: Largest element-wise difference of the 4x4 transforms.
+    """
+    if table is None:
+        table = [(0, 80, 10, 90, True), (0, 5, 102.72, 0, True), (0, 0, 145, -90, True),
+                 (15, 20, 50, 30, False)]
+    chain = DHChain(table)
+    rng = np.random.default_rng(seed)
+    thetas = rng.uniform(-180, 180, (count, chain.num_joints))
+    fast = chain.forward(thetas)
+    worst = 0.0
+    for config, T_fast in zip(thetas, fast):
+        T = np.eye(4)
+        joint = 0
+        for theta, d, a, alpha, revolute in table:
+            if revolute:
+                theta = theta + config[joint]
+                joint += 1
+            T = T @ dh_transform(theta, d, a, alpha)
+        worst = max(worst, np.abs(T - T_fast).max())
+    print(f"DHChain vs dh_transform: {count} configurations, max difference {worst:.2e}")
+    return worst
+
+def forward_kinematics(theta1, theta2, theta3):
+    return ARM.positions([theta1, theta2, theta3])[0]
 
 def plot_arm(joint_positions):
+    import matplotlib.pyplot as plt
+
     xs, ys, zs = joint_positions[:, 0], joint_positions[:, 1], joint_positions[:, 2]
 
     fig = plt.figure()
@@ -41,11 +249,16 @@ def plot_arm(joint_positions):
     ax.view_init(elev=30, azim=135)
     plt.show()
 
-# 👉 Enter your joint angles here (in degrees)
-theta1 = 45   # Base
-theta2 = 45   # Elbow
-theta3 = 90   # Wrist
+if __name__ == "__main__":
+    import sys
+    if "--check" in sys.argv:
+        raise SystemExit(0 if reference_check() < 1e-9 else 1)
+
+    # 👉 Enter your joint angles here (in degrees)
+    theta1 = 45   # Base
+    theta2 = 45   # Elbow
+    theta3 = 90   # Wrist
 
-# Compute and plot
-joint_positions = forward_kinematics(theta1, theta2, theta3)
-plot_arm(joint_positions)
+    # Compute and plot
+    joint_positions = forward_kinematics(theta1, theta2, theta3)
+    plot_arm(joint_positions)
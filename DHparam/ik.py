@@ -0,0 +1,183 @@
+import time
+import numpy as np
+
+try:
+    from .fk import ARM
+except ImportError:
+    from fk import ARM
+
+class IKSolver:
+    """
+    Batched inverse kinematics for the base-yaw + two-planar-link arm.
+
+    A closed-form solution gives both elbow branches; a damped-least-squares
+    (DLS) pass on the full DH chain then refines it, which also covers
+    targets out of reach (converging to the closest reachable point) and any
+    end-link offset the closed form does not model. All angles are in degrees
+    and lengths in the chain's unit (mm), matching fk.py.
+
+    Parameters:
+      chain (DHChain): Arm model; its first link must be the base yaw and the
+        rest must lie in one plane (alpha = 0).
+      elbow (str): Default branch, "up" or "down".
+      damping (float): DLS damping factor in length units.
+      tol (float): Position tolerance for stopping the refinement.
+      max_iter (int): Maximum DLS iterations.
+      limits (array): Optional (num_joints, 2) joint limits in degrees.
+    """
+
+    def __init__(self, chain=ARM, elbow="up", damping=1.0, tol=1e-3, max_iter=20, limits=None):
+        if chain.num_joints != 3 or chain.table[0][3] != 90 or any(row[3] != 0 for row in chain.table[1:]):
+            raise ValueError("IKSolver needs a base yaw joint followed by planar links")
+        self.chain = chain
+        self.elbow = elbow
+        self.damping = damping
+        self.tol = tol
+        self.max_iter = max_iter
+        self.limits = None if limits is None else np.radians(np.asarray(limits, dtype=np.float64))
+        # Planar link lengths: the second joint's link, then everything after
+        # the third joint, which is straight as long as the fixed links have
+        # zero theta
+        self.upper = chain.table[chain.joint_links[1]][2]
+        self.lower = sum(row[2] for row in chain.table[chain.joint_links[2]:])
+        self._last = None
+
+    def _closed_form(self, targets, elbow):
+        x, y, z = targets[:, 0], targets[:, 1], targets[:, 2]
+        L1, L2 = self.upper, self.lower
+        r = np.hypot(x, y)
+        theta1 = np.arctan2(y, x)
+        cos3 = (r * r + z * z - L1 * L1 - L2 * L2) / (2 * L1 * L2)
+        theta3 = np.arccos(np.clip(cos3, -1.0, 1.0))
+        if elbow == "up":
+            theta3 = -theta3
+        theta2 = np.arctan2(z, r) - np.arctan2(L2 * np.sin(theta3), L1 + L2 * np.cos(theta3))
+        return np.stack([theta1, theta2, theta3], axis=1)
+
+    def closed_form(self, targets, elbow=None):
+        """
+        Analytic solution for (N, 3) target positions.
+
+        Returns:
+          np.ndarray: (N, 3) joint angles in degrees for the chosen elbow branch.
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape((-1, 3))
+        return np.degrees(self._closed_form(targets, elbow or self.elbow))
+
+    def _refine(self, targets, thetas, max_iter):
+        eye = np.identity(3) * self.damping ** 2
+        active = np.arange(targets.shape[0])
+        error = targets - self.chain.end_position(thetas, degrees=False)
+        for _ in range(max_iter):
+            norms = np.linalg.norm(error[active], axis=1)
+            active = active[norms > self.tol]
+            if active.size == 0:
+                break
+            J = self.chain.jacobian(thetas[active], degrees=False)[:, :3, :]
+            Jt = np.transpose(J, (0, 2, 1))
+            # dtheta = J^T (J J^T + lambda^2 I)^-1 e
+            step = np.linalg.solve(J @ Jt + eye, error[active][:, :, None])
+            thetas[active] += (Jt @ step)[:, :, 0]
+            if self.limits is not None:
+                thetas[active] = np.clip(thetas[active], self.limits[:, 0], self.limits[:, 1])
+            error[active] = targets[active] - self.chain.end_position(thetas[active], degrees=False)
+        return thetas, np.linalg.norm(error, axis=1)
+
+    def refine(self, targets, thetas, max_iter=None):
+        """
+        Run DLS iterations from the given joint angles (degrees).
+
+        Returns:
+          (thetas, errors): refined (N, 3) angles in degrees and the remaining
+          position error of each target.
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape((-1, 3))
+        thetas = np.radians(np.asarray(thetas, dtype=np.float64).reshape((-1, 3)))
+        thetas, errors = self._refine(targets, thetas, max_iter or self.max_iter)
+        return np.degrees(thetas), errors
+
+    def solve(self, targets, seed=None):
+        """
+        Solve N targets at once.
+
+        Parameters:
+          targets (array): (N, 3) end-effector positions.
+          seed (array): Optional (N, 3) or (3,) joint angles in degrees. When
+            given, each target uses whichever elbow branch is nearer the seed
+            instead of the default branch.
+
+        Returns:
+          (thetas, errors): (N, 3) joint angles in degrees and position errors.
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape((-1, 3))
+        if seed is None:
+            thetas = self._closed_form(targets, self.elbow)
+        else:
+            seed = np.radians(np.broadcast_to(np.asarray(seed, dtype=np.float64), targets.shape))
+            up = self._closed_form(targets, "up")
+            down = self._closed_form(targets, "down")
+            # Wrapped angular distance to the seed
+            dist_up = np.abs(np.angle(np.exp(1j * (up - seed)))).sum(axis=1)
+            dist_down = np.abs(np.angle(np.exp(1j * (down - seed)))).sum(axis=1)
+            thetas = np.where((dist_up <= dist_down)[:, None], up, down)
+            # On the base axis the yaw is arbitrary; keep the seed's
+            on_axis = np.hypot(targets[:, 0], targets[:, 1]) < 1e-9
+            thetas[on_axis, 0] = seed[on_axis, 0]
+        if self.limits is not None:
+            thetas = np.clip(thetas, self.limits[:, 0], self.limits[:, 1])
+        thetas, errors = self._refine(targets, thetas, self.max_iter)
+        return np.degrees(thetas), errors
+
+    def solve_warm(self, target):
+        """
+        Per-frame solve seeded from the previous solution.
+
+        The elbow branch (and the yaw on the base axis) is taken from the last
+        solution, so the arm never flips branch between frames; the DLS pass
+        then only runs when the closed form is not already within tolerance.
+
+        Returns:
+          (thetas, error): (3,) joint angles in degrees and the position error.
+        """
+        thetas, errors = self.solve(np.asarray(target, dtype=np.float64).reshape((1, 3)), seed=self._last)
+        self._last = thetas[0]
+        return self._last, errors[0]
+
+    def reset(self):
+        self._last = None
+
+def round_trip_check(count=10000, seed=0):
+    """
+    Sample reachable joint configurations, run them through FK and back
+    through IK, and report accuracy and throughput.
+    """
+    rng = np.random.default_rng(seed)
+    thetas = np.column_stack([
+        rng.uniform(-180, 180, count),
+        rng.uniform(0, 180, count),
+        rng.uniform(-150, -5, count),
+    ])
+    targets = ARM.end_position(thetas)
+    solver = IKSolver()
+
+    start = time.perf_counter()
+    solution, errors = solver.solve(targets)
+    batch_time = time.perf_counter() - start
+    fk_error = np.linalg.norm(ARM.end_position(solution) - targets, axis=1)
+
+    # Smooth trajectory, as the control loop would see it frame to frame
+    path = ARM.end_position(np.linspace(thetas[0], thetas[1], 500))
+    solver.reset()
+    start = time.perf_counter()
+    warm_errors = [solver.solve_warm(p)[1] for p in path]
+    warm_time = time.perf_counter() - start
+
+    print(f"Batch: {count} targets in {batch_time * 1000:.1f}ms "
+          f"({count / batch_time:,.0f} solves/s)")
+    print(f"FK round trip error: max {fk_error.max():.2e}mm, mean {fk_error.mean():.2e}mm")
+    print(f"Warm start: {warm_time / len(path) * 1e6:.0f}us/solve, "
+          f"max error {max(warm_errors):.2e}mm")
+    return fk_error.max()
+
+if __name__ == "__main__":
+    round_trip_check()
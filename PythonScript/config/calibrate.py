@@ -1,61 +1,177 @@
+#python3 -m config.calibrate --headless --workers 4 --max_error 1.0
+# headless: no preview windows; corners are cached so re-runs only process new images
+
 import numpy as np
 import cv2
 import glob
 import os
+import argparse
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 
-def calibrate_camera():
-    # Chessboard dimensions
-    CHECKERBOARD = (6, 8)  # Number of inner corners per a chessboard row and column (7x9 squares)
-    SQUARE_SIZE = 0.018  # Size of each square in meters (18mm)
+# Chessboard dimensions
+CHECKERBOARD = (6, 8)  # Number of inner corners per a chessboard row and column (7x9 squares)
+SQUARE_SIZE = 0.018  # Size of each square in meters (18mm)
+CACHE_FILE = ".corner_cache.npz"
+# New results between cache saves while detecting, so an interrupted run
+# keeps most of its work
+CACHE_SAVE_EVERY = 10
 
-    # Prepare object points
-    objp = np.zeros((CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
-    objp[:, :2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2) * SQUARE_SIZE
+def image_key(fname):
+    """
+    Cache key for an image: hash of its content and the pattern searched for,
+    so renamed files still hit the cache and edited ones do not.
+    """
+    digest = hashlib.sha1(f"{CHECKERBOARD}".encode())
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-    # Arrays to store object points and image points
-    objpoints = []  # 3D points in real world space
-    imgpoints = []  # 2D points in image plane
+def find_corners(fname):
+    """
+    Detect and refine chessboard corners in one image.
+    Runs in worker processes, so it only takes and returns plain data.
 
-    # Get list of calibration images
-    images = glob.glob('calib_images/*.jpg')
-    print(f"Found {len(images)} calibration images")
+    Returns:
+      (corners, image_size): refined (N, 1, 2) corners, or an empty array if
+      the board was not found, and (width, height); (None, None) if the
+      image could not be read.
+    """
+    img = cv2.imread(fname)
+    if img is None:
+        return None, None
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    if len(images) == 0:
-        print("Error: No images found in calib_images directory!")
-        return
+    # Try different flags for corner detection
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+    ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD, flags=flags)
+    if not ret:
+        return np.zeros((0, 1, 2), np.float32), gray.shape[::-1]
+    corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1),
+                                (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
+    return corners2.reshape(-1, 1, 2), gray.shape[::-1]
 
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+def load_corner_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def save_corner_cache(path, cache):
+    """
+    Write the cache through a temporary file, so a crash while writing
+    leaves the previous cache intact.
+    """
+    temp = path + ".tmp.npz"
+    np.savez(temp, **cache)
+    os.replace(temp, path)
+
+def detect_all(images, workers=None, cache_path=None):
+    """
+    Find corners in every image, reusing cached results.
+
+    Returns:
+      dict: fname -> (corners, image_size) for every readable image.
+    """
+    cache = load_corner_cache(cache_path) if cache_path else {}
+    keys = {fname: image_key(fname) for fname in images}
+    results = {}
+    todo = []
     for fname in images:
-        print(f"\nProcessing {fname}...")
-        img = cv2.imread(fname)
-        if img is None:
-            print(f"Error: Could not read image {fname}")
-            continue
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Try different flags for corner detection
-        flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
-        ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD, flags=flags)
-
-        if ret:
-            print(f"Successfully found corners in {fname}")
-            objpoints.append(objp)
-            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), 
-                                      (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001))
-            imgpoints.append(corners2)
+        key = keys[fname]
+        if key in cache:
+            results[fname] = (cache[key], tuple(int(v) for v in cache[key + "_size"]))
+        else:
+            todo.append(fname)
+    print(f"{len(images) - len(todo)} image(s) cached, {len(todo)} to process")
+
+    if not todo:
+        return results
+    unsaved = 0
+    pool = contextlib.nullcontext() if workers == 1 else ProcessPoolExecutor(max_workers=workers,
+                                                                             initializer=_init_worker)
+    try:
+        with pool:
+            if workers == 1:
+                found = map(find_corners, todo)
+            else:
+                found = pool.map(find_corners, todo,
+                                 chunksize=max(1, len(todo) // (4 * (workers or os.cpu_count() or 1))))
+            for fname, (corners, size) in zip(todo, found):
+                if corners is None:
+                    print(f"Error: Could not read image {fname}")
+                    continue
+                print(f"{'Successfully found' if len(corners) else 'Failed to find'} corners in {fname}")
+                results[fname] = (corners, size)
+                cache[keys[fname]] = corners
+                cache[keys[fname] + "_size"] = np.array(size)
+                unsaved += 1
+                if cache_path and unsaved >= CACHE_SAVE_EVERY:
+                    save_corner_cache(cache_path, cache)
+                    unsaved = 0
+    finally:
+        # Also when interrupted: keep whatever was found
+        if cache_path and unsaved:
+            save_corner_cache(cache_path, cache)
+    return results
 
+def show_results(results):
+    """
+    Display each image with its detected corners, as the interactive mode did.
+    """
+    for fname, (corners, size) in results.items():
+        img = cv2.imread(fname)
+        if len(corners):
             # Draw and display the corners
-            img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners2, ret)
+            img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners, True)
             cv2.imshow('Corners', img)
             cv2.waitKey(500)  # Show each image for 500ms
         else:
-            print(f"Failed to find corners in {fname}")
             # Show the image that failed
             cv2.imshow('Failed Image', img)
             cv2.waitKey(1000)  # Show for 1 second
-
     cv2.destroyAllWindows()
 
+def per_image_errors(objpoints, imgpoints, mtx, dist, rvecs, tvecs):
+    """
+    RMS reprojection error of every view, in pixels.
+    """
+    errors = []
+    for objp, imgp, rvec, tvec in zip(objpoints, imgpoints, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        errors.append(np.sqrt(np.mean(np.sum((projected - imgp) ** 2, axis=2))))
+    return np.array(errors)
+
+def calibrate_camera(pattern='calib_images/*.jpg', headless=False, workers=None, use_cache=True,
+                     max_error=None, output='calibration.npz'):
+    # Prepare object points
+    objp = np.zeros((CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2) * SQUARE_SIZE
+
+    # Get list of calibration images
+    images = sorted(glob.glob(pattern))
+    print(f"Found {len(images)} calibration images")
+
+    if len(images) == 0:
+        print("Error: No images found in calib_images directory!")
+        return
+
+    cache_path = os.path.join(os.path.dirname(images[0]), CACHE_FILE) if use_cache else None
+    results = detect_all(images, workers, cache_path)
+    if not headless:
+        show_results(results)
+
+    # Arrays to store object points and image points
+    names = [fname for fname, (corners, size) in results.items() if len(corners)]
+    imgpoints = [results[fname][0] for fname in names]  # 2D points in image plane
+    objpoints = [objp] * len(names)  # 3D points in real world space
+
     if len(objpoints) == 0:
         print("\nNo calibration images were successfully processed!")
         print("Common issues:")
@@ -66,12 +182,34 @@ def calibrate_camera():
         print("5. Verify that the pattern is not blurry")
         return
 
-    # Calibrate camera
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
+    image_size = results[names[0]][1]
+
+    # Calibrate camera, dropping outlier views and re-solving from the same corners
+    while True:
+        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+        errors = per_image_errors(objpoints, imgpoints, mtx, dist, rvecs, tvecs)
+
+        print(f"\nRMS reprojection error: {ret:.3f}px over {len(names)} images")
+        print("Per-image reprojection error (worst first):")
+        for i in np.argsort(errors)[::-1]:
+            print(f"  {errors[i]:.3f}px  {names[i]}")
+
+        if max_error is None or errors.max() <= max_error:
+            break
+        keep = errors <= max_error
+        if keep.sum() < 3:
+            print(f"\nOnly {keep.sum()} image(s) within {max_error}px; keeping all of them")
+            break
+        dropped = [name for name, k in zip(names, keep) if not k]
+        print(f"\nDropping {len(dropped)} image(s) above {max_error}px and re-solving: {', '.join(dropped)}")
+        names = [name for name, k in zip(names, keep) if k]
+        imgpoints = [p for p, k in zip(imgpoints, keep) if k]
+        objpoints = objpoints[:len(names)]
 
     # Save calibration parameters
-    np.savez('calibration.npz', mtx=mtx, dist=dist)
-    print("\nCalibration completed and saved to calibration.npz")
+    # The resolution lets CameraCalibration rescale for other capture sizes
+    np.savez(output, mtx=mtx, dist=dist, size=np.array(image_size))
+    print(f"\nCalibration completed and saved to {output}")
 
     # Print calibration results
     print("\nCamera Matrix:")
@@ -80,4 +218,19 @@ def calibrate_camera():
     print(dist)
 
 if __name__ == "__main__":
-    calibrate_camera() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chessboard camera calibration.")
+    parser.add_argument('--images', type=str, default='calib_images/*.jpg',
+                        help="Glob pattern of calibration images (default: calib_images/*.jpg).")
+    parser.add_argument('--headless', action='store_true',
+                        help="Do not display detected corners.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Corner detection processes (default: one per CPU, 1 = no pool).")
+    parser.add_argument('--no_cache', action='store_true',
+                        help="Ignore and do not update the per-image corner cache.")
+    parser.add_argument('--max_error', type=float, default=None,
+                        help="Drop images whose reprojection error exceeds this many pixels and re-solve.")
+    parser.add_argument('--output', type=str, default='calibration.npz',
+                        help="Output calibration file (default: calibration.npz).")
+    args = parser.parse_args()
+    calibrate_camera(args.images, args.headless, args.workers, not args.no_cache,
+                     args.max_error, args.output)
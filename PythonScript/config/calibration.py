@@ -1,3 +1,6 @@
+import os
+import cv2
+import hashlib
 import numpy as np
 
 def load_calibration(filepath="calibration.npz"):
@@ -9,3 +12,208 @@ def load_calibration(filepath="calibration.npz"):
     mtx = data['mtx']
     dist = data['dist']
     return mtx, dist
+
+# Offsets of the 4 pixels around a point, for bilinear lookups
+_NEIGHBOUR_DX = np.array([0, 1, 0, 1])
+_NEIGHBOUR_DY = np.array([0, 0, 1, 1])
+
+def scale_camera_matrix(mtx, scale_x, scale_y):
+    """
+    Intrinsics of the same camera when its images are resized by
+    (scale_x, scale_y), with pixel centers at integer coordinates.
+    """
+    mtx = np.array(mtx, dtype=np.float64)
+    mtx[0, 0] *= scale_x
+    mtx[1, 1] *= scale_y
+    mtx[0, 1] *= scale_x
+    mtx[0, 2] = (mtx[0, 2] + 0.5) * scale_x - 0.5
+    mtx[1, 2] = (mtx[1, 2] + 0.5) * scale_y - 0.5
+    return mtx
+
+class CameraCalibration:
+    """
+    Camera intrinsics together with the resolution they were calibrated at.
+
+    scaled() gives the calibration for any frame size (capture mode, or a
+    frame upscaled for detection) by rescaling the camera matrix, so poses
+    stay right whatever the detector was fed. Distortion is handled by
+    undistorting tag corners only (undistort_points), through a lookup
+    table computed once at the calibrated resolution and shared by all
+    scaled copies. Full-frame undistortion maps are only built if asked for
+    (e.g. for display).
+
+    Tables are cached as .npy files in `<calibration file>.cache/` and
+    memory-mapped on later runs, so startup does not pay for them again.
+
+    Parameters:
+      camera_matrix (np.ndarray): 3x3 intrinsics at `image_size`.
+      dist_coeffs (np.ndarray): Distortion coefficients (or None).
+      image_size (tuple): (width, height) the intrinsics belong to.
+      cache_dir (str): Where lookup tables are cached (None: memory only).
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, image_size, cache_dir=None):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = None if dist_coeffs is None else np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self.image_size = (int(image_size[0]), int(image_size[1]))
+        self.cache_dir = cache_dir
+        self._parent = None
+        self._scale = (1.0, 1.0)
+        self._scaled = {}
+        self._lut = None
+        self._maps = None
+
+    def __getstate__(self):
+        # Tables are left out: a copy sent to another process maps them from
+        # the cache again instead of pickling megabytes
+        state = dict(self.__dict__)
+        state.update(_lut=None, _maps=None, _scaled={})
+        return state
+
+    @classmethod
+    def load(cls, filepath="calibration.npz", default_size=None):
+        """
+        Load a calibration file written by config.calibrate. Files from
+        before the resolution was saved need `default_size`, the capture
+        size they were made at.
+        """
+        data = np.load(filepath)
+        if "size" in data:
+            size = tuple(int(v) for v in data["size"])
+        elif default_size is not None:
+            size = tuple(default_size)
+            print(f"Calibration {filepath} has no resolution; assuming {size[0]}x{size[1]}")
+        else:
+            raise ValueError(f"Calibration {filepath} has no resolution; recalibrate or give the capture size")
+        return cls(data["mtx"], data["dist"], size, cache_dir=filepath + ".cache")
+
+    def save(self, filepath):
+        np.savez(filepath, mtx=self.camera_matrix, dist=self.dist_coeffs, size=np.array(self.image_size))
+
+    @property
+    def has_distortion(self):
+        return self.dist_coeffs is not None and np.any(self.dist_coeffs != 0)
+
+    def _root(self):
+        return self if self._parent is None else self._parent
+
+    def scaled(self, size):
+        """
+        The calibration for frames of `size` (width, height). Cached, so
+        calling it every frame is cheap.
+        """
+        size = (int(size[0]), int(size[1]))
+        root = self._root()
+        if size == root.image_size:
+            return root
+        scaled = root._scaled.get(size)
+        if scaled is None:
+            scale_x = size[0] / root.image_size[0]
+            scale_y = size[1] / root.image_size[1]
+            if abs(scale_x - scale_y) > 0.01 * max(scale_x, scale_y):
+                print(f"Warning: {size[0]}x{size[1]} has a different aspect ratio than the calibration "
+                      f"({root.image_size[0]}x{root.image_size[1]}); the capture mode probably crops")
+            scaled = CameraCalibration(scale_camera_matrix(root.camera_matrix, scale_x, scale_y),
+                                       root.dist_coeffs, size, root.cache_dir)
+            scaled._parent = root
+            scaled._scale = (scale_x, scale_y)
+            root._scaled[size] = scaled
+        return scaled
+
+    def _key(self, kind):
+        digest = hashlib.sha1(self.camera_matrix.tobytes())
+        if self.dist_coeffs is not None:
+            digest.update(self.dist_coeffs.tobytes())
+        return f"{kind}_{self.image_size[0]}x{self.image_size[1]}_{digest.hexdigest()[:10]}.npy"
+
+    def _cached(self, kind, build):
+        """
+        Load a table from the cache (memory-mapped) or build and store it.
+        """
+        path = os.path.join(self.cache_dir, self._key(kind)) if self.cache_dir else None
+        if path is not None and os.path.exists(path):
+            try:
+                # Plain ndarray view of the mapping: memmap indexing is slower
+                return np.asarray(np.load(path, mmap_mode="r"))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable calibration cache {path}: {e}")
+        table = build()
+        if path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                np.save(path, table)
+            except OSError as e:
+                print(f"Could not cache {path}: {e}")
+        return table
+
+    def _build_lut(self):
+        width, height = self.image_size
+        grid = np.mgrid[0:height, 0:width][::-1].transpose(1, 2, 0).reshape((-1, 1, 2)).astype(np.float64)
+        # Many more iterations than undistortPoints' default, so strong
+        # distortion near the edges is still inverted accurately
+        criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 50, 1e-6)
+        if hasattr(cv2, "undistortPointsIter"):
+            points = cv2.undistortPointsIter(grid, self.camera_matrix, self.dist_coeffs, None,
+                                             self.camera_matrix, criteria)
+        else:
+            # OpenCV 5 folded the criteria into undistortPoints
+            points = cv2.undistortPoints(grid, self.camera_matrix, self.dist_coeffs, None, None,
+                                         self.camera_matrix, criteria)
+        return points.reshape((height, width, 2)).astype(np.float32)
+
+    def point_lut(self):
+        """
+        (height, width, 2) table of the undistorted position of every pixel
+        at the calibrated resolution.
+        """
+        root = self._root()
+        if root._lut is None:
+            root._lut = root._cached("lut", root._build_lut)
+        return root._lut
+
+    def undistort_points(self, points):
+        """
+        Undistort pixel coordinates (e.g. the 4 corners of a tag) of a frame
+        of this calibration's size. The result is in the same pixel frame,
+        to be used with camera_matrix and no distortion coefficients.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        if not self.has_distortion:
+            return points
+        lut = self.point_lut()
+        scale = np.array(self._scale)
+        # Position in the calibrated image, then a bilinear lookup
+        source = (points + 0.5) / scale - 0.5
+        base = np.floor(source)
+        fx, fy = np.hsplit(source - base, 2)
+        base = base.astype(np.intp)
+        height, width = lut.shape[:2]
+        inside = (base >= 0).all(axis=1) & (base[:, 0] < width - 1) & (base[:, 1] < height - 1)
+        base[~inside] = 0
+        weights = np.hstack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy])
+        neighbours = lut[base[:, 1:2] + _NEIGHBOUR_DY, base[:, 0:1] + _NEIGHBOUR_DX]
+        result = (np.einsum("nk,nkc->nc", weights, neighbours) + 0.5) * scale - 0.5
+        if not inside.all():
+            # Off the table (e.g. a corner extrapolated past the frame edge)
+            outside = points[~inside].reshape((-1, 1, 2))
+            result[~inside] = cv2.undistortPoints(outside, self.camera_matrix, self.dist_coeffs,
+                                                  P=self.camera_matrix).reshape((-1, 2))
+        return result
+
+    def undistort_maps(self):
+        """
+        initUndistortRectifyMap tables for frames of this size, built on
+        first use. Only for display or offline use; detection never remaps
+        whole frames.
+        """
+        if self._maps is None:
+            def build():
+                map_x, map_y = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                           self.camera_matrix, self.image_size, cv2.CV_32FC1)
+                return np.stack([map_x, map_y])
+            self._maps = self._cached("maps", build)
+        return self._maps
+
+    def undistort_image(self, image):
+        maps = self.undistort_maps()
+        return cv2.remap(image, np.asarray(maps[0]), np.asarray(maps[1]), cv2.INTER_LINEAR)
@@ -1,47 +1,445 @@
 # capture_calib.py
-from picamera2 import Picamera2
+#python3 -m config.capture_calib --source 0   (any src.main --source; default: Pi camera)
+#python3 -m config.capture_calib --auto --coverage 0.8 --poses 8   (saves useful views by itself)
 import cv2
+import re
 import time
 import os
+import argparse
+import threading
 import numpy as np
+from src.capture import open_source
+from src.pipeline import LatestBuffer
+from config.calibrate import CHECKERBOARD, CACHE_FILE, find_corners, image_key
+from config.calibrate import load_corner_cache, save_corner_cache
 
-# Create directory for calibration images if it doesn't exist.
-os.makedirs("calib_images", exist_ok=True)
-
-# Initialize camera
-picam2 = Picamera2()
-config = picam2.create_preview_configuration()
-picam2.configure(config)
-picam2.start()
-time.sleep(2)  # Let the camera adjust
-
-print("Starting calibration capture...")
-print("Press SPACE to capture an image")
-print("Press Q to quit")
-
-image_count = 1
-while True:
-    # Capture frame
-    frame = picam2.capture_array()
-    
-    # Convert from RGB to BGR for OpenCV
-    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-    
-    # Display the frame
-    cv2.imshow('Calibration Capture (Press SPACE to capture, Q to quit)', frame)
-    
-    # Wait for key press
-    key = cv2.waitKey(1) & 0xFF
-    
-    if key == ord('q'):  # Quit
-        break
-    elif key == ord(' '):  # Space bar to capture
-        filename = f"calib_images/image{image_count:02d}.jpg"
+WINDOW_NAME = 'Calibration Capture (Press SPACE to capture, Q to quit)'
+AUTO_WINDOW_NAME = 'Calibration Auto-Capture (Q to quit)'
+# Board tilt (relative difference of opposite sides) beyond which a view counts as tilted
+TILT_THRESHOLD = 0.08
+# The fast board check stops finding boards whose squares are under ~12 px
+# in the decimated frame, so decimation aims for this square size and never
+# goes below MIN_CHECK_SCALE
+CHECK_SQUARE = 16.0
+MIN_CHECK_SCALE = 0.5
+
+def next_image_index(directory):
+    """
+    Number after the highest imageNN.jpg already in the directory, so new
+    captures never overwrite earlier ones.
+    """
+    numbers = [int(m.group(1)) for m in (re.match(r"image(\d+)\.jpg$", name) for name in os.listdir(directory)) if m]
+    return max(numbers, default=0) + 1
+
+class CoverageTracker:
+    """
+    Which parts of the image plane and which board poses the saved views
+    cover.
+
+    The image is split into a grid of cells; a view covers the cells under
+    the board. Poses are binned by the board's apparent tilt about both axes
+    (left/right and top/bottom side length ratios) and its size, which needs
+    no intrinsics.
+
+    Parameters:
+      image_size (tuple): (width, height) of the frames.
+      grid (tuple): Coverage cells across and down.
+    """
+
+    def __init__(self, image_size, grid=(8, 6)):
+        self.image_size = image_size
+        self.grid = grid
+        self.counts = np.zeros((grid[1], grid[0]), dtype=np.int32)
+        self.pose_bins = set()
+        self.views = 0
+
+    def cells(self, corners):
+        """
+        Boolean grid of the cells the board outline covers.
+        """
+        mask = np.zeros((self.grid[1], self.grid[0]), dtype=np.uint8)
+        scale = np.array([self.grid[0] / self.image_size[0], self.grid[1] / self.image_size[1]])
+        outline = cv2.convexHull(corners.reshape((-1, 2)).astype(np.float32)).reshape((-1, 2))
+        # Fixed point coordinates, so partly covered cells count
+        points = np.round(outline * scale * 16).astype(np.int32)
+        cv2.fillConvexPoly(mask, points, 1, lineType=cv2.LINE_8, shift=4)
+        return mask.astype(bool)
+
+    def pose_bin(self, corners):
+        """
+        (tilt left/right, tilt up/down, size) bin of a view, each tilt in
+        {-1, 0, 1} and size 0 (small) or 1 (large).
+        """
+        grid = corners.reshape((CHECKERBOARD[1], CHECKERBOARD[0], 2))
+        left = np.linalg.norm(grid[-1, 0] - grid[0, 0])
+        right = np.linalg.norm(grid[-1, -1] - grid[0, -1])
+        top = np.linalg.norm(grid[0, -1] - grid[0, 0])
+        bottom = np.linalg.norm(grid[-1, -1] - grid[-1, 0])
+        tilt_x = (right - left) / (right + left)
+        tilt_y = (bottom - top) / (bottom + top)
+        area = cv2.contourArea(cv2.convexHull(corners.reshape((-1, 2)).astype(np.float32)))
+        large = area > 0.15 * self.image_size[0] * self.image_size[1]
+
+        def level(tilt):
+            return 0 if abs(tilt) < TILT_THRESHOLD else int(np.sign(tilt))
+        return level(tilt_x), level(tilt_y), int(large)
+
+    def novelty(self, corners):
+        """
+        (new cells, new pose bin) a view would add.
+        """
+        new_cells = int(np.count_nonzero(self.cells(corners) & (self.counts == 0)))
+        return new_cells, self.pose_bin(corners) not in self.pose_bins
+
+    def add(self, corners):
+        self.counts += self.cells(corners)
+        self.pose_bins.add(self.pose_bin(corners))
+        self.views += 1
+
+    @property
+    def coverage(self):
+        return np.count_nonzero(self.counts) / self.counts.size
+
+    def done(self, coverage, poses):
+        return self.coverage >= coverage and len(self.pose_bins) >= poses
+
+    def draw(self, frame):
+        """
+        Tint the covered cells of a BGR frame, darker for fewer views.
+        """
+        height, width = frame.shape[:2]
+        overlay = frame.copy()
+        for row in range(self.grid[1]):
+            for col in range(self.grid[0]):
+                x0, x1 = col * width // self.grid[0], (col + 1) * width // self.grid[0]
+                y0, y1 = row * height // self.grid[1], (row + 1) * height // self.grid[1]
+                if self.counts[row, col]:
+                    level = min(255, 80 + 60 * int(self.counts[row, col]))
+                    cv2.rectangle(overlay, (x0, y0), (x1, y1), (0, level, 0), -1)
+                cv2.rectangle(frame, (x0, y0), (x1, y1), (80, 80, 80), 1)
+        return cv2.addWeighted(overlay, 0.3, frame, 0.7, 0)
+
+def sharpness(gray, corners):
+    """
+    Variance of the Laplacian over the board's bounding box: low for
+    blurred (moving or out of focus) views.
+    """
+    x, y, w, h = cv2.boundingRect(corners.reshape((-1, 2)).astype(np.float32))
+    region = gray[max(0, y):y + h, max(0, x):x + w]
+    if region.size == 0:
+        return 0.0
+    return float(cv2.Laplacian(region, cv2.CV_64F).var())
+
+def square_size(corners):
+    """
+    Median spacing of neighbouring inner corners, in pixels.
+    """
+    grid = corners.reshape((CHECKERBOARD[1], CHECKERBOARD[0], 2))
+    across = np.linalg.norm(np.diff(grid, axis=1), axis=2).ravel()
+    down = np.linalg.norm(np.diff(grid, axis=0), axis=2).ravel()
+    return float(np.median(np.concatenate([across, down])))
+
+class AutoCapture:
+    """
+    Background chessboard checker that saves useful views by itself.
+
+    The newest frame is checked on its own thread: a fast chessboard search
+    (CALIB_CB_FAST_CHECK) on a decimated copy, so frames without a board are
+    rejected in a few milliseconds, then sub-pixel corners at full size. The
+    decimation follows the last board found (squares of about CHECK_SQUARE
+    pixels, never below MIN_CHECK_SCALE), and every few misses the search
+    runs at full size so a board too small for the current scale is still
+    picked up. A
+    view is saved when it is sharp, the board holds still, and it covers new
+    grid cells or a new pose bin. Saved images are run through
+    config.calibrate's corner search right away and the result cached, so
+    calibrate only has to solve.
+
+    Parameters:
+      directory (str): Where images are saved (imageNN.jpg).
+      image_size (tuple): (width, height) of the frames.
+      grid (tuple): Coverage cells across and down.
+      coverage (float): Fraction of cells to cover before stopping.
+      poses (int): Distinct pose bins to fill before stopping.
+      max_images (int): Stop after this many images regardless.
+      check_width (int): Width the fast search starts at, until a board is
+        found; bounded below by MIN_CHECK_SCALE of the frame width.
+      full_check_every (int): Search the full-size frame on the first
+        decimated miss and then every this many misses in a row (0 to
+        never).
+      min_sharpness (float): Minimum Laplacian variance over the board.
+      max_motion (float): Maximum mean corner motion since the previous
+        check, in pixels.
+      min_new_cells (int): Cells a view must newly cover when its pose bin
+        is not new.
+      min_interval (float): Seconds between saves.
+    """
+
+    def __init__(self, directory, image_size, grid=(8, 6), coverage=0.8, poses=8, max_images=40,
+                 check_width=320, full_check_every=5, min_sharpness=50.0, max_motion=2.0, min_new_cells=2,
+                 min_interval=0.5):
+        self.directory = directory
+        self.tracker = CoverageTracker(image_size, grid)
+        self.target_coverage = coverage
+        self.target_poses = poses
+        self.max_images = max_images
+        self.scale = min(1.0, max(MIN_CHECK_SCALE, check_width / image_size[0]))
+        self.full_check_every = full_check_every
+        self.misses = 0
+        self.min_sharpness = min_sharpness
+        self.max_motion = max_motion
+        self.min_new_cells = min_new_cells
+        self.min_interval = min_interval
+        self.index = next_image_index(directory)
+        self.saved = []
+        self.checked = 0
+        self.found = 0
+        self.status = "Show the chessboard"
+        self.corners = None
+        self.cache_path = os.path.join(directory, CACHE_FILE)
+        self._cache = {}
+        self._previous = None
+        self._last_save = 0.0
+        self._frames = LatestBuffer(1)
+        self._stop = threading.Event()
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="calib-check", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """
+        Offer a BGR frame (copied, capture buffers are reused).
+        """
+        self._frames.put(frame.copy())
+
+    def _search(self, gray, scale):
+        small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+        found, corners = cv2.findChessboardCorners(small, CHECKERBOARD, flags=flags)
+        if not found:
+            return None
+        # Back to full-size pixel centres
+        return ((corners.reshape((-1, 1, 2)) + 0.5) / scale - 0.5).astype(np.float32)
+
+    def _find(self, gray):
+        corners = self._search(gray, self.scale)
+        if corners is None and self.scale < 1.0:
+            self.misses += 1
+            # Right after losing the board (it may just have moved away), then every few misses
+            if self.full_check_every and (self.misses == 1 or self.misses % self.full_check_every == 0):
+                corners = self._search(gray, 1.0)
+        if corners is None:
+            return None
+        self.misses = 0
+        # Decimate next time so the board's squares stay findable
+        self.scale = float(np.clip(CHECK_SQUARE / square_size(corners), MIN_CHECK_SCALE, 1.0))
+        return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1),
+                                (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)).reshape((-1, 1, 2))
+
+    def _check(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.checked += 1
+        corners = self._find(gray)
+        previous, self._previous = self._previous, corners
+        self.corners = corners
+        if corners is None:
+            self.status = "No board"
+            return
+        self.found += 1
+        motion = np.inf if previous is None else float(np.mean(np.linalg.norm(corners - previous, axis=2)))
+        if motion > self.max_motion:
+            self.status = "Hold still"
+            return
+        focus = sharpness(gray, corners)
+        if focus < self.min_sharpness:
+            self.status = f"Blurry ({focus:.0f} < {self.min_sharpness:.0f})"
+            return
+        new_cells, new_pose = self.tracker.novelty(corners)
+        if not new_pose and new_cells < self.min_new_cells:
+            self.status = "Already covered: move or tilt the board"
+            return
+        if time.monotonic() - self._last_save < self.min_interval:
+            return
+        self._save(frame, corners)
+
+    def _save(self, frame, corners):
+        filename = os.path.join(self.directory, f"image{self.index:02d}.jpg")
         cv2.imwrite(filename, frame)
-        print(f"Saved {filename}")
-        image_count += 1
-        time.sleep(0.5)  # Small delay between captures
+        # The same search calibrate runs, on the saved (compressed) image
+        found, size = find_corners(filename)
+        if found is None or not len(found):
+            os.remove(filename)
+            self.status = "Board lost in the saved image; try again"
+            return
+        key = image_key(filename)
+        self._cache[key] = found
+        self._cache[key + "_size"] = np.array(size)
+        self.tracker.add(corners)
+        self.saved.append(filename)
+        self.index += 1
+        self._last_save = time.monotonic()
+        self.status = f"Saved {filename}"
+        print(f"Saved {filename}: coverage {self.tracker.coverage:.0%}, "
+              f"{len(self.tracker.pose_bins)} pose bins")
+        if self.tracker.done(self.target_coverage, self.target_poses) or len(self.saved) >= self.max_images:
+            self.finished.set()
+
+    def _run(self):
+        while not self._stop.is_set() and not self.finished.is_set():
+            frame = self._frames.get(timeout=0.1)
+            if frame is None:
+                continue
+            try:
+                self._check(frame)
+            except Exception as e:
+                print(f"Error in calibration check: {e}")
+
+    def progress(self):
+        return (f"{len(self.saved)} saved, coverage {self.tracker.coverage:.0%}/{self.target_coverage:.0%}, "
+                f"poses {len(self.tracker.pose_bins)}/{self.target_poses}")
+
+    def draw(self, frame):
+        frame = self.tracker.draw(frame)
+        corners = self.corners
+        if corners is not None:
+            cv2.drawChessboardCorners(frame, CHECKERBOARD, corners, True)
+        cv2.putText(frame, self.progress(), (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        cv2.putText(frame, self.status, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        return frame
+
+    def close(self):
+        """
+        Stop checking and add the corners of the saved images to
+        config.calibrate's cache.
+        """
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        if self._cache:
+            cache = load_corner_cache(self.cache_path)
+            cache.update(self._cache)
+            save_corner_cache(self.cache_path, cache)
+
+def capture_manual(camera, directory):
+    print("Press SPACE to capture an image")
+    print("Press Q to quit")
+
+    image_count = next_image_index(directory)
+    saved = 0
+    while True:
+        # Capture frame
+        frame = camera.read()
+        if frame is None:
+            break
+
+        # Convert from RGB to BGR for OpenCV
+        rgb, frame = frame, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        camera.release(rgb)
+
+        # Display the frame
+        cv2.imshow(WINDOW_NAME, frame)
+
+        # Wait for key press
+        key = cv2.waitKey(1) & 0xFF
+
+        if key == ord('q'):  # Quit
+            break
+        elif key == ord(' '):  # Space bar to capture
+            filename = os.path.join(directory, f"image{image_count:02d}.jpg")
+            cv2.imwrite(filename, frame)
+            print(f"Saved {filename}")
+            image_count += 1
+            saved += 1
+            time.sleep(0.5)  # Small delay between captures
+    return saved
+
+def capture_auto(camera, directory, args, headless=False):
+    frame = camera.read()
+    if frame is None:
+        return 0
+    height, width = frame.shape[:2]
+    auto = AutoCapture(directory, (width, height), grid=tuple(args.grid), coverage=args.coverage,
+                       poses=args.poses, max_images=args.max_images, check_width=args.check_width,
+                       full_check_every=args.full_check_every,
+                       min_sharpness=args.min_sharpness, max_motion=args.max_motion)
+    print(f"Auto-capture until {args.coverage:.0%} of the {args.grid[0]}x{args.grid[1]} grid and "
+          f"{args.poses} pose bins are covered (Q or Ctrl+C to stop)")
+    last_print = time.monotonic()
+    try:
+        while not auto.finished.is_set():
+            rgb, frame = frame, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            camera.release(rgb)
+            auto.submit(frame)
+            if headless:
+                if time.monotonic() - last_print >= 2.0:
+                    last_print = time.monotonic()
+                    print(f"{auto.progress()} - {auto.status}")
+            else:
+                cv2.imshow(AUTO_WINDOW_NAME, auto.draw(frame))
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            frame = camera.read()
+            if frame is None:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        auto.close()
+    print(f"Auto-capture: {auto.progress()}; {auto.found} of {auto.checked} checked frames had a board")
+    if auto.finished.is_set():
+        print("Coverage targets met")
+    return len(auto.saved)
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture chessboard images for calibration.")
+    parser.add_argument('--source', type=str, default="pi",
+                        help="Frame source, as for src.main (default: pi).")
+    parser.add_argument('--size', type=int, nargs=2, default=(640, 480),
+                        help="Capture size (default: 640 480, the Picamera2 preview default).")
+    parser.add_argument('--output_dir', type=str, default="calib_images",
+                        help="Directory for the images (default: calib_images).")
+    parser.add_argument('--auto', action='store_true',
+                        help="Save sharp views with new coverage automatically instead of on SPACE.")
+    parser.add_argument('--grid', type=int, nargs=2, default=(8, 6),
+                        help="Auto: coverage grid cells across and down (default: 8 6).")
+    parser.add_argument('--coverage', type=float, default=0.8,
+                        help="Auto: fraction of grid cells to cover before stopping (default: 0.8).")
+    parser.add_argument('--poses', type=int, default=8,
+                        help="Auto: distinct pose bins (tilt left/right x up/down x size, 18 in all) "
+                             "to fill before stopping (default: 8).")
+    parser.add_argument('--max_images', type=int, default=40,
+                        help="Auto: stop after this many images (default: 40).")
+    parser.add_argument('--check_width', type=int, default=320,
+                        help="Auto: width of the decimated frame the fast board check starts at, at least "
+                             "half the frame width; afterwards it follows the board's size (default: 320).")
+    parser.add_argument('--full_check_every', type=int, default=5,
+                        help="Auto: check at full size on the first miss on the decimated frame and then "
+                             "every this many misses (0: never, default: 5).")
+    parser.add_argument('--min_sharpness', type=float, default=50.0,
+                        help="Auto: minimum Laplacian variance over the board (default: 50).")
+    parser.add_argument('--max_motion', type=float, default=2.0,
+                        help="Auto: maximum board motion between checks in pixels (default: 2).")
+    parser.add_argument('--headless', action='store_true',
+                        help="Auto: no preview window, print progress instead.")
+    args = parser.parse_args()
+
+    # Create directory for calibration images if it doesn't exist.
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Initialize camera
+    camera = open_source(args.source, gray=False, size=tuple(args.size))
+    time.sleep(2)  # Let the camera adjust
+
+    print("Starting calibration capture...")
+    try:
+        if args.auto:
+            saved = capture_auto(camera, args.output_dir, args, args.headless)
+        else:
+            saved = capture_manual(camera, args.output_dir)
+    finally:
+        camera.close()
+        if not args.headless:
+            cv2.destroyAllWindows()
+    print(f"\nCalibration capture complete. Saved {saved} images.")
 
-picam2.stop()
-cv2.destroyAllWindows()
-print(f"\nCalibration capture complete. Saved {image_count-1} images.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+#python3 -m src.autotune --synthetic 150 --output detector.json
+#python3 -m src.autotune --frames recordings/run1 --calib calibration.npz --min_recall 0.98 --max_error_mm 10
+#python3 -m src.autotune --video test.mp4 --grid quad_decimate=1,1.5,2 --grid num_threads=1,2,4
+# sweeps detector settings over a frame set and keeps the fastest one that still meets the recall and
+# pose error budget; run it on the robot's own computer, then: python3 -m src.main --detector_config detector.json
+
+import cv2
+import os
+import json
+import time
+import itertools
+import platform
+import argparse
+import numpy as np
+from .detector import (create_detector, detect_tags, to_gray, get_detection_corners, PoseEstimator,
+                       PNP_METHODS, load_detector_config, detector_config,
+                       parse_detector_setting)
+from .benchmark import (load_directory, load_video, synthetic_frames, summarize, rotation_error,
+                        git_commit)
+from .synthetic import DEFAULT_CAMERA_MATRIX
+
+# Settings swept by default, roughly in order of their effect on frame rate
+DEFAULT_GRID = {
+    "quad_decimate": [1.0, 1.5, 2.0, 3.0, 4.0],
+    "num_threads": [n for n in (1, 2, 4) if n <= (os.cpu_count() or 1)],
+    "quad_sigma": [0.0, 0.8],
+    "refine_edges": [True, False],
+    "decode_sharpening": [0.25, 0.5],
+}
+# Most thorough settings: ground truth for frames without any
+REFERENCE_SETTINGS = {"quad_decimate": 1.0, "refine_edges": True}
+
+def parse_grid_axis(text):
+    """
+    Parse a command line "name=v1,v2,..." grid axis into (name, [values]).
+    """
+    name, _, values = text.partition("=")
+    parsed = [parse_detector_setting(f"{name}={value}") for value in values.split(",") if value.strip()]
+    if not parsed:
+        raise ValueError(f"No values in grid axis '{text}'")
+    return parsed[0][0], [value for _, value in parsed]
+
+def candidate_settings(grid, base):
+    """
+    Every combination of the grid values on top of the fixed `base`
+    settings, the ones expected to run fastest first so the time limit
+    prunes the rest early.
+    """
+    names = list(grid)
+    candidates = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        settings = dict(base)
+        settings.update(zip(names, values))
+        candidates.append(settings)
+    candidates.sort(key=lambda s: (-s.get("quad_decimate", 2.0), -s.get("num_threads", 1)))
+    return candidates
+
+def reference_truth(frames, detector, estimator):
+    """
+    Poses found by the reference detector, standing in for ground truth on
+    recorded frames.
+    """
+    truth = {}
+    for name, gray, _ in frames:
+        poses = {}
+        for detection in detect_tags(gray, detector):
+            rvec, tvec, _ = estimator.solve(detection.getId(), get_detection_corners(detection))
+            if rvec is not None:
+                poses[detection.getId()] = (rvec, tvec)
+        truth[name] = poses
+    return truth
+
+def evaluate(frames, truth, detector, estimator, min_recall=None, time_limit=None, warmup=3, repeat=1):
+    """
+    Time detection and pose estimation over the frames and score them
+    against the truth.
+
+    Parameters:
+      frames (list): (name, gray frame, _) tuples.
+      truth (dict): Frame name -> {tag ID: (rvec, tvec)}.
+      detector: AprilTag detector configured with the candidate settings.
+      estimator (PoseEstimator): Pose solver (without warm start).
+      min_recall (float): Stop as soon as too many tags were missed to reach it.
+      time_limit (float): Stop once the timed frames took longer than this
+        many seconds in total (a faster candidate is already known).
+      warmup (int): Untimed frames before the pass.
+      repeat (int): Timed passes; the fastest one is kept.
+
+    Returns:
+      dict: fps, recall and pose errors, with "stopped" set to the reason
+      when the evaluation ended early.
+    """
+    expected = sum(len(truth[name]) for name, _, _ in frames)
+    allowed_misses = expected * (1.0 - min_recall) if min_recall is not None else None
+    for name, gray, _ in frames[:warmup]:
+        detect_tags(gray, detector)
+
+    best_time = None
+    for run in range(repeat):
+        estimator.reset()
+        elapsed = 0.0
+        missed = false_positives = 0
+        translation_errors = []
+        rotation_errors = []
+        for name, gray, _ in frames:
+            t0 = time.perf_counter()
+            detections = detect_tags(gray, detector)
+            poses = {}
+            for detection in detections:
+                tag_id = detection.getId()
+                rvec, tvec, _ = estimator.solve(tag_id, get_detection_corners(detection), t0)
+                if rvec is not None:
+                    poses[tag_id] = (rvec, tvec)
+            elapsed += time.perf_counter() - t0
+
+            for tag_id, (rvec_true, tvec_true) in truth[name].items():
+                if tag_id not in poses:
+                    missed += 1
+                    continue
+                rvec, tvec = poses[tag_id]
+                translation_errors.append(np.linalg.norm(tvec - tvec_true))
+                rotation_errors.append(rotation_error(rvec, rvec_true))
+            false_positives += len(set(poses) - set(truth[name]))
+
+            if allowed_misses is not None and missed > allowed_misses:
+                return {"stopped": "recall"}
+            if time_limit is not None and elapsed > time_limit:
+                return {"stopped": "slower"}
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    translation = summarize(translation_errors, 1000.0)
+    rotation = summarize(rotation_errors)
+    return {
+        "stopped": None,
+        "time": best_time,
+        "fps": len(frames) / best_time if best_time else None,
+        "recall": (expected - missed) / expected if expected else None,
+        "false_positives": false_positives,
+        "translation_p90_mm": translation["p90"] if translation else None,
+        "rotation_p90_deg": rotation["p90"] if rotation else None,
+    }
+
+def meets_budget(result, min_recall, max_error_mm, max_rotation_deg):
+    if result["stopped"]:
+        return False
+    if result["recall"] is not None and result["recall"] < min_recall:
+        return False
+    if max_error_mm is not None and result["translation_p90_mm"] is not None \
+            and result["translation_p90_mm"] > max_error_mm:
+        return False
+    if max_rotation_deg is not None and result["rotation_p90_deg"] is not None \
+            and result["rotation_p90_deg"] > max_rotation_deg:
+        return False
+    return True
+
+def format_result(settings, result):
+    shown = " ".join(f"{name}={value:g}" if isinstance(value, float) else f"{name}={value}"
+                     for name, value in settings.items())
+    if result["stopped"]:
+        return f"{shown}: stopped ({result['stopped']})"
+    text = f"{shown}: {result['fps']:.1f} fps"
+    if result["recall"] is not None:
+        text += f", recall {result['recall']:.3f}"
+    if result["translation_p90_mm"] is not None:
+        text += f", p90 error {result['translation_p90_mm']:.2f}mm {result['rotation_p90_deg']:.2f}deg"
+    return text
+
+def autotune(frames, truth, make_detector, make_estimator, candidates, min_recall=0.95,
+             max_error_mm=None, max_rotation_deg=None, confirm=3, confirm_repeat=3):
+    """
+    Find the fastest detector settings meeting the recall and pose error
+    budget.
+
+    Each candidate gets one pass, cut short once it misses too many tags or
+    is already slower than the fastest passing candidate so far. The
+    `confirm` fastest passing candidates are then timed again over
+    `confirm_repeat` passes, so the pick does not hinge on timing noise.
+
+    Parameters:
+      frames (list): (name, gray frame, _) tuples.
+      truth (dict): Frame name -> {tag ID: (rvec, tvec)}.
+      make_detector: Callable mapping settings to a detector.
+      make_estimator: Callable returning a fresh PoseEstimator.
+      candidates (list): Settings dicts to try.
+      min_recall (float): Minimum fraction of truth tags detected and solved.
+      max_error_mm (float): Maximum p90 translation error (None: no limit).
+      max_rotation_deg (float): Maximum p90 rotation error (None: no limit).
+
+    Returns:
+      (best, results): the best (settings, result) or None when no candidate
+      meets the budget, and every (settings, result) tried.
+    """
+    results = []
+    passing = []
+    estimator = make_estimator()
+    for i, settings in enumerate(candidates):
+        # Some slack, the confirmation passes settle close calls
+        time_limit = min(result["time"] for _, result in passing) * 1.2 if passing else None
+        result = evaluate(frames, truth, make_detector(settings), estimator, min_recall, time_limit)
+        if not result["stopped"] and not meets_budget(result, min_recall, max_error_mm, max_rotation_deg):
+            result["stopped"] = "error"
+        results.append((settings, result))
+        if not result["stopped"]:
+            passing.append((settings, result))
+        print(f"[{i + 1}/{len(candidates)}] {format_result(settings, result)}")
+
+    if not passing:
+        return None, results
+    passing.sort(key=lambda item: item[1]["time"])
+    print(f"\nConfirming the {min(confirm, len(passing))} fastest...")
+    confirmed = []
+    for settings, _ in passing[:max(1, confirm)]:
+        result = evaluate(frames, truth, make_detector(settings), estimator, repeat=confirm_repeat)
+        confirmed.append((settings, result))
+        print(format_result(settings, result))
+    return min(confirmed, key=lambda item: item[1]["time"]), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the fastest AprilTag detector settings that meet a "
+                                                 "recall and pose error budget.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--frames', type=str,
+                        help="Directory of images; a truth.json inside provides ground truth.")
+    source.add_argument('--video', type=str,
+                        help="Video file to tune on (the reference settings stand in for ground truth).")
+    source.add_argument('--synthetic', type=int,
+                        help="Render this many random tag36h11 scenes at known poses.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed for synthetic scenes (default: 0).")
+    parser.add_argument('--distance', type=float, nargs=2, default=(0.3, 2.0),
+                        help="Synthetic tag distance range in meters (default: 0.3 2.0).")
+    parser.add_argument('--noise', type=float, default=2.0,
+                        help="Synthetic pixel noise standard deviation (default: 2.0).")
+    parser.add_argument('--max_frames', type=int, default=None,
+                        help="Only use the first N frames of a directory or video.")
+    parser.add_argument('--calib', type=str, default=None,
+                        help="Calibration file with 'mtx' and 'dist' (default: truth.json or stand-in intrinsics).")
+    parser.add_argument('--tag_size', type=float, default=0.0508,
+                        help="Real-world tag size in meters (default ~2 inches = 0.0508 m).")
+    parser.add_argument('--families', type=str, default="tag36h11",
+                        help="AprilTag families to detect (default: tag36h11).")
+    parser.add_argument('--pnp', choices=sorted(PNP_METHODS), default='ippe_square',
+                        help="solvePnP method used for tag poses (default: ippe_square).")
+    parser.add_argument('--detector_config', type=str, default=None, metavar='FILE',
+                        help="JSON file of detector settings kept fixed unless swept.")
+    parser.add_argument('--detector', type=str, action='append', default=[], metavar='NAME=VALUE',
+                        help="Fix a detector setting (removes it from the default grid); repeatable.")
+    parser.add_argument('--grid', type=str, action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="Values to sweep for a setting, replacing its default grid; repeatable. "
+                             f"Default grid: {DEFAULT_GRID}.")
+    parser.add_argument('--min_recall', type=float, default=None,
+                        help="Minimum fraction of tags detected (default: 0.95x the reference settings').")
+    parser.add_argument('--max_error_mm', type=float, default=None,
+                        help="Maximum p90 translation error in mm (default: 1.25x the reference settings').")
+    parser.add_argument('--max_rotation_deg', type=float, default=None,
+                        help="Maximum p90 rotation error in degrees (default: no limit).")
+    parser.add_argument('--confirm', type=int, default=3,
+                        help="Fastest passing settings re-timed before picking one (default: 3).")
+    parser.add_argument('--output', type=str, default="detector.json",
+                        help="Where to write the chosen settings (default: detector.json).")
+    args = parser.parse_args()
+
+    try:
+        base = load_detector_config(args.detector_config, args.detector)
+        grid = {name: values for name, values in DEFAULT_GRID.items() if name not in base}
+        for text in args.grid:
+            name, values = parse_grid_axis(text)
+            grid[name] = values
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    camera_matrix, dist_coeffs = None, None
+    if args.calib:
+        from config.calibration import load_calibration
+        camera_matrix, dist_coeffs = load_calibration(args.calib)
+    truth = None
+    if args.synthetic:
+        camera_matrix = DEFAULT_CAMERA_MATRIX if camera_matrix is None else camera_matrix
+        dist_coeffs = None
+        print(f"Rendering {args.synthetic} synthetic scenes...")
+        frames = synthetic_frames(args.synthetic, args.tag_size, camera_matrix, args.seed,
+                                  args.distance, args.noise)
+    elif args.frames:
+        frames, truth_matrix, truth_size = load_directory(args.frames, args.max_frames)
+        if truth_matrix is not None:
+            if camera_matrix is None:
+                camera_matrix = truth_matrix
+            args.tag_size = truth_size
+    else:
+        frames = load_video(args.video, args.max_frames)
+    if not frames:
+        print("No frames to tune on")
+        return
+    if camera_matrix is None:
+        print("No calibration given; using stand-in intrinsics (pose errors are in arbitrary units)")
+        camera_matrix = DEFAULT_CAMERA_MATRIX
+    # Grayscale conversion is the same for every candidate
+    frames = [(name, to_gray(frame), frame_truth) for name, frame, frame_truth in frames]
+    if all(frame_truth is not None for _, _, frame_truth in frames):
+        truth = {name: frame_truth for name, _, frame_truth in frames}
+
+    def make_detector(settings):
+        return create_detector(args.families, settings)
+
+    def make_estimator():
+        return PoseEstimator(camera_matrix, dist_coeffs, args.tag_size, method=args.pnp, warm_start=False)
+
+    reference_settings = dict(base, **REFERENCE_SETTINGS)
+    if truth is None:
+        print(f"No ground truth; using the detections of {reference_settings} as truth")
+        truth = reference_truth(frames, make_detector(reference_settings), make_estimator())
+    reference = evaluate(frames, truth, make_detector(reference_settings), make_estimator())
+    print(f"Reference: {format_result(reference_settings, reference)}")
+    # Without explicit limits, allow a little less than the reference
+    # settings manage (tags too small for any setting do not count against)
+    min_recall = args.min_recall
+    if min_recall is None:
+        min_recall = 0.95 * reference["recall"] if reference["recall"] is not None else 0.0
+    max_error_mm = args.max_error_mm
+    if max_error_mm is None and reference["translation_p90_mm"] is not None:
+        max_error_mm = 1.25 * reference["translation_p90_mm"]
+    budget = f"recall >= {min_recall:.3f}"
+    if max_error_mm is not None:
+        budget += f", p90 error <= {max_error_mm:.2f}mm"
+    if args.max_rotation_deg is not None:
+        budget += f", p90 rotation <= {args.max_rotation_deg:.2f}deg"
+
+    candidates = candidate_settings(grid, base)
+    print(f"Loaded {len(frames)} frames of {frames[0][1].shape[1]}x{frames[0][1].shape[0]}; "
+          f"trying {len(candidates)} settings for {budget}")
+    start = time.perf_counter()
+    best, results = autotune(frames, truth, make_detector, make_estimator, candidates, min_recall,
+                             max_error_mm, args.max_rotation_deg, args.confirm)
+    print(f"Swept in {time.perf_counter() - start:.0f}s")
+    if best is None:
+        print(f"No settings meet {budget}; relax the budget or widen the grid")
+        return
+
+    settings, result = best
+    print(f"\nBest: {format_result(settings, result)}")
+    print(f"Reference ran at {reference['fps']:.1f} fps")
+    chosen = detector_config(make_detector(settings))
+    with open(args.output, "w") as f:
+        json.dump({
+            "detector": chosen,
+            "tuning": {
+                "result": result,
+                "reference": {"settings": reference_settings, "result": reference},
+                "budget": {"min_recall": min_recall, "max_error_mm": max_error_mm,
+                           "max_rotation_deg": args.max_rotation_deg},
+                "frames": len(frames),
+                "frame_size": [frames[0][1].shape[1], frames[0][1].shape[0]],
+                "candidates": [{"settings": s, "result": r} for s, r in results],
+                "commit": git_commit(),
+                "platform": platform.platform(),
+                "opencv": cv2.__version__,
+            },
+        }, f, indent=2)
+    print(f"Settings written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+#python3 -m src.benchmark --synthetic 200 --output bench.json
+#python3 -m src.benchmark --frames recordings/run1 --calib calibration.npz --upscale 2
+#python3 -m src.benchmark --video test.mp4 --target 27 --pnp iterative
+#python3 -m src.benchmark --synthetic 200 --processes 1 2 3 4   (process pool scaling)
+# replays frames through detection -> pose -> message encoding without a camera
+
+import cv2
+import os
+import glob
+import json
+import time
+import platform
+import argparse
+import functools
+import subprocess
+import numpy as np
+from .detector import (create_detector, detect_tags, detect_region, to_gray, get_detection_corners,
+                       MultiScaleDetector, PoseEstimator, PNP_METHODS, load_detector_config, detector_config)
+from .protocol import encode_pose, encode_text
+from .synthetic import random_scenes, DEFAULT_CAMERA_MATRIX
+from .process_pool import run_process_pipeline
+
+STAGES = ("gray", "detect", "pose", "encode", "total")
+TRUTH_FILE = "truth.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+def load_truth(path):
+    """
+    Load a ground truth file written by save_frames.
+
+    Returns:
+      (truth, camera_matrix, tag_size): dict of frame name -> {tag ID: (rvec, tvec)},
+      and the intrinsics and tag size the frames were rendered with.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    truth = {}
+    for name, tags in data["frames"].items():
+        truth[name] = {int(tag_id): (np.array(pose["rvec"]).reshape((3, 1)), np.array(pose["tvec"]).reshape((3, 1)))
+                       for tag_id, pose in tags.items()}
+    return truth, np.array(data["camera_matrix"]), data["tag_size"]
+
+def save_frames(directory, frames, camera_matrix, tag_size):
+    """
+    Write (name, frame, truth) frames as PNGs plus a truth.json, so a
+    synthetic set can be replayed unchanged with --frames.
+    """
+    os.makedirs(directory, exist_ok=True)
+    data = {"camera_matrix": np.asarray(camera_matrix).tolist(), "tag_size": tag_size, "frames": {}}
+    for name, frame, truth in frames:
+        cv2.imwrite(os.path.join(directory, name), frame)
+        data["frames"][name] = {str(tag_id): {"rvec": pose[0].ravel().tolist(), "tvec": pose[1].ravel().tolist()}
+                                for tag_id, pose in truth.items()}
+    with open(os.path.join(directory, TRUTH_FILE), "w") as f:
+        json.dump(data, f)
+    print(f"Saved {len(frames)} frames to {directory}")
+
+def load_directory(directory, max_frames=None):
+    """
+    Load every image in a directory, sorted by name, with ground truth if the
+    directory has a truth.json.
+    """
+    names = sorted(os.path.basename(p) for p in glob.glob(os.path.join(directory, "*"))
+                   if p.lower().endswith(IMAGE_EXTENSIONS))[:max_frames]
+    truth_path = os.path.join(directory, TRUTH_FILE)
+    truth, camera_matrix, tag_size = load_truth(truth_path) if os.path.exists(truth_path) else ({}, None, None)
+    frames = []
+    for name in names:
+        frame = cv2.imread(os.path.join(directory, name), cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            print(f"Skipping unreadable image {name}")
+            continue
+        frames.append((name, frame, truth.get(name) if truth else None))
+    return frames, camera_matrix, tag_size
+
+def load_video(path, max_frames=None):
+    """
+    Decode a video file into memory, so decoding is not part of the timings.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {path}")
+    frames = []
+    while max_frames is None or len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append((f"{len(frames):06d}", frame, None))
+    cap.release()
+    return frames
+
+def synthetic_frames(count, tag_size, camera_matrix, seed=0, distance=(0.3, 2.0), noise=2.0):
+    frames = []
+    for i, (frame, truth) in enumerate(random_scenes(count, tag_size=tag_size, seed=seed,
+                                                     camera_matrix=camera_matrix, distance=distance,
+                                                     noise=noise)):
+        frames.append((f"{i:06d}.png", frame, {tag_id: pose[:2] for tag_id, pose in truth.items()}))
+    return frames
+
+def summarize(samples, scale=1.0):
+    """
+    Mean, percentiles and max of a list of samples, multiplied by `scale`.
+    """
+    if len(samples) == 0:
+        return None
+    values = np.asarray(samples, dtype=np.float64) * scale
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": int(values.size), "mean": float(values.mean()), "p50": float(p50),
+            "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+def rotation_error(rvec, rvec_true):
+    """
+    Angle in degrees of the rotation between two Rodrigues vectors.
+    """
+    R = cv2.Rodrigues(rvec)[0].T @ cv2.Rodrigues(rvec_true)[0]
+    return np.degrees(np.arccos(np.clip((np.trace(R) - 1) / 2, -1.0, 1.0)))
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(frames, detector, estimator, scanner=None, target=None, protocol="text",
+                  warmup=5, repeat=1, upscale=1.0):
+    """
+    Time every frame through the same stages as the live loop.
+
+    Parameters:
+      frames (list): (name, frame, truth) tuples; truth is a dict of tag ID ->
+        (rvec, tvec), or None when the frame has no ground truth.
+      detector: AprilTag detector from create_detector.
+      estimator (PoseEstimator): Pose solver; reset before each pass.
+      scanner (MultiScaleDetector): Optional multi-scale detector used instead
+        of a single full-frame pass.
+      upscale (float): Without a scanner, resize every whole frame by this
+        factor before detection (corners are mapped back to native pixels).
+      target (int): Only solve and encode this tag ID (default: every tag).
+      protocol (str): "text" or "binary" message encoding.
+      warmup (int): Frames run before timing starts.
+      repeat (int): Passes over the frames.
+
+    Returns:
+      dict: timings, throughput, recall and pose error.
+    """
+    timings = {stage: [] for stage in STAGES}
+    translation_errors = []
+    rotation_errors = []
+    expected = detected = false_positives = 0
+    seq = 0
+    pixels = []
+
+    for run in range(-1 if warmup else 0, repeat):
+        estimator.reset()
+        batch = frames[:warmup] if run < 0 else frames
+        start_pass = time.perf_counter()
+        for name, frame, truth in batch:
+            t0 = time.perf_counter()
+            gray = to_gray(frame)
+            t1 = time.perf_counter()
+            if scanner is not None:
+                scanned = scanner.pixels_processed
+                detections = scanner.detect(gray, detector)
+                scanned = scanner.pixels_processed - scanned
+            elif upscale != 1.0:
+                detections = detect_region(gray, detector, 0, 0, gray.shape[1], gray.shape[0], upscale)
+                scanned = gray.size * upscale * upscale
+            else:
+                detections = detect_tags(gray, detector)
+                scanned = gray.size
+            t2 = time.perf_counter()
+            poses = {}
+            for detection in detections:
+                tag_id = detection.getId()
+                if target is not None and tag_id != target:
+                    continue
+                rvec, tvec, error = estimator.solve(tag_id, get_detection_corners(detection), t0)
+                if rvec is not None:
+                    poses[tag_id] = (rvec, tvec)
+            t3 = time.perf_counter()
+            for tag_id, (rvec, tvec) in poses.items():
+                if protocol == "binary":
+                    encode_pose(seq, t0, tag_id, tvec, rvec)
+                else:
+                    encode_text(tvec, rvec)
+                seq += 1
+            t4 = time.perf_counter()
+            if run < 0:
+                continue
+
+            timings["gray"].append(t1 - t0)
+            timings["detect"].append(t2 - t1)
+            timings["pose"].append(t3 - t2)
+            timings["encode"].append(t4 - t3)
+            timings["total"].append(t4 - t0)
+            pixels.append(scanned)
+
+            if truth is None:
+                continue
+            found = {detection.getId() for detection in detections}
+            for tag_id, (rvec_true, tvec_true) in truth.items():
+                if target is not None and tag_id != target:
+                    continue
+                expected += 1
+                if tag_id not in found:
+                    continue
+                detected += 1
+                if tag_id in poses:
+                    rvec, tvec = poses[tag_id]
+                    translation_errors.append(np.linalg.norm(tvec - tvec_true))
+                    rotation_errors.append(rotation_error(rvec, rvec_true))
+            false_positives += len(found - set(truth))
+        if run < 0:
+            continue
+        elapsed = time.perf_counter() - start_pass
+        print(f"Pass {run + 1}/{repeat}: {len(batch)} frames in {elapsed:.2f}s "
+              f"({len(batch) / elapsed:.1f} fps)")
+
+    total_time = sum(timings["total"])
+    return {
+        "frames": len(timings["total"]),
+        "fps": len(timings["total"]) / total_time if total_time else None,
+        "latency_ms": {stage: summarize(samples, 1000.0) for stage, samples in timings.items()},
+        "detector_mpixels": summarize(pixels, 1e-6),
+        "recall": detected / expected if expected else None,
+        "tags_expected": expected,
+        "tags_detected": detected,
+        "false_positives": false_positives,
+        "pose_error": {
+            "translation_mm": summarize(translation_errors, 1000.0),
+            "rotation_deg": summarize(rotation_errors),
+        },
+    }
+
+def create_processor(families, detector_settings, camera_matrix, dist_coeffs, tag_size, pnp, target=None):
+    """
+    Detection and pose estimation of one process pool worker, as a callable
+    mapping a frame to (frame, detections, poses).
+    """
+    detector = create_detector(families, detector_settings)
+    estimator = PoseEstimator(camera_matrix, dist_coeffs, tag_size, method=pnp, warm_start=False)
+
+    def process(frame):
+        gray = to_gray(frame)
+        detections = detect_tags(gray, detector)
+        poses = {}
+        for detection in detections:
+            if target is not None and detection.getId() != target:
+                continue
+            rvec, tvec, error = estimator.estimate(detection)
+            if rvec is not None:
+                poses[detection.getId()] = (detection, rvec, tvec, error)
+        return gray, detections, poses
+    return process
+
+def run_scaling(frames, processor_factory, worker_counts, repeat=1):
+    """
+    Throughput of the process pool over the frames for each worker count.
+    Every frame is processed (nothing is dropped) and worker startup is not
+    timed, so the numbers compare directly.
+
+    Returns:
+      dict: worker count -> {"fps", "speedup"} (speedup over the first count).
+    """
+    scaling = {}
+    for count in worker_counts:
+        batch = iter([frame for _, frame, _ in frames] * repeat)
+        timing = {}
+
+        def capture():
+            timing.setdefault("start", time.perf_counter())
+            frame = next(batch, None)
+            return frame, time.monotonic()
+
+        def consume(result):
+            timing["end"] = time.perf_counter()
+
+        stats = run_process_pipeline(capture, processor_factory, consume, num_workers=count, drop_stale=False)
+        fps = stats["results_consumed"] / (timing["end"] - timing["start"])
+        first = scaling[worker_counts[0]]["fps"] if scaling else fps
+        scaling[count] = {"fps": fps, "speedup": fps / first}
+        print(f"{count} worker process{'es' if count > 1 else ''}: {fps:.1f} fps "
+              f"(x{fps / first:.2f}, {stats['results_consumed']} frames)")
+    return scaling
+
+def print_report(report):
+    print(f"\n{report['frames']} frames, {report['fps']:.1f} fps")
+    print(f"{'stage':<8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for stage, stats in report["latency_ms"].items():
+        if stats:
+            print(f"{stage:<8}" + "".join(f"{stats[k]:9.3f}" for k in ("mean", "p50", "p90", "p99", "max")))
+    if report["detector_mpixels"]:
+        print(f"Detector input: {report['detector_mpixels']['mean']:.2f} Mpx/frame on average")
+    if report["recall"] is not None:
+        print(f"Recall: {report['recall']:.3f} ({report['tags_detected']}/{report['tags_expected']}), "
+              f"false positives: {report['false_positives']}")
+    for name, stats in report["pose_error"].items():
+        if stats:
+            print(f"Pose error {name}: p50 {stats['p50']:.3f}, p90 {stats['p90']:.3f}, max {stats['max']:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of AprilTag detection and pose estimation.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--frames', type=str,
+                        help="Directory of images; a truth.json inside provides ground truth.")
+    source.add_argument('--video', type=str,
+                        help="Video file to replay (no ground truth).")
+    source.add_argument('--synthetic', type=int,
+                        help="Render this many random tag36h11 scenes at known poses.")
+    parser.add_argument('--save', type=str, default=None,
+                        help="With --synthetic, also write the scenes and truth.json to this directory.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed for synthetic scenes (default: 0).")
+    parser.add_argument('--distance', type=float, nargs=2, default=(0.3, 2.0),
+                        help="Synthetic tag distance range in meters (default: 0.3 2.0).")
+    parser.add_argument('--noise', type=float, default=2.0,
+                        help="Synthetic pixel noise standard deviation (default: 2.0).")
+    parser.add_argument('--max_frames', type=int, default=None,
+                        help="Only use the first N frames of a directory or video.")
+    parser.add_argument('--calib', type=str, default=None,
+                        help="Calibration file with 'mtx' and 'dist' (default: truth.json or stand-in intrinsics).")
+    parser.add_argument('--tag_size', type=float, default=0.0508,
+                        help="Real-world tag size in meters (default ~2 inches = 0.0508 m).")
+    parser.add_argument('--families', type=str, default="tag36h11",
+                        help="AprilTag families to detect (default: tag36h11).")
+    parser.add_argument('--detector_config', type=str, default=None, metavar='FILE',
+                        help="JSON file of detector settings, e.g. written by src.autotune.")
+    parser.add_argument('--detector', type=str, action='append', default=[], metavar='NAME=VALUE',
+                        help="Detector setting, overriding --detector_config; repeatable.")
+    parser.add_argument('--target', type=int, default=None,
+                        help="Only solve, encode and score this tag ID (default: all tags).")
+    parser.add_argument('--upscale', type=float, default=1.0,
+                        help="Upscale factor for the multi-scale tile pass (default: 1 = native only).")
+    parser.add_argument('--upscale_mode', choices=['tiles', 'frame'], default='frame',
+                        help="'frame' resizes the whole frame; 'tiles' upscales only candidate regions "
+                             "after a native pass (default: frame).")
+    parser.add_argument('--pnp', choices=sorted(PNP_METHODS), default='ippe_square',
+                        help="solvePnP method used for tag poses (default: ippe_square).")
+    parser.add_argument('--warm_start', action='store_true',
+                        help="Seed each pose from the previous frame; only meaningful for continuous "
+                             "recordings, synthetic scenes are independent.")
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text',
+                        help="Message encoding to time (default: text).")
+    parser.add_argument('--warmup', type=int, default=5,
+                        help="Untimed frames before each run (default: 5).")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Timed passes over the frames (default: 1).")
+    parser.add_argument('--processes', type=int, nargs='+', default=None, metavar='N',
+                        help="Also measure process pool throughput with each of these worker counts "
+                             "(e.g. 1 2 3 4).")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+    try:
+        detector_settings = load_detector_config(args.detector_config, args.detector)
+    except (OSError, ValueError) as e:
+        parser.error(f"detector settings: {e}")
+
+    camera_matrix, dist_coeffs = None, None
+    if args.calib:
+        from config.calibration import load_calibration
+        camera_matrix, dist_coeffs = load_calibration(args.calib)
+
+    if args.synthetic:
+        # Scenes are rendered without distortion
+        camera_matrix = DEFAULT_CAMERA_MATRIX if camera_matrix is None else camera_matrix
+        dist_coeffs = None
+        print(f"Rendering {args.synthetic} synthetic scenes...")
+        frames = synthetic_frames(args.synthetic, args.tag_size, camera_matrix, args.seed,
+                                  args.distance, args.noise)
+        if args.save:
+            save_frames(args.save, frames, camera_matrix, args.tag_size)
+    elif args.frames:
+        frames, truth_matrix, truth_size = load_directory(args.frames, args.max_frames)
+        if truth_matrix is not None:
+            if camera_matrix is None:
+                camera_matrix = truth_matrix
+            args.tag_size = truth_size
+    else:
+        frames = load_video(args.video, args.max_frames)
+
+    if not frames:
+        print("No frames to benchmark")
+        return
+    if camera_matrix is None:
+        print("No calibration given; using stand-in intrinsics (pose values are not meaningful)")
+        camera_matrix = DEFAULT_CAMERA_MATRIX
+    print(f"Loaded {len(frames)} frames of {frames[0][1].shape[1]}x{frames[0][1].shape[0]}")
+
+    detector = create_detector(args.families, detector_settings)
+    scanner = None
+    if args.upscale != 1.0 and args.upscale_mode == 'tiles':
+        scanner = MultiScaleDetector(args.upscale)
+    estimator = PoseEstimator(camera_matrix, dist_coeffs, args.tag_size, method=args.pnp,
+                              warm_start=args.warm_start)
+    report = run_benchmark(frames, detector, estimator, scanner, args.target, args.protocol,
+                           min(args.warmup, len(frames)), args.repeat, args.upscale)
+    print_report(report)
+
+    if args.processes:
+        print(f"\nProcess pool scaling over {len(frames) * args.repeat} frames:")
+        factory = functools.partial(create_processor, args.families, detector_settings, camera_matrix,
+                                    dist_coeffs, args.tag_size, args.pnp, args.target)
+        report["scaling"] = run_scaling(frames, factory, args.processes, args.repeat)
+
+    report["config"] = vars(args)
+    report["detector"] = detector_config(detector)
+    report["commit"] = git_commit()
+    report["platform"] = platform.platform()
+    report["opencv"] = cv2.__version__
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
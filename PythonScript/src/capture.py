@@ -0,0 +1,476 @@
+#python3 -m src.capture --source test.mp4 --frames 300
+#python3 -m src.capture --source synthetic --frames 300
+# compares the grayscale and color capture paths frame by frame
+
+import os
+import abc
+import cv2
+import time
+import threading
+import collections
+import argparse
+import numpy as np
+
+class FramePool:
+    """
+    Fixed set of preallocated frame buffers with explicit ownership.
+
+    acquire() hands out a free buffer and the holder gives it back with
+    release() once nothing reads it any more; a buffer is never reused while
+    it is out. When every buffer is out, acquire() waits for a release, so
+    a stalled consumer throttles capture instead of having its frames
+    overwritten; `waits` and `timeouts` count how often that happened.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, count=4):
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(max(1, count))]
+        self._ids = {id(buf) for buf in self.buffers}
+        self._free = collections.deque(self.buffers)
+        self._cond = threading.Condition()
+        self.waits = 0
+        self.timeouts = 0
+
+    @property
+    def shape(self):
+        return self.buffers[0].shape
+
+    @property
+    def in_use(self):
+        return len(self.buffers) - len(self._free)
+
+    def acquire(self, timeout=None):
+        """
+        Take a free buffer, waiting up to `timeout` seconds for one.
+
+        Returns:
+          np.ndarray: The buffer, or None if none was released in time.
+        """
+        with self._cond:
+            if not self._free:
+                self.waits += 1
+                if not self._cond.wait_for(lambda: self._free, timeout):
+                    self.timeouts += 1
+                    return None
+            return self._free.popleft()
+
+    def release(self, frame):
+        """
+        Give a buffer back. Frames that are not buffers of this pool (e.g.
+        converted copies) and buffers already free are ignored.
+        """
+        if frame is None or id(frame) not in self._ids:
+            return
+        with self._cond:
+            if any(buf is frame for buf in self._free):
+                return
+            self._free.append(frame)
+            self._cond.notify()
+
+def pool_size(workers=1, buffer_size=2):
+    """
+    Buffers in flight at once in pipeline mode: both ring buffers, one frame
+    per worker, plus the frames being captured and consumed. With fewer,
+    capture waits for the consumer.
+    """
+    return 2 * buffer_size + workers + 2
+
+# Seconds a source waits for a pooled buffer before reporting that frames
+# are not being released
+POOL_WAIT = 1.0
+
+def acquire_pooled(pool):
+    frame = pool.acquire(timeout=POOL_WAIT)
+    if frame is None:
+        raise RuntimeError(f"No free frame buffer: all {len(pool.buffers)} in use for {POOL_WAIT:.0f}s "
+                           f"(frames not released?)")
+    return frame
+
+class FrameSource(abc.ABC):
+    """
+    Common interface of all frame sources.
+
+    read() returns the next frame, or None at the end of a finite source.
+    Gray sources return single-channel frames from a FramePool; color sources
+    return RGB frames, as Picamera2 does. read_timed() also returns the
+    capture time on the time.monotonic() clock. Every frame read must be
+    handed back with release() once nothing uses it any more.
+    """
+    gray = True
+    pool = None
+
+    @abc.abstractmethod
+    def read(self):
+        pass
+
+    def read_timed(self):
+        frame = self.read()
+        return frame, time.monotonic()
+
+    def release(self, frame):
+        """
+        Return a frame from read(); pooled buffers become free for reuse.
+        """
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PiCameraSource(FrameSource):
+    """
+    Pi camera capture.
+
+    In gray mode the sensor output is configured as YUV420 and only the
+    luminance plane is copied out of the camera's own buffer, straight into a
+    pooled frame: no RGB conversion and no per-frame allocation. Color mode
+    returns the RGB main stream as capture_array() did.
+
+    Parameters:
+      size (tuple): (width, height) of the main stream.
+      gray (bool): Capture the Y plane only.
+      pool_count (int): Number of pooled gray buffers (see pool_size).
+      controls (dict): Camera controls applied at configuration.
+    """
+
+    def __init__(self, size=(1280, 720), gray=True, pool_count=4, controls=None):
+        from picamera2 import Picamera2, MappedArray
+        self._mapped_array = MappedArray
+        self.size = size
+        self.gray = gray
+        print("Initializing Pi Camera...")
+        self.picam2 = Picamera2()
+        print("Camera object created")
+
+        print("\nCreating preview configuration...")
+        main = {"size": size}
+        if gray:
+            main["format"] = "YUV420"
+        config = self.picam2.create_preview_configuration(main=main, controls=controls or {})
+
+        print("Configuring camera...")
+        self.picam2.configure(config)
+        self.pool = FramePool((size[1], size[0]), count=pool_count) if gray else None
+        print("Starting camera...")
+        self.picam2.start()
+        print("Camera initialization complete")
+
+    def read(self):
+        return self.read_timed()[0]
+
+    def read_timed(self):
+        width, height = self.size
+        # Wait for a buffer before capturing, so the frame is fresh
+        frame = acquire_pooled(self.pool) if self.gray else None
+        try:
+            request = self.picam2.capture_request()
+        except Exception:
+            self.release(frame)
+            raise
+        try:
+            if self.gray:
+                with self._mapped_array(request, "main") as mapped:
+                    # YUV420 is mapped as (height * 3 / 2, stride); the first
+                    # `height` rows are the Y plane
+                    np.copyto(frame, mapped.array[:height, :width])
+            else:
+                frame = request.make_array("main")
+            sensor_time = request.get_metadata().get("SensorTimestamp")
+        except Exception:
+            self.release(frame)
+            raise
+        finally:
+            request.release()
+        now = time.monotonic()
+        # SensorTimestamp is CLOCK_MONOTONIC in ns on current libcamera; fall
+        # back to the read time if it ever is not
+        if sensor_time is None or abs(now - sensor_time / 1e9) > 1.0:
+            return frame, now
+        return frame, sensor_time / 1e9
+
+    def close(self):
+        self.picam2.stop()
+
+class VideoCaptureSource(FrameSource):
+    """
+    cv2.VideoCapture source: V4L2 device, video file or stream URL.
+
+    Decoded frames land in one reused buffer; gray mode converts them into a
+    pooled single-channel frame, which is the only copy the detector sees.
+    With `raw_yuyv` a V4L2 camera is asked for YUYV without conversion and
+    the Y samples are taken directly, skipping the BGR decode.
+    """
+
+    def __init__(self, source, gray=True, pool_count=4, size=None, raw_yuyv=False, api=cv2.CAP_ANY):
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source, api)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video source {source}")
+        if size is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        self.raw_yuyv = False
+        if gray and raw_yuyv:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV"))
+            self.raw_yuyv = self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        self.gray = gray
+        self.pool_count = pool_count
+        self.pool = None
+        self._raw = None
+
+    def _convert(self, raw):
+        if not self.gray:
+            # Callers keep the frame, so hand out a copy of the reused buffer
+            return cv2.cvtColor(raw, cv2.COLOR_BGR2RGB)
+        if self.raw_yuyv and raw.ndim <= 2 and raw.dtype == np.uint8:
+            # Some backends return the packed buffer as one row
+            height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            raw = raw.reshape((height, raw.size // (2 * height), 2))
+        shape = raw.shape[:2]
+        if self.pool is None or self.pool.shape != shape:
+            self.pool = FramePool(shape, count=self.pool_count)
+        frame = acquire_pooled(self.pool)
+        if raw.ndim == 3 and raw.shape[2] == 2:
+            np.copyto(frame, raw[:, :, 0])
+        elif raw.ndim == 2:
+            np.copyto(frame, raw)
+        else:
+            cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY, dst=frame)
+        return frame
+
+    def read(self):
+        ret, raw = self.cap.read(self._raw)
+        if not ret:
+            return None
+        self._raw = raw
+        return self._convert(raw)
+
+    def close(self):
+        self.cap.release()
+
+class VideoFileSource(VideoCaptureSource):
+    """
+    Video file replay, optionally paced to the file's frame rate (so the
+    downstream stages see the same frame spacing as a live camera) and looped.
+    """
+
+    def __init__(self, path, gray=True, pool_count=4, realtime=True, loop=False):
+        super().__init__(path, gray=gray, pool_count=pool_count)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.period = 1.0 / fps if realtime and fps > 0 else 0.0
+        self.loop = loop
+        self._next_time = None
+
+    def read(self):
+        frame = super().read()
+        if frame is None and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            frame = super().read()
+        if frame is not None and self.period:
+            now = time.monotonic()
+            if self._next_time is None or now - self._next_time > self.period:
+                # First frame, or fell behind: restart the schedule
+                self._next_time = now
+            elif self._next_time > now:
+                time.sleep(self._next_time - now)
+            self._next_time += self.period
+        return frame
+
+class ImageDirectorySource(FrameSource):
+    """
+    Images of a directory in name order, optionally paced and looped.
+    """
+
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, directory, gray=True, fps=0.0, loop=False):
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(self.EXTENSIONS))
+        if not self.paths:
+            raise IOError(f"No images in {directory}")
+        self.gray = gray
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.loop = loop
+        self._index = 0
+        self._last_time = 0.0
+
+    def read(self):
+        while True:
+            if self._index >= len(self.paths):
+                if not self.loop:
+                    return None
+                self._index = 0
+            path = self.paths[self._index]
+            self._index += 1
+            frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR)
+            if frame is not None:
+                break
+            print(f"Skipping unreadable image {path}")
+        if self.period:
+            wait = self._last_time + self.period - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_time = time.monotonic()
+        return frame if self.gray else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+class SyntheticSource(FrameSource):
+    """
+    Rendered tag36h11 tags moving on smooth paths in front of the camera, for
+    running the whole program without any hardware. The ground truth of the
+    last frame is kept in `truth`.
+
+    Parameters:
+      tag_ids (list): Tags to render.
+      tag_size (float): Tag side length in meters.
+      size (tuple): (width, height) of the frames.
+      fps (float): Frame rate to pace to, 0 for as fast as possible.
+      count (int): Number of frames before the end of the stream (None: endless).
+    """
+
+    def __init__(self, tag_ids=(0,), tag_size=0.0508, gray=True, pool_count=4, size=(1280, 720),
+                 fps=30.0, count=None, camera_matrix=None):
+        from .synthetic import render_scene, DEFAULT_CAMERA_MATRIX
+        self._render = render_scene
+        self.camera_matrix = DEFAULT_CAMERA_MATRIX if camera_matrix is None else camera_matrix
+        self.tag_ids = list(tag_ids)
+        self.tag_size = tag_size
+        self.gray = gray
+        self.size = size
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.count = count
+        self.pool = FramePool((size[1], size[0]), count=pool_count)
+        self.truth = {}
+        self._frame = 0
+        self._last_time = 0.0
+
+    def poses(self, t):
+        """
+        (tag_id, rvec, tvec, tag_size) of every tag at time t (seconds).
+
+        Distances scale with the tag size so a tag always spans about
+        90-150 pixels, which default detector settings find in every frame.
+        """
+        tags = []
+        count = len(self.tag_ids)
+        # 0.3-0.45 m for a 2 inch tag
+        scale = self.tag_size / 0.0508
+        # Up to four tags side by side, more in two rows
+        rows = 1 if count <= 4 else 2
+        cols = -(-count // rows)
+        for i, tag_id in enumerate(self.tag_ids):
+            phase = 2 * np.pi * i / count
+            row, col = divmod(i, cols)
+            # Spread the tags across the frame and let each one wander and tilt
+            z = scale * (0.375 + 0.075 * np.sin(0.3 * t + phase))
+            x = z * (0.5 * (col - (cols - 1) / 2) / max(1, (cols - 1) / 2) + 0.1 * np.sin(0.7 * t + phase))
+            y = z * (0.4 * (row - (rows - 1) / 2) + 0.1 * np.cos(0.5 * t + phase))
+            tilt = 0.4 * np.sin(0.4 * t + phase)
+            rvec = cv2.Rodrigues(cv2.Rodrigues(np.array([0.0, np.pi, 0.0]))[0]
+                                 @ cv2.Rodrigues(np.array([0.0, tilt, 0.0]))[0])[0]
+            tags.append((tag_id, rvec, np.array([x, y, z]), self.tag_size))
+        return tags
+
+    def read(self):
+        if self.count is not None and self._frame >= self.count:
+            return None
+        t = self._frame * (self.period or 1.0 / 30.0)
+        self._frame += 1
+        buf = acquire_pooled(self.pool)
+        frame, self.truth = self._render(self.poses(t), self.camera_matrix, self.size, out=buf)
+        if not self.gray:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+        if frame is not buf:
+            self.pool.release(buf)
+        if self.period:
+            wait = self._last_time + self.period - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_time = time.monotonic()
+        return frame
+
+def open_source(spec, gray=True, pool_count=4, size=(1280, 720), controls=None, tag_ids=(0,),
+                tag_size=0.0508, loop=False):
+    """
+    Open a frame source from a --source string:
+
+      pi, picamera           Pi camera (Picamera2)
+      0, 1, /dev/video0      V4L2 device
+      synthetic[:ID,ID...]   rendered tags (default IDs: `tag_ids`)
+      a directory            its images in name order
+      a file                 video file, paced to its frame rate
+      anything else          cv2.VideoCapture URL or pipeline
+
+    Backends are imported only when selected, so a dev machine never loads
+    the camera stack.
+    """
+    spec = str(spec)
+    if spec in ("pi", "picamera"):
+        return PiCameraSource(size, gray=gray, pool_count=pool_count, controls=controls)
+    if spec.isdigit() or spec.startswith("/dev/video"):
+        api = cv2.CAP_V4L2 if os.name == "posix" else cv2.CAP_ANY
+        return VideoCaptureSource(spec, gray=gray, pool_count=pool_count, size=size, api=api)
+    if spec == "synthetic" or spec.startswith("synthetic:"):
+        ids = [int(i) for i in spec.split(":", 1)[1].split(",")] if ":" in spec else tag_ids
+        return SyntheticSource(ids, tag_size, gray=gray, pool_count=pool_count, size=size)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, gray=gray, loop=loop)
+    if os.path.isfile(spec):
+        return VideoFileSource(spec, gray=gray, pool_count=pool_count, loop=loop)
+    return VideoCaptureSource(spec, gray=gray, pool_count=pool_count)
+
+def to_display(frame):
+    """
+    BGR image for annotation and display: gray frames are expanded, color
+    frames are copied so the original stays untouched.
+    """
+    if frame.ndim == 2:
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    return frame.copy()
+
+def measure(spec, frames, gray):
+    """
+    Time to open the source and per-frame cost of delivering a
+    detector-ready frame, including the color conversions the color path
+    needs before detection.
+    """
+    start = time.perf_counter()
+    source = open_source(spec, gray=gray)
+    if isinstance(source, (VideoFileSource, ImageDirectorySource, SyntheticSource)):
+        # Measure decoding or rendering, not the playback pacing
+        source.period = 0.0
+    open_time = time.perf_counter() - start
+    times = []
+    try:
+        for _ in range(frames):
+            start = time.perf_counter()
+            frame = source.read()
+            if frame is None:
+                break
+            if not gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            times.append(time.perf_counter() - start)
+            source.release(frame)
+    finally:
+        source.close()
+    return open_time, np.array(times) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare gray and color capture paths.")
+    parser.add_argument('--source', type=str, default="0",
+                        help="Any --source accepted by src.main (default: 0).")
+    parser.add_argument('--frames', type=int, default=300,
+                        help="Frames to read per mode (default: 300).")
+    args = parser.parse_args()
+    for gray in (False, True):
+        open_time, times = measure(args.source, args.frames, gray)
+        if len(times) == 0:
+            print("No frames read")
+            break
+        print(f"{'gray ' if gray else 'color'}: opened in {open_time * 1000:.0f}ms, {len(times)} frames, "
+              f"mean {times.mean():.3f}ms, p50 {np.percentile(times, 50):.3f}ms, "
+              f"p99 {np.percentile(times, 99):.3f}ms")
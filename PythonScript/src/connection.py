@@ -0,0 +1,313 @@
+#python3 -m src.connection              (list serial ports and which ones look like a board)
+#python3 -m src.connection --connect 30   (keep the board connected for 30s; unplug it to watch the reconnects)
+
+import os
+import glob
+import time
+import argparse
+import threading
+import serial
+from serial.tools import list_ports
+from .metrics import metrics
+
+BAUD = 115200
+# (VID, PID) of Arduino boards and the USB-serial bridges of common clones;
+# PID None matches any product of the vendor
+ARDUINO_USB_IDS = [
+    (0x2341, None),    # Arduino SA
+    (0x2A03, None),    # Arduino Srl
+    (0x1A86, 0x7523),  # CH340
+    (0x0403, 0x6001),  # FTDI FT232R
+    (0x10C4, 0xEA60),  # CP210x
+]
+# Tried when enumeration finds no matching USB device (no udev, other OS)
+LEGACY_PORTS = ['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyACM0', '/dev/ttyACM1']
+
+
+def parse_usb_id(text):
+    """
+    Parse "VID" or "VID:PID" (hex) into a (vid, pid) entry for the USB ID
+    list; pid is None for "any product".
+    """
+    vid, _, pid = text.partition(":")
+    try:
+        return int(vid, 16), int(pid, 16) if pid else None
+    except ValueError:
+        raise ValueError(f"Bad USB ID (expected VID or VID:PID in hex): {text}")
+
+
+def matches_usb_id(info, usb_ids):
+    return info.vid is not None and any(
+        info.vid == vid and (pid is None or info.pid == pid) for vid, pid in usb_ids)
+
+
+def discover_ports(usb_ids=ARDUINO_USB_IDS, ports=None):
+    """
+    Device paths worth trying, best first.
+
+    Parameters:
+      usb_ids (list): (vid, pid) entries identifying a board.
+      ports (list): Explicit device paths or glob patterns; replaces the
+        enumeration (e.g. a simulator's pty, which has no USB IDs).
+
+    Returns:
+      list: Existing device paths.
+    """
+    if ports:
+        found = []
+        for pattern in ports:
+            for device in sorted(glob.glob(pattern)) or [pattern]:
+                if os.path.exists(device) and device not in found:
+                    found.append(device)
+        return found
+    boards = sorted(info.device for info in list_ports.comports() if matches_usb_id(info, usb_ids))
+    if boards:
+        return boards
+    return [device for device in LEGACY_PORTS if os.path.exists(device)]
+
+
+def handshake(port, timeout=3.0, ping_interval=0.25):
+    """
+    Wait until the sketch answers: it prints READY when setup() finishes
+    (opening the port resets most boards) and PONG to every PING, for
+    boards that did not reset.
+
+    Returns:
+      bool: True once READY or PONG was read, False after `timeout`.
+    """
+    deadline = time.monotonic() + timeout
+    next_ping = time.monotonic()
+    while time.monotonic() < deadline:
+        if time.monotonic() >= next_ping:
+            port.write(b"PING\n")
+            port.flush()
+            next_ping += ping_interval
+        line = port.readline().decode('utf-8', 'replace').strip()
+        if line in ("READY", "PONG"):
+            return True
+    return False
+
+
+class ConnectionManager:
+    """
+    Background thread that finds the board, opens it and keeps it open, so
+    no sending thread ever waits for a port.
+
+    While disconnected it enumerates the ports every `poll_interval`;
+    after failed attempts it backs off exponentially up to `backoff_max`,
+    but tries again at once when the set of ports changes (hot-plug).
+    While connected it watches for the device disappearing; senders report
+    write and read errors with lost().
+
+    The connection state is one (state, device, since) tuple replaced as a
+    whole, so readers never see a half-updated state. States: "searching",
+    "connecting", "connected", "backoff" and "stopped".
+
+    Parameters:
+      on_connect: Callable (port, device) run once a port passed the
+        handshake; the port is then owned by the caller until lost().
+      on_disconnect: Callable (port, device, reason) run after a port was lost.
+      usb_ids, ports: See discover_ports.
+      handshake_timeout (float): Seconds to wait for READY/PONG.
+      require_handshake (bool): Reject ports that never answer; by default
+        they are accepted after the timeout, for sketches without the
+        handshake.
+    """
+
+    def __init__(self, on_connect, on_disconnect=None, usb_ids=ARDUINO_USB_IDS, ports=None, baud=BAUD,
+                 handshake_timeout=3.0, require_handshake=False, poll_interval=0.5, backoff_min=0.25,
+                 backoff_max=5.0):
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.usb_ids = usb_ids
+        self.ports = ports
+        self.baud = baud
+        self.handshake_timeout = handshake_timeout
+        self.require_handshake = require_handshake
+        self.poll_interval = poll_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.state = ("searching", None, time.monotonic())
+        self._port = None
+        self._device = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._connected = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="serial-connection", daemon=True)
+        self._thread.start()
+
+    def _set_state(self, state, device=None):
+        if self.state[:2] != (state, device):
+            self.state = (state, device, time.monotonic())
+
+    @property
+    def connected(self):
+        return self.state[0] == "connected"
+
+    def wait_connected(self, timeout=None):
+        """
+        Block until a board is connected (or `timeout` passes).
+
+        Returns:
+          bool: True if connected.
+        """
+        self._connected.wait(timeout)
+        return self.connected
+
+    def lost(self, port, reason):
+        """
+        Report that `port` failed; it is closed and the search restarts.
+        Calls for a port that was already replaced are ignored.
+        """
+        with self._lock:
+            if port is None or port is not self._port:
+                return
+            device = self._device
+            self._port = self._device = None
+            self._connected.clear()
+            self._set_state("searching")
+        try:
+            port.close()
+        except Exception:
+            pass
+        print(f"Lost connection to {device}: {reason}")
+        metrics.inc("serial_disconnects")
+        if self.on_disconnect is not None:
+            self.on_disconnect(port, device, reason)
+        self._wake.set()
+
+    def _open(self, device):
+        self._set_state("connecting", device)
+        start = time.monotonic()
+        try:
+            port = serial.Serial(device, self.baud, timeout=0.1)
+        except (serial.SerialException, OSError) as e:
+            print(f"Failed to connect to {device}: {e}")
+            return None
+        try:
+            ready = handshake(port, self.handshake_timeout)
+        except (serial.SerialException, OSError) as e:
+            print(f"Handshake with {device} failed: {e}")
+            port.close()
+            return None
+        elapsed = time.monotonic() - start
+        metrics.observe("serial_handshake", elapsed)
+        if ready:
+            print(f"Successfully connected to {device} (board ready after {elapsed:.2f}s)")
+        elif self.require_handshake:
+            print(f"No handshake reply from {device} after {elapsed:.1f}s")
+            port.close()
+            return None
+        else:
+            print(f"Connected to {device}; no handshake reply after {elapsed:.1f}s (sketch without READY/PONG?)")
+        return port
+
+    def _wait_for_change(self, seconds, devices):
+        """
+        Sleep up to `seconds`, returning early when the discovered ports
+        differ from `devices` (a board was plugged in) or on close().
+        """
+        end = time.monotonic() + seconds
+        while not self._stop.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            self._wake.wait(min(remaining, self.poll_interval))
+            self._wake.clear()
+            if discover_ports(self.usb_ids, self.ports) != devices:
+                return
+
+    def _run(self):
+        backoff = self.backoff_min
+        while not self._stop.is_set():
+            port, device = self._port, self._device
+            if port is not None:
+                # Connected: unplugging a USB board removes its device node
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                if self._port is port and not os.path.exists(device):
+                    self.lost(port, "device removed")
+                continue
+
+            devices = discover_ports(self.usb_ids, self.ports)
+            if not devices:
+                self._set_state("searching")
+                self._wait_for_change(self.poll_interval, devices)
+                continue
+            for device in devices:
+                if self._stop.is_set():
+                    break
+                port = self._open(device)
+                if port is None:
+                    continue
+                with self._lock:
+                    if self._stop.is_set():
+                        port.close()
+                        break
+                    self._port, self._device = port, device
+                    self._set_state("connected", device)
+                self.on_connect(port, device)
+                self._connected.set()
+                backoff = self.backoff_min
+                break
+            else:
+                self._set_state("backoff")
+                self._wait_for_change(backoff, devices)
+                backoff = min(backoff * 2, self.backoff_max)
+
+    def close(self):
+        """
+        Stop the thread and close the port.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=self.handshake_timeout + 1.0)
+        with self._lock:
+            port, self._port, self._device = self._port, None, None
+            self._set_state("stopped")
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and connect to the Arduino.")
+    parser.add_argument('--port', type=str, action='append', default=[], metavar='DEVICE',
+                        help="Device path or glob to use instead of USB enumeration (repeatable).")
+    parser.add_argument('--usb_id', type=str, action='append', default=[], metavar='VID[:PID]',
+                        help="Extra USB ID (hex) identifying a board (repeatable).")
+    parser.add_argument('--connect', type=float, default=0, metavar='SECONDS',
+                        help="Keep a connection up for SECONDS and print its state changes.")
+    args = parser.parse_args()
+    try:
+        usb_ids = ARDUINO_USB_IDS + [parse_usb_id(text) for text in args.usb_id]
+    except ValueError as e:
+        parser.error(str(e))
+
+    for info in list_ports.comports():
+        ids = f"{info.vid:04x}:{info.pid:04x}" if info.vid is not None else "-"
+        mark = "board" if matches_usb_id(info, usb_ids) else ""
+        print(f"{info.device:20s} {ids:10s} {mark:6s} {info.description}")
+    print(f"Candidates: {discover_ports(usb_ids, args.port) or 'none'}")
+    if args.connect <= 0:
+        return
+
+    manager = ConnectionManager(lambda port, device: None, usb_ids=usb_ids, ports=args.port)
+    end = time.monotonic() + args.connect
+    last = None
+    try:
+        while time.monotonic() < end:
+            state = manager.state[:2]
+            if state != last:
+                print(f"State: {state[0]} {state[1] or ''}")
+                last = state
+            time.sleep(0.1)
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,104 @@
 import cv2
+import json
+import time
 import numpy as np
 from robotpy_apriltag import AprilTagDetector
 
-def create_detector(tag_family="tag36h11"):
+# Detector settings by name -> (settings group, robotpy attribute, type).
+# "config" is AprilTagDetector.Config, "quad" its QuadThresholdParameters.
+DETECTOR_PARAMS = {
+    "quad_decimate": ("config", "quadDecimate", float),
+    "quad_sigma": ("config", "quadSigma", float),
+    "num_threads": ("config", "numThreads", int),
+    "refine_edges": ("config", "refineEdges", bool),
+    "decode_sharpening": ("config", "decodeSharpening", float),
+    "min_cluster_pixels": ("quad", "minClusterPixels", int),
+    "max_num_maxima": ("quad", "maxNumMaxima", int),
+    "critical_angle": ("quad", "criticalAngle", float),  # radians
+    "max_line_fit_mse": ("quad", "maxLineFitMSE", float),
+    "min_white_black_diff": ("quad", "minWhiteBlackDiff", int),
+    "deglitch": ("quad", "deglitch", bool),
+}
+
+def create_detector(tag_family="tag36h11", config=None):
     """
     Create and configure a robotpy-apriltag detector.
+
+    Parameters:
+      tag_family (str): AprilTag family to detect.
+      config (dict): Detector settings by DETECTOR_PARAMS name, e.g.
+        {"quad_decimate": 1.5, "num_threads": 2}. Settings not given keep
+        robotpy's defaults.
     """
     detector = AprilTagDetector()
     detector.addFamily(tag_family)
+    if config:
+        apply_detector_config(detector, config)
     return detector
 
+def apply_detector_config(detector, config):
+    """
+    Change some settings of an existing detector.
+    """
+    groups = {"config": detector.getConfig(), "quad": detector.getQuadThresholdParameters()}
+    for name, value in config.items():
+        if name not in DETECTOR_PARAMS:
+            raise ValueError(f"Unknown detector setting '{name}' (known: {', '.join(DETECTOR_PARAMS)})")
+        group, attribute, kind = DETECTOR_PARAMS[name]
+        setattr(groups[group], attribute, kind(value))
+    detector.setConfig(groups["config"])
+    detector.setQuadThresholdParameters(groups["quad"])
+
+def detector_config(detector):
+    """
+    Every setting of a detector, by DETECTOR_PARAMS name.
+    """
+    groups = {"config": detector.getConfig(), "quad": detector.getQuadThresholdParameters()}
+    return {name: getattr(groups[group], attribute) for name, (group, attribute, _) in DETECTOR_PARAMS.items()}
+
+def parse_detector_setting(text):
+    """
+    Parse a command line "name=value" detector setting into (name, value).
+    """
+    name, sep, value = text.partition("=")
+    name = name.strip()
+    if not sep or name not in DETECTOR_PARAMS:
+        raise ValueError(f"Bad detector setting '{text}'; expected NAME=VALUE with NAME one of "
+                         f"{', '.join(DETECTOR_PARAMS)}")
+    kind = DETECTOR_PARAMS[name][2]
+    value = value.strip()
+    try:
+        if kind is bool:
+            if value.lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+                raise ValueError(value)
+            return name, value.lower() in ("1", "true", "yes", "on")
+        return name, kind(value)
+    except ValueError:
+        raise ValueError(f"Bad value for detector setting {name}: '{value}'")
+
+def load_detector_config(path=None, settings=()):
+    """
+    Detector settings from a JSON file (such as one written by src.autotune)
+    with "name=value" command line settings applied on top.
+
+    Returns:
+      dict: Settings for create_detector (empty for all defaults).
+    """
+    config = {}
+    if path:
+        with open(path) as f:
+            data = json.load(f)
+        # autotune files keep the settings next to the tuning results
+        data = data.get("detector", data)
+        for name, value in data.items():
+            if name not in DETECTOR_PARAMS:
+                raise ValueError(f"Unknown detector setting '{name}' in {path}")
+            config[name] = value
+    for text in settings:
+        name, value = parse_detector_setting(text)
+        config[name] = value
+    return config
+
 def detect_tags(frame, detector):
     """
     Convert the input frame to grayscale and detect AprilTags.
@@ -21,10 +110,29 @@ def detect_tags(frame, detector):
     Returns:
       list: Detected AprilTag objects.
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    detections = detector.detect(gray)
+    gray = to_gray(frame)
+    detections = run_detector(detector, gray)
     return detections
 
+def run_detector(detector, gray):
+    """
+    detector.detect() that leaves `gray` untouched: without decimation the
+    AprilTag library applies the quad_sigma blur to the input image in place,
+    which would blur the caller's frame (preview, recording, later passes).
+    """
+    config = detector.getConfig()
+    if config.quadSigma != 0 and config.quadDecimate <= 1:
+        gray = gray.copy()
+    return detector.detect(gray)
+
+def to_gray(frame):
+    """
+    Return a single-channel view of the frame, converting BGR input.
+    """
+    if frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
 def get_detection_corners(detection):
     """
     Retrieve the corner points from a detection.
@@ -38,9 +146,524 @@ def get_detection_corners(detection):
     corners = np.array(corners_tuple, dtype=np.float32).reshape((4, 2))
     return corners
 
+class TagDetection:
+    """
+    A detection whose corners have been mapped back to full-frame coordinates.
+    Mirrors the getters of robotpy's AprilTagDetection used in this package,
+    so it can be passed anywhere a detection is expected.
+    """
+
+    class Point:
+        __slots__ = ("x", "y")
+
+        def __init__(self, x, y):
+            self.x = x
+            self.y = y
+
+    def __init__(self, tag_id, corners, center, decision_margin=0.0, hamming=0):
+        self._id = tag_id
+        self._corners = np.asarray(corners, dtype=np.float32).reshape((4, 2))
+        self._center = TagDetection.Point(float(center[0]), float(center[1]))
+        self._decision_margin = decision_margin
+        self._hamming = hamming
+
+    def getId(self):
+        return self._id
+
+    def getCorners(self, buf=None):
+        return tuple(float(v) for v in self._corners.ravel())
+
+    def getCenter(self):
+        return self._center
+
+    def getDecisionMargin(self):
+        return self._decision_margin
+
+    def getHamming(self):
+        return self._hamming
+
+def detect_region(gray, detector, x0, y0, x1, y1, scale=1.0):
+    """
+    Detect tags inside a rectangular region of a grayscale frame.
+    
+    Parameters:
+      gray (np.ndarray): Full grayscale frame.
+      detector: An instance of AprilTagDetector.
+      x0, y0, x1, y1 (int): Region bounds in full-frame pixels (exclusive end).
+      scale (float): Upscale factor applied to the crop before detection.
+      
+    Returns:
+      list: TagDetection objects in full-frame coordinates.
+    """
+    # The detector silently finds nothing in non-contiguous views
+    crop = np.ascontiguousarray(gray[y0:y1, x0:x1])
+    if scale != 1.0:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    
+    offset = np.array([x0, y0], dtype=np.float32)
+    detections = []
+    for detection in run_detector(detector, crop):
+        corners = get_detection_corners(detection)
+        center = detection.getCenter()
+        center = np.array([center.x, center.y], dtype=np.float32)
+        # Map pixel centres of the resized crop back to the source pixels
+        corners = (corners + 0.5) / scale - 0.5 + offset
+        center = (center + 0.5) / scale - 0.5 + offset
+        detections.append(TagDetection(detection.getId(), corners, center,
+                                       detection.getDecisionMargin(), detection.getHamming()))
+    return detections
+
+class MultiScaleDetector:
+    """
+    Find small tags without upscaling the whole frame.
+    
+    Each frame is first searched at native resolution. Only candidate
+    regions are then upscaled: dark convex quads with light holes (a tag's
+    black border around its data bits) found by a cheap adaptive threshold
+    of the native frame that the native pass did not decode, plus windows
+    around tags that the previous frame found only when upscaled. When the
+    candidates cover more than `max_area` of the frame (a cluttered scene),
+    the whole frame is upscaled instead, so the cost never exceeds a native
+    pass plus a blanket resize. Results from the different scales are
+    de-duplicated by tag ID.
+    
+    Parameters:
+      scale (float): Upscale factor for the candidate pass.
+      min_side (int): Smallest candidate quad in native pixels.
+      max_side (int): Largest candidate quad; bigger tags are left to the
+        native pass.
+      padding (float): Padding around candidate quads as a fraction of their size.
+      max_area (float): Fraction of the frame above which the whole frame is upscaled.
+      hint_padding (float): Padding around remembered tags as a fraction of their size.
+    """
+    # Adaptive threshold of the candidate search: neighbourhood size and
+    # how much darker than it a pixel must be
+    THRESHOLD_BLOCK = 31
+    THRESHOLD_OFFSET = 8
+    # Candidates at least this large must enclose a light hole
+    HOLE_SIDE = 12
+
+    def __init__(self, scale=2.0, min_side=8, max_side=160, padding=0.25, max_area=0.5, hint_padding=1.0):
+        self.scale = scale
+        self.min_side = min_side
+        self.max_side = max_side
+        self.padding = padding
+        self.max_area = max_area
+        self.hint_padding = hint_padding
+        self.hints = {}
+        self.pixels_processed = 0
+        self.candidates_found = 0
+        self.full_frame_passes = 0
+
+    def _hint_region(self, corners, shape):
+        height, width = shape[:2]
+        lo = corners.min(axis=0)
+        hi = corners.max(axis=0)
+        pad = max((hi - lo).max() * self.hint_padding, self.min_side)
+        x0, y0 = np.floor(lo - pad).astype(int)
+        x1, y1 = np.ceil(hi + pad).astype(int)
+        return max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+
+    def candidates(self, gray, found=()):
+        """
+        Regions of `gray` that look like undecoded tags.
+
+        Parameters:
+          gray (np.ndarray): Native-resolution grayscale frame.
+          found (list): 4x2 corners of tags already decoded; quads inside
+            them are skipped.
+
+        Returns:
+          list: Padded (x0, y0, x1, y1) regions in full-frame pixels.
+        """
+        height, width = gray.shape[:2]
+        binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV,
+                                       self.THRESHOLD_BLOCK, self.THRESHOLD_OFFSET)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            return []
+        taken = [(corners.min(axis=0), corners.max(axis=0)) for corners in found]
+        regions = []
+        for contour, (_, _, child, parent) in zip(contours, hierarchy[0]):
+            if parent >= 0:
+                # The outline of a hole
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            side = max(w, h)
+            if side < self.min_side or side > self.max_side or min(w, h) < 0.3 * side:
+                continue
+            if side >= self.HOLE_SIDE and child < 0:
+                # Solid blob: no data bits inside
+                continue
+            hull = cv2.convexHull(contour)
+            area = cv2.contourArea(hull)
+            if area < 0.8 * cv2.contourArea(contour) or area < 0.25 * w * h:
+                continue
+            if len(cv2.approxPolyDP(hull, 0.08 * cv2.arcLength(hull, True), True)) != 4:
+                continue
+            cx, cy = x + w / 2, y + h / 2
+            if any(lo[0] <= cx <= hi[0] and lo[1] <= cy <= hi[1] for lo, hi in taken):
+                continue
+            pad = int(side * self.padding) + 4
+            regions.append((max(x - pad, 0), max(y - pad, 0), min(x + w + pad, width), min(y + h + pad, height)))
+        self.candidates_found += len(regions)
+        return regions
+
+    def detect(self, frame, detector):
+        """
+        Detect tags at native resolution plus upscaled candidate regions.
+        
+        Returns:
+          list: One detection per tag ID, in full-frame coordinates.
+        """
+        gray = to_gray(frame)
+        found = {}
+        for detection in run_detector(detector, gray):
+            found[detection.getId()] = detection
+        self.pixels_processed += gray.shape[0] * gray.shape[1]
+        if self.scale == 1.0:
+            return list(found.values())
+        
+        regions = [self._hint_region(c, gray.shape) for tag_id, c in self.hints.items()
+                   if tag_id not in found]
+        regions += self.candidates(gray, [get_detection_corners(d) for d in found.values()])
+        regions = merge_regions(regions)
+        height, width = gray.shape[:2]
+        if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions) > self.max_area * width * height:
+            self.full_frame_passes += 1
+            regions = [(0, 0, width, height)]
+        
+        upscaled = {}
+        for x0, y0, x1, y1 in regions:
+            self.pixels_processed += int((x1 - x0) * (y1 - y0) * self.scale * self.scale)
+            for detection in detect_region(gray, detector, x0, y0, x1, y1, self.scale):
+                tag_id = detection.getId()
+                if tag_id in found:
+                    continue
+                best = upscaled.get(tag_id)
+                if best is None or detection.getDecisionMargin() > best.getDecisionMargin():
+                    upscaled[tag_id] = detection
+        
+        # Remember tags that needed upscaling so they are searched every frame
+        self.hints = {tag_id: get_detection_corners(d) for tag_id, d in upscaled.items()}
+        found.update(upscaled)
+        return list(found.values())
+
+def merge_regions(regions):
+    """
+    Merge overlapping (x0, y0, x1, y1) regions into their bounding boxes,
+    so no pixel is upscaled twice.
+    """
+    merged = [list(region) for region in regions]
+    changed = True
+    while changed:
+        changed = False
+        out = []
+        for region in merged:
+            for other in out:
+                if (region[0] < other[2] and other[0] < region[2] and
+                        region[1] < other[3] and other[1] < region[3]):
+                    other[:] = [min(other[0], region[0]), min(other[1], region[1]),
+                                max(other[2], region[2]), max(other[3], region[3])]
+                    changed = True
+                    break
+            else:
+                out.append(region)
+        merged = out
+    return [tuple(region) for region in merged]
+
+class ROITracker:
+    """
+    Track one tag by searching a predicted window around its last position.
+    
+    After the target has been found, only a padded crop around its predicted
+    next position is searched. A full-frame scan is done after `max_misses`
+    consecutive misses inside the window and every `full_scan_period` frames,
+    so the target (and any other tags) can always be reacquired.
+    
+    Parameters:
+      target_id (int): ID of the tag to track.
+      padding (float): Window padding as a fraction of the tag's bounding box size.
+      min_size (int): Minimum side length of the search window in pixels.
+      max_misses (int): Consecutive window misses before a full-frame scan.
+      full_scan_period (int): Force a full-frame scan every N frames (0 disables).
+      upscale (float): Upscale factor applied to every search.
+      small_tag_px (float): Crops around tags smaller than this are upscaled
+        (up to 2x) even when `upscale` is 1.
+      scanner (MultiScaleDetector): Used for full-frame scans instead of
+        upscaling the whole frame, if given.
+    """
+
+    def __init__(self, target_id, padding=1.0, min_size=96, max_misses=3,
+                 full_scan_period=30, upscale=1.0, small_tag_px=24, scanner=None):
+        self.target_id = target_id
+        self.padding = padding
+        self.min_size = min_size
+        self.max_misses = max_misses
+        self.full_scan_period = full_scan_period
+        self.upscale = upscale
+        self.small_tag_px = small_tag_px
+        self.scanner = scanner
+        self.last_corners = None
+        self.velocity = np.zeros(2, dtype=np.float32)
+        self.misses = 0
+        self.frames_since_full = 0
+        self.roi_scans = 0
+        self.full_scans = 0
+
+    def reset(self):
+        self.last_corners = None
+        self.velocity[:] = 0
+        self.misses = 0
+
+    def predict_roi(self, frame_shape):
+        """
+        Return the (x0, y0, x1, y1) search window for the next frame,
+        or None when a full-frame scan is due.
+        """
+        if self.last_corners is None or self.misses >= self.max_misses:
+            return None
+        if self.full_scan_period and self.frames_since_full >= self.full_scan_period:
+            return None
+        
+        height, width = frame_shape[:2]
+        lo = self.last_corners.min(axis=0) + self.velocity
+        hi = self.last_corners.max(axis=0) + self.velocity
+        # Widen the window further for every frame the tag was not found
+        pad = (hi - lo).max() * self.padding * (1 + self.misses)
+        center = (lo + hi) / 2
+        half = np.maximum((hi - lo) / 2 + pad, self.min_size / 2)
+        x0, y0 = np.floor(center - half).astype(int)
+        x1, y1 = np.ceil(center + half).astype(int)
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, width), min(y1, height)
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        return x0, y0, x1, y1
+
+    def _roi_scale(self):
+        scale = self.upscale
+        if self.last_corners is not None and self.small_tag_px:
+            side = np.linalg.norm(self.last_corners[0] - self.last_corners[1])
+            if 0 < side < self.small_tag_px:
+                scale = max(scale, min(2.0, self.small_tag_px / side))
+        return scale
+
+    def detect(self, frame, detector):
+        """
+        Detect tags, searching only the predicted window when possible.
+        
+        Returns:
+          list: Detections with corners in full-frame coordinates.
+        """
+        gray = to_gray(frame)
+        roi = self.predict_roi(gray.shape)
+        if roi is None:
+            self.full_scans += 1
+            self.frames_since_full = 0
+            if self.scanner is not None:
+                detections = self.scanner.detect(gray, detector)
+            else:
+                height, width = gray.shape[:2]
+                detections = detect_region(gray, detector, 0, 0, width, height, self.upscale)
+        else:
+            self.roi_scans += 1
+            self.frames_since_full += 1
+            detections = detect_region(gray, detector, *roi, self._roi_scale())
+        
+        for detection in detections:
+            if detection.getId() == self.target_id:
+                corners = get_detection_corners(detection)
+                if self.last_corners is not None and self.misses == 0:
+                    self.velocity = corners.mean(axis=0) - self.last_corners.mean(axis=0)
+                else:
+                    self.velocity[:] = 0
+                self.last_corners = corners
+                self.misses = 0
+                return detections
+        
+        if roi is None:
+            # Not visible anywhere; keep scanning the full frame
+            self.reset()
+        else:
+            self.misses += 1
+        return detections
+
+PNP_METHODS = {
+    "iterative": cv2.SOLVEPNP_ITERATIVE,
+    "ippe_square": cv2.SOLVEPNP_IPPE_SQUARE,
+    "ippe": cv2.SOLVEPNP_IPPE,
+    "sqpnp": cv2.SOLVEPNP_SQPNP,
+}
+
+# IPPE_SQUARE needs its own corner order, which is ours mirrored in y; a pose
+# solved in that frame is converted back by a 180 degree turn about x.
+_FLIP_X = np.diag([1.0, -1.0, -1.0])
+
+def tag_object_points(tag_size, ippe_order=False):
+    """
+    Object points of the tag corners in the tag's coordinate system, in the
+    order returned by get_detection_corners. Cached per tag size.
+    """
+    key = (tag_size, ippe_order)
+    points = _object_points_cache.get(key)
+    if points is None:
+        half_size = tag_size / 2.0
+        sign = -1.0 if ippe_order else 1.0
+        points = np.array([
+            [-half_size, -half_size * sign, 0.0],
+            [ half_size, -half_size * sign, 0.0],
+            [ half_size,  half_size * sign, 0.0],
+            [-half_size,  half_size * sign, 0.0]
+        ], dtype=np.float32)
+        _object_points_cache[key] = points
+    return points
+
+_object_points_cache = {}
+
+class PoseEstimator:
+    """
+    Stateful tag pose solver.
+    
+    Keeps the previous pose of every tag ID and uses it to warm-start the next
+    solve: as the initial guess for the iterative solver, or to pick between
+    the two mirror solutions the IPPE solvers return, which is what usually
+    makes planar tag poses flicker.
+    
+    Parameters:
+      camera_matrix (np.ndarray): The 3x3 camera intrinsic matrix.
+      dist_coeffs (np.ndarray): Distortion coefficients.
+      tag_size (float): Default side length of the tags in meters.
+      method (str): One of PNP_METHODS.
+      warm_start (bool): Seed each solve from the tag's previous pose.
+      tag_sizes (dict): Optional per-ID tag sizes overriding `tag_size`.
+      max_age (float): Previous poses older than this (seconds) are ignored.
+      calibration: Optional config.calibration.CameraCalibration. With it the
+        intrinsics follow the size of the frames (see set_frame_size) and
+        corners are undistorted before solving, replacing camera_matrix and
+        dist_coeffs.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, tag_size, method="ippe_square",
+                 warm_start=True, tag_sizes=None, max_age=0.5, calibration=None):
+        if method not in PNP_METHODS:
+            raise ValueError(f"Unknown PnP method: {method}")
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self.tag_size = tag_size
+        self.tag_sizes = tag_sizes or {}
+        self.method = method
+        self.warm_start = warm_start
+        self.max_age = max_age
+        self._flags = PNP_METHODS[method]
+        self._last = {}
+        self.calibration = calibration
+        self._undistort = None
+        self._frame_size = None
+        if calibration is not None:
+            self.set_frame_size(calibration.image_size)
+
+    def reset(self):
+        self._last.clear()
+
+    def set_frame_size(self, size):
+        """
+        Use intrinsics for frames of `size` (width, height), rescaled from
+        the calibrated resolution. Only does work when the size changes.
+        """
+        if self.calibration is None or size == self._frame_size:
+            return
+        scaled = self.calibration.scaled(size)
+        self.camera_matrix = scaled.camera_matrix
+        # Corners are undistorted before the solve
+        self.dist_coeffs = None
+        self._undistort = scaled.undistort_points if scaled.has_distortion else None
+        self._frame_size = size
+        self._last.clear()
+
+    def _previous(self, tag_id, now):
+        if not self.warm_start:
+            return None
+        last = self._last.get(tag_id)
+        if last is None or now - last[2] > self.max_age:
+            return None
+        return last
+
+    def solve(self, tag_id, corners, now=None):
+        """
+        Solve the pose of one tag from its 4x2 image corners.
+        
+        Returns:
+          (rvec, tvec, error) with the RMS reprojection error in pixels, or
+          (None, None, None) if the solve failed.
+        """
+        now = time.monotonic() if now is None else now
+        size = self.tag_sizes.get(tag_id, self.tag_size)
+        previous = self._previous(tag_id, now)
+        ippe_square = self._flags == cv2.SOLVEPNP_IPPE_SQUARE
+        obj_points = tag_object_points(size, ippe_square)
+        if self._undistort is not None:
+            corners = self._undistort(corners).astype(np.float32)
+        
+        if self._flags == cv2.SOLVEPNP_ITERATIVE and previous is not None:
+            count, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+                obj_points, corners, self.camera_matrix, self.dist_coeffs,
+                useExtrinsicGuess=True, flags=self._flags,
+                rvec=previous[0].copy(), tvec=previous[1].copy())
+        else:
+            count, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+                obj_points, corners, self.camera_matrix, self.dist_coeffs, flags=self._flags)
+        if not count:
+            return None, None, None
+        
+        errors = np.asarray(errors).ravel()
+        if ippe_square:
+            rvecs = [cv2.Rodrigues(cv2.Rodrigues(r)[0] @ _FLIP_X)[0] for r in rvecs]
+        
+        best = int(np.argmin(errors))
+        if previous is not None and count > 1:
+            # Prefer the solution closest in rotation to the previous pose,
+            # unless it fits the corners much worse
+            prev_rot = cv2.Rodrigues(previous[0])[0]
+            angles = [np.arccos(np.clip((np.trace(prev_rot.T @ cv2.Rodrigues(r)[0]) - 1) / 2, -1, 1))
+                      for r in rvecs]
+            closest = int(np.argmin(angles))
+            if errors[closest] <= max(4 * errors[best], 1.0):
+                best = closest
+        
+        rvec = np.asarray(rvecs[best], dtype=np.float64).reshape((3, 1))
+        tvec = np.asarray(tvecs[best], dtype=np.float64).reshape((3, 1))
+        self._last[tag_id] = (rvec, tvec, now)
+        return rvec, tvec, float(errors[best])
+
+    def estimate(self, detection, now=None):
+        """
+        Solve the pose of one detection. Returns (rvec, tvec, error).
+        """
+        return self.solve(detection.getId(), get_detection_corners(detection), now)
+
+    def estimate_all(self, detections, tag_ids=None, now=None):
+        """
+        Solve every detection in a frame, optionally only the given IDs.
+        
+        Returns:
+          dict: tag ID -> (rvec, tvec, error) for each successful solve.
+        """
+        now = time.monotonic() if now is None else now
+        poses = {}
+        for detection in detections:
+            tag_id = detection.getId()
+            if tag_ids is not None and tag_id not in tag_ids:
+                continue
+            rvec, tvec, error = self.estimate(detection, now)
+            if rvec is not None:
+                poses[tag_id] = (rvec, tvec, error)
+        return poses
+
 def estimate_pose(detection, camera_matrix, dist_coeffs, tag_size):
     """
     Estimate the 3D pose (rotation and translation) of the detected tag.
+    Stateless wrapper around PoseEstimator using the iterative solver.
     
     Parameters:
       detection: A detected AprilTag object.
@@ -51,19 +674,8 @@ def estimate_pose(detection, camera_matrix, dist_coeffs, tag_size):
     Returns:
       (rvec, tvec) if successful, or (None, None).
     """
-    half_size = tag_size / 2.0
-    # Define the object points of the tag corners in the tag's coordinate system.
-    obj_points = np.array([
-        [-half_size, -half_size, 0.0],
-        [ half_size, -half_size, 0.0],
-        [ half_size,  half_size, 0.0],
-        [-half_size,  half_size, 0.0]
-    ], dtype=np.float32)
-    
-    img_points = get_detection_corners(detection)
-    success, rvec, tvec = cv2.solvePnP(obj_points, img_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
-    if not success:
-        return None, None
+    estimator = PoseEstimator(camera_matrix, dist_coeffs, tag_size, method="iterative", warm_start=False)
+    rvec, tvec, _ = estimator.estimate(detection)
     return rvec, tvec
 
 def draw_detections(frame, detections, target_id=None):
@@ -73,17 +685,18 @@ def draw_detections(frame, detections, target_id=None):
     Parameters:
       frame (np.ndarray): The image frame.
       detections (list): List of detected tag objects.
-      target_id (int): ID of the target tag to highlight in green.
+      target_id (int or collection): ID(s) of the target tags to highlight in green.
       
     Returns:
       np.ndarray: The annotated frame.
     """
+    target_ids = target_id if isinstance(target_id, (list, tuple, set, frozenset)) else (target_id,)
     for detection in detections:
         corners = get_detection_corners(detection).astype(int)
         tag_id = detection.getId()
         
-        # Use green for target tag, blue for others
-        color = (0, 255, 0) if tag_id == target_id else (255, 0, 0)
+        # Use green for target tags, blue for others
+        color = (0, 255, 0) if tag_id in target_ids else (255, 0, 0)
         
         cv2.polylines(frame, [corners.reshape((-1, 1, 2))], isClosed=True, color=color, thickness=2)
         center = detection.getCenter()
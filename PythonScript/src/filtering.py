@@ -0,0 +1,312 @@
+import cv2
+import time
+import threading
+import numpy as np
+
+# 99.9% quantile of the chi-square distribution with 3 degrees of freedom
+DEFAULT_GATE = 16.27
+
+def _rotation(rvec):
+    return cv2.Rodrigues(np.asarray(rvec, dtype=np.float64).reshape((3, 1)))[0]
+
+def _log(R):
+    return cv2.Rodrigues(R)[0].ravel()
+
+class PoseFilter:
+    """
+    Filter for the pose of one tag.
+
+    Position: constant-velocity Kalman filter, one independent 2-state
+    (position, velocity) filter per axis so the depth axis can be given the
+    larger measurement noise PnP has along the optical axis.
+    Rotation: alpha-beta filter on SO(3) with an angular velocity estimate.
+
+    Measurements whose position innovation fails the chi-square gate, or
+    whose rotation jumps by more than max_rotation_jump (typically the IPPE
+    mirror solution), are rejected. After max_rejects rejections in a row
+    the filter restarts from the measurement, so a tag that really moved is
+    picked up again.
+
+    Parameters:
+      process_noise (float): Acceleration noise density (m/s^2).
+      measurement_noise (tuple): Position noise (x, y, z) of one solve (m).
+      rotation_alpha (float): Rotation correction gain (0..1).
+      rotation_beta (float): Angular velocity correction gain (0..1).
+      gate (float): Mahalanobis distance squared above which a position is rejected.
+      max_rotation_jump (float): Largest accepted rotation innovation (rad).
+      max_rejects (int): Consecutive rejections before a restart.
+    """
+
+    def __init__(self, process_noise=1.0, measurement_noise=(0.002, 0.002, 0.01), rotation_alpha=0.5,
+                 rotation_beta=0.1, gate=DEFAULT_GATE, max_rotation_jump=0.5, max_rejects=3):
+        self.process_noise = process_noise
+        self.measurement_var = np.square(np.asarray(measurement_noise, dtype=np.float64))
+        self.rotation_alpha = rotation_alpha
+        self.rotation_beta = rotation_beta
+        self.gate = gate
+        self.max_rotation_jump = max_rotation_jump
+        self.max_rejects = max_rejects
+        self.reset()
+
+    def reset(self):
+        self.x = np.zeros((3, 2))          # per axis: position, velocity
+        self.P = np.zeros((3, 2, 2))       # per axis covariance
+        self.R = np.eye(3)
+        self.omega = np.zeros(3)           # angular velocity (rad/s, body frame)
+        self.timestamp = None
+        self.rejects = 0
+
+    @property
+    def initialized(self):
+        return self.timestamp is not None
+
+    def _start(self, R, position, timestamp):
+        self.x[:, 0] = position
+        self.x[:, 1] = 0.0
+        self.P[:] = 0.0
+        self.P[:, 0, 0] = self.measurement_var
+        # Unknown velocity: allow a few m/s
+        self.P[:, 1, 1] = 4.0
+        self.R = R
+        self.omega[:] = 0.0
+        self.timestamp = timestamp
+        self.rejects = 0
+
+    def _propagate(self, dt):
+        """
+        Predicted (x, P) of the position filter after dt seconds.
+        """
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        q = self.process_noise ** 2
+        Q = q * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        x = self.x @ F.T
+        P = F @ self.P @ F.T + Q
+        return x, P
+
+    def update(self, rvec, tvec, timestamp):
+        """
+        Correct the filter with a measured pose.
+
+        Returns:
+          str: "accepted", "rejected" or "restarted".
+        """
+        R_meas = _rotation(rvec)
+        position = np.asarray(tvec, dtype=np.float64).ravel()
+        if not self.initialized:
+            self._start(R_meas, position, timestamp)
+            return "accepted"
+
+        dt = max(timestamp - self.timestamp, 0.0)
+        x, P = self._propagate(dt)
+        innovation = position - x[:, 0]
+        S = P[:, 0, 0] + self.measurement_var
+        R_pred = self.R @ _rotation(self.omega * dt)
+        rotation_error = _log(R_pred.T @ R_meas)
+
+        if (np.sum(innovation ** 2 / S) > self.gate
+                or np.linalg.norm(rotation_error) > self.max_rotation_jump):
+            self.rejects += 1
+            if self.rejects < self.max_rejects:
+                return "rejected"
+            self._start(R_meas, position, timestamp)
+            return "restarted"
+
+        K = P[:, :, 0] / S[:, None]
+        self.x = x + K * innovation[:, None]
+        self.P = P - K[:, :, None] * P[:, 0, None, :]
+        self.R = R_pred @ _rotation(self.rotation_alpha * rotation_error)
+        if dt > 0:
+            self.omega += self.rotation_beta * rotation_error / dt
+        self.timestamp = timestamp
+        self.rejects = 0
+        return "accepted"
+
+    def predict(self, timestamp):
+        """
+        Extrapolate the filtered pose to `timestamp` without changing the state.
+
+        Returns:
+          (rvec, tvec) as (3, 1) arrays, or (None, None) before the first update.
+        """
+        if not self.initialized:
+            return None, None
+        dt = timestamp - self.timestamp
+        tvec = (self.x[:, 0] + self.x[:, 1] * dt).reshape((3, 1))
+        rvec = cv2.Rodrigues(self.R @ _rotation(self.omega * dt))[0]
+        return rvec, tvec
+
+class PoseFilterBank:
+    """
+    One PoseFilter per tag ID, plus the reprojection error check that runs
+    before a solve reaches its filter. Safe to use from the vision loop and
+    the prediction thread at the same time.
+
+    Parameters:
+      max_reprojection_error (float): Solves with a larger RMS reprojection
+        error (pixels) are dropped.
+      max_coast (float): Seconds a tag keeps being predicted after its last
+        accepted measurement.
+      **filter_args: Passed to every PoseFilter.
+    """
+
+    def __init__(self, max_reprojection_error=3.0, max_coast=0.3, **filter_args):
+        self.max_reprojection_error = max_reprojection_error
+        self.max_coast = max_coast
+        self.filter_args = filter_args
+        self.filters = {}
+        self.lock = threading.Lock()
+        self.stats = {"accepted": 0, "rejected_reprojection": 0, "rejected_gate": 0, "restarts": 0}
+
+    def update(self, poses, timestamp):
+        """
+        Filter one frame's poses.
+
+        Parameters:
+          poses (dict): tag ID -> (detection, rvec, tvec, error).
+          timestamp (float): Capture time of the frame (time.monotonic()).
+
+        Returns:
+          dict: tag ID -> (detection, rvec, tvec, error) with the filtered pose
+          at `timestamp`, for the measurements that were accepted.
+        """
+        accepted = {}
+        with self.lock:
+            for tag_id, (detection, rvec, tvec, error) in poses.items():
+                if error is not None and error > self.max_reprojection_error:
+                    self.stats["rejected_reprojection"] += 1
+                    continue
+                pose_filter = self.filters.get(tag_id)
+                if pose_filter is None:
+                    pose_filter = self.filters[tag_id] = PoseFilter(**self.filter_args)
+                elif timestamp - pose_filter.timestamp > self.max_coast:
+                    # Lost for too long: the old state says nothing useful
+                    pose_filter.reset()
+                result = pose_filter.update(rvec, tvec, timestamp)
+                if result == "rejected":
+                    self.stats["rejected_gate"] += 1
+                    continue
+                if result == "restarted":
+                    self.stats["restarts"] += 1
+                self.stats["accepted"] += 1
+                rvec, tvec = pose_filter.predict(timestamp)
+                accepted[tag_id] = (detection, rvec, tvec, error)
+        return accepted
+
+    def predict(self, tag_ids, timestamp):
+        """
+        Extrapolated poses of the given tags at `timestamp`, in the order
+        given, skipping tags not measured within max_coast.
+
+        Returns:
+          list: (tag_id, rvec, tvec) tuples.
+        """
+        predicted = []
+        with self.lock:
+            for tag_id in tag_ids:
+                pose_filter = self.filters.get(tag_id)
+                if pose_filter is None or not pose_filter.initialized:
+                    continue
+                if timestamp - pose_filter.timestamp > self.max_coast:
+                    continue
+                rvec, tvec = pose_filter.predict(timestamp)
+                predicted.append((tag_id, rvec, tvec))
+        return predicted
+
+    def summary(self):
+        stats = self.stats
+        return (f"{stats['accepted']} accepted, {stats['rejected_reprojection']} rejected (reprojection), "
+                f"{stats['rejected_gate']} rejected (gate), {stats['restarts']} restarts")
+
+class PredictionStage:
+    """
+    Sends latency-compensated poses: each frame's filtered poses, and
+    predicted ones in between frames at a fixed rate.
+
+    Every pose is extrapolated to "now + lead", the time it is expected to
+    reach the board, so the capture, detection and queueing delay is
+    already behind it, and lead covers the serial link.
+
+    Parameters:
+      bank (PoseFilterBank): Filters of the tags.
+      send: Callable (poses, timestamp) taking (tag_id, rvec, tvec) tuples,
+        e.g. send_data.targets_detected_action.
+      rate (float): Prediction rate in Hz (0: only send on new frames).
+      lead: Seconds to extrapolate past now, or a callable returning it.
+    """
+
+    def __init__(self, bank, send, rate=50.0, lead=0.0):
+        self.bank = bank
+        self.send = send
+        self.period = 1.0 / rate if rate > 0 else None
+        self.lead = lead if callable(lead) else (lambda: lead)
+        self.frames_sent = 0
+        self.predictions_sent = 0
+        self._tag_ids = []
+        self._last_sent = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.period is not None:
+            self._thread = threading.Thread(target=self._run, name="pose-prediction", daemon=True)
+            self._thread.start()
+
+    def _emit(self, tag_ids, now):
+        at_time = now + self.lead()
+        poses = self.bank.predict(tag_ids, at_time)
+        if poses:
+            self.send(poses, at_time)
+        return poses
+
+    def current(self, now):
+        """
+        Poses of the last published tags extrapolated to now + lead, for a
+        sender with its own clock (CommandScheduler's `predict`).
+
+        Returns:
+          (poses, at_time): (tag_id, rvec, tvec) list and the time it is for.
+        """
+        with self._lock:
+            tag_ids = self._tag_ids
+        at_time = now + self.lead()
+        return self.bank.predict(tag_ids, at_time), at_time
+
+    def publish(self, tag_ids):
+        """
+        Send the current poses of `tag_ids` (priority order) right after a
+        frame updated the filters; later predictions follow the same order.
+
+        Returns:
+          list: The (tag_id, rvec, tvec) sent.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._tag_ids = list(tag_ids)
+            self._last_sent = now
+        poses = self._emit(tag_ids, now)
+        if poses:
+            self.frames_sent += 1
+        return poses
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Fell behind (e.g. the process was descheduled): skip ahead
+                next_time = time.monotonic()
+            now = time.monotonic()
+            with self._lock:
+                tag_ids = self._tag_ids
+                due = now - self._last_sent >= self.period
+                if due:
+                    self._last_sent = now
+            if due and tag_ids and self._emit(tag_ids, now):
+                self.predictions_sent += 1
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
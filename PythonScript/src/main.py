@@ -1,14 +1,40 @@
 #python3 -m src.main --source 0 --target 27 --upscale 1 --tag_size 0.018
 # camera device index, target id, zoom factor, tag size in meters
+#python3 -m src.main --target 27 --pipeline --workers 3   (threaded capture/detect/display)
+#python3 -m src.main --source synthetic --target 27        (no camera needed; also a video file or image folder)
+#python3 -m src.main --target 27 --headless --stream 8080   (no window; MJPEG preview on localhost)
+#python3 -m src.main --targets 1-5,27 --priority nearest --protocol binary   (several targets, one message per frame)
+#python3 -m src.main --target 27 --protocol binary --filter --predict_rate 50   (filtered, latency-compensated poses)
+#python3 -m src.main --target 27 --protocol binary --send_rate 100   (commands on a fixed 100 Hz clock, keep-alive/stop when lost)
+#python3 -m src.main --target 27 --serial_port /dev/ttyACM0   (fixed port instead of finding the board by USB ID)
+#python3 -m src.main --target 27 --quiet --metrics_port 9100   (Prometheus text at /metrics, stage latencies logged every 10s)
+#python3 -m src.main --target 27 --record run.rec --record_keyframes 30   (flight recorder; python3 -m src.recorder run.rec)
 
+import time
+STARTUP_TIME = time.monotonic()
 import cv2
 import argparse
+import functools
+import threading
 import numpy as np
-import time
-from picamera2 import Picamera2
-from config.calibration import load_calibration
-from .detector import create_detector, detect_tags, estimate_pose, draw_detections
-from .send_data import target_detected_action
+from config.calibration import CameraCalibration
+from .detector import (create_detector, detect_tags, draw_detections, ROITracker, MultiScaleDetector, PoseEstimator,
+                       PNP_METHODS, load_detector_config)
+from .send_data import (targets_detected_action, set_protocol, set_send_rate, set_verbose, set_recorder,
+                        set_scheduler, set_ports, initialize_serial, link_latency, send_poses, send_control)
+from .connection import parse_usb_id
+from .pipeline import run_pipeline
+from .process_pool import run_process_pipeline
+from .capture import open_source, pool_size, to_display
+from .preview import PreviewStage, WINDOW_NAME
+from .tracker import TargetTable, parse_targets, PRIORITIES
+from .filtering import PoseFilterBank, PredictionStage
+from .scheduler import CommandScheduler
+from .metrics import metrics, MetricsServer, MetricsLogger
+from .recorder import FlightRecorder
+
+startup_events = {}
+CAPTURE_SIZE = (1280, 720)
 
 def draw_info_overlay(frame, target_detected, tag_id, x, y, z, distance):
     """
@@ -50,48 +76,24 @@ def draw_info_overlay(frame, target_detected, tag_id, x, y, z, distance):
     
     return frame
 
-def main():
-    print("Starting program initialization...")
-    parser = argparse.ArgumentParser(description="Continuous AprilTag 3D Pose Estimation using robotpy-apriltag")
-    parser.add_argument('--source', type=str, default="0",
-                        help="Video source: device index (e.g., 0) or URL for your Camo feed.")
-    parser.add_argument('--upscale', type=float, default=1.0,
-                        help="Upscale factor for frames (e.g., 1.5) to help detect small tags.")
-    parser.add_argument('--target', type=int, required=True,
-                        help="Desired AprilTag ID that triggers the action.")
-    parser.add_argument('--tag_size', type=float, default=0.0508,
-                        help="Real-world tag size in meters (default ~2 inches = 0.0508 m).")
-    parser.add_argument('--calib', type=str, default="calibration.npz",
-                        help="Path to calibration file containing 'mtx' and 'dist'.")
-    parser.add_argument('--families', type=str, default="tag36h11",
-                        help="AprilTag families to detect (default: tag36h11).")
-    args = parser.parse_args()
-    print(f"Arguments parsed: {args}")
-
-    try:
-        print("Loading calibration data...")
-        camera_matrix, dist_coeffs = load_calibration(args.calib)
-        print("Calibration data loaded successfully")
-    except Exception as e:
-        print(f"Error loading calibration data: {e}")
-        return
-
-    try:
-        print("Creating AprilTag detector...")
-        detector = create_detector(args.families)
-        print("AprilTag detector created successfully")
-    except Exception as e:
-        print(f"Error creating detector: {e}")
-        return
+def report_startup(event):
+    """
+    Print the time from program start to `event`, the first time it happens.
+    """
+    if event not in startup_events:
+        startup_events[event] = time.monotonic() - STARTUP_TIME
+        print(f"Startup: {event} after {startup_events[event]:.3f}s")
 
+def init_camera(args, pool_count=4):
+    """
+    Open the frame source selected with --source (the Pi camera by default).
+    In gray mode frames are the luminance plane only, in pooled buffers.
+    Returns the FrameSource, or None if initialization failed.
+    """
     try:
-        print("Initializing Pi Camera...")
-        picam2 = Picamera2()
-        print("Camera object created")
-        
-        print("\nCreating preview configuration...")
-        config = picam2.create_preview_configuration(
-            main={"size": (1280, 720)},
+        camera = open_source(
+            args.source, gray=not args.color, pool_count=pool_count, size=CAPTURE_SIZE,
+            tag_ids=args.targets, tag_size=args.tag_size, loop=args.loop,
             controls={
                 "FrameDurationLimits": (33333, 33333),
                 "ExposureTime": 10000,
@@ -102,24 +104,244 @@ def main():
                 "Brightness": 0.1
             }
         )
-        
-        print("Configuring camera...")
-        picam2.configure(config)
-        print("Starting camera...")
-        picam2.start()
-        print("Camera initialization complete")
+        report_startup("camera ready")
+        return camera
         
     except Exception as e:
         print(f"Error initializing camera: {e}")
+        if args.source not in ("pi", "picamera"):
+            return None
         print("\nTroubleshooting steps:")
         print("1. Check if the camera is properly connected")
         print("2. Run 'vcgencmd get_camera' to check camera status")
         print("3. Check if camera is enabled in raspi-config")
         print("4. Try rebooting the Raspberry Pi")
-        return
+        return None
 
-    print("Starting continuous detection. Press 'q' to quit.")
+def process_frame(frame, detector, args, estimator, tracker=None):
+    """
+    Convert a captured RGB frame, detect tags and estimate the poses of all
+    requested targets in one pass.
+    Gray frames from the luminance capture path go to the detector as they are.
+    `tracker` is an ROITracker or MultiScaleDetector; either one handles
+    upscaling itself and returns corners in native frame coordinates.
+    
+    Returns:
+      (frame, detections, poses) where frame is the BGR or gray (possibly
+      upscaled) frame and poses maps each target ID found to
+      (detection, rvec, tvec, reprojection error).
+    """
+    if frame.ndim == 3:
+        with metrics.span("convert"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    
+    with metrics.span("detect"):
+        if tracker is not None:
+            detections = tracker.detect(frame, detector)
+        else:
+            if args.upscale != 1.0:
+                # --upscale_mode frame: blanket resize of the whole frame
+                frame = cv2.resize(frame, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_LINEAR)
+            detections = detect_tags(frame, detector)
+    poses = {}
+    
+    with metrics.span("pose"):
+        # Intrinsics for the size actually detected on (capture mode, upscale)
+        estimator.set_frame_size((frame.shape[1], frame.shape[0]))
+        for detection in detections:
+            if detection.getId() in args.target_set:
+                rvec, tvec, error = estimator.estimate(detection)
+                if rvec is not None and tvec is not None:
+                    poses[detection.getId()] = (detection, rvec, tvec, error)
+    
+    metrics.inc("frames")
+    metrics.inc("detections", len(detections))
+    return frame, detections, poses
+
+def annotate_frame(frame, detections, targets, target_ids):
+    """
+    Draw the detections and the info overlay on a BGR copy of the frame.
+    `targets` are the (tag_id, rvec, tvec) published for the frame, highest
+    priority first; the first one gets the full readout.
+    """
+    x, y, z = 0, 0, 0
+    distance = 0
+    tag_id = target_ids[0]
+    if targets:
+        tag_id, _, tvec = targets[0]
+        x, y, z = tvec.flatten()
+        distance = np.linalg.norm(tvec)
+    
+    # The only color conversion of the gray path happens here, for display
+    annotated = draw_detections(to_display(frame), detections, target_ids)
+    annotated = draw_info_overlay(annotated, bool(targets), tag_id, x, y, z, distance)
+    
+    # One line for each further target below the main readout
+    for row, (other_id, _, tvec) in enumerate(targets[1:]):
+        ox, oy, oz = tvec.flatten()
+        cv2.putText(annotated, f"ID {other_id}: {ox:.3f}, {oy:.3f}, {oz:.3f}m", (10, 160 + 20 * row),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return annotated
+
+def show_frame(frame, detections, targets, args):
+    """
+    Annotate and display a processed frame.
+    Returns False when the user asked to quit.
+    """
+    cv2.imshow(WINDOW_NAME, annotate_frame(frame, detections, targets, args.targets))
+    
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        print("Quit command received")
+        return False
+    return True
+
+def print_targets(targets):
+    for tag_id, rvec, tvec in targets:
+        x, y, z = tvec.flatten()
+        print(f"\n=== TARGET TAG {tag_id} DETECTED ===")
+        print(f"X: {x:.3f}m | Y: {y:.3f}m | Z: {z:.3f}m")
+        print(f"Distance: {np.linalg.norm(tvec):.3f}m")
+        print("==========================================\n")
+
+def publish_targets(table, poses, timestamp, print_status, prediction=None):
+    """
+    Record one frame's poses in the target table and hand the targets seen
+    to the serial writer as one message, in priority order.
+    With a PredictionStage the poses are filtered first (outliers dropped)
+    and what is sent is extrapolated to when it reaches the board.
+    Returns the (tag_id, rvec, tvec) list for the frame.
+    """
+    with metrics.span("publish"):
+        if prediction is not None:
+            poses = prediction.bank.update(poses, timestamp)
+        targets = table.update(poses, timestamp)
+        if targets:
+            report_startup("first target")
+            metrics.inc("targets", len(targets))
+            if prediction is not None:
+                prediction.publish([tag_id for tag_id, _, _ in targets])
+            else:
+                targets_detected_action(targets, timestamp=timestamp)
+    # Capture to hand-off to the serial writer
+    metrics.observe("frame_latency", time.monotonic() - timestamp)
+    # Only print coordinates when a target is detected
+    if targets and print_status:
+        print_targets(targets)
+    return targets
+
+def create_tracker(args):
+    """
+    Create the ROI tracker and/or multi-scale scanner requested on the
+    command line, or None for plain full-frame detection.
+    """
+    scanner = None
+    if args.upscale != 1.0 and args.upscale_mode == 'tiles':
+        scanner = MultiScaleDetector(args.upscale)
+    if not args.track:
+        return scanner
+    upscale = args.upscale if scanner is None else 1.0
+    return ROITracker(args.target, padding=args.track_padding, max_misses=args.track_misses,
+                      full_scan_period=args.track_period, upscale=upscale, scanner=scanner)
+
+def create_estimator(args, calibration):
+    """
+    Create a pose estimator with the solver selected on the command line.
+    It rescales the calibration to the size of the frames it is given.
+    """
+    return PoseEstimator(calibration.camera_matrix, calibration.dist_coeffs, args.tag_size, method=args.pnp,
+                         warm_start=not args.no_warm_start, calibration=calibration)
+
+def create_prediction(args):
+    """
+    Create the pose filter and prediction stage when --filter is given,
+    otherwise None (raw poses are sent as before).
+    """
+    if not args.filter:
+        return None
+    if args.send_rate > 0:
+        # The scheduler predicts at every tick itself
+        rate = 0
+    else:
+        rate = args.predict_rate
+        if rate > 20:
+            # Let the writer (20 messages/s by default) keep up with the predictions
+            set_send_rate(rate)
+    bank = PoseFilterBank(max_reprojection_error=args.max_reproj_error)
+    lead = link_latency if args.lead is None else args.lead
+    return PredictionStage(bank, targets_detected_action, rate=rate, lead=lead)
+
+def create_scheduler(args, prediction=None):
+    """
+    Start the fixed-rate command scheduler when --send_rate is given and
+    route the poses to it; otherwise None (poses are sent as frames
+    arrive). With --filter every tick sends the pose predicted for it.
+    """
+    if args.send_rate <= 0:
+        return None
+    predict = prediction.current if prediction is not None else None
+    scheduler = CommandScheduler(args.send_rate, send_poses, send_control, predict=predict,
+                                 hold_time=args.hold_time, keepalive_interval=args.keepalive)
+    set_scheduler(scheduler)
+    return scheduler
+
+def create_recorder(args, calibration):
+    """
+    Open the flight recorder when --record is given, storing what a replay
+    needs (intrinsics, tag size, targets) in its header.
+    """
+    if not args.record:
+        return None
+    # Frames are only resized before detection in --upscale_mode frame
+    frame_upscale = args.upscale if args.upscale_mode == 'frame' and not args.track else 1.0
+    meta = {
+        "camera_matrix": calibration.camera_matrix.tolist(),
+        "dist_coeffs": None if calibration.dist_coeffs is None else calibration.dist_coeffs.tolist(),
+        "image_size": list(calibration.image_size),
+        "frame_upscale": frame_upscale,
+        "tag_size": args.tag_size,
+        "targets": args.targets,
+        "source": args.source,
+        "upscale": args.upscale,
+        "upscale_mode": args.upscale_mode,
+        "pnp": args.pnp,
+        "detector": args.detector_settings,
+    }
+    print(f"Recording to {args.record}")
+    return FlightRecorder(args.record, size_mb=args.record_size, meta=meta,
+                          keyframe_interval=args.record_keyframes)
+
+def create_display(args):
+    """
+    Pick how processed frames are shown:
+      --headless without --stream: not at all (no annotation either)
+      --preview_fps or --stream: PreviewStage thread at a capped rate
+      otherwise: annotate and show every frame inline, as before
+    
+    Returns:
+      (display, preview): display(frame, detections, targets) returns False
+      to quit; preview is the PreviewStage or None.
+    """
+    if args.stream or args.preview_fps > 0:
+        def annotate(frame, detections, targets):
+            return annotate_frame(frame, detections, targets, args.targets)
+        preview = PreviewStage(annotate, max_fps=args.preview_fps or 10.0, window=not args.headless,
+                               stream_port=args.stream)
+        return preview.submit, preview
+    if args.headless:
+        return lambda frame, detections, targets: True, None
+    return lambda frame, detections, targets: show_frame(frame, detections, targets, args), None
+
+def run_single_thread(camera, detector, args, calibration, display, prediction=None,
+                      recorder=None):
+    """
+    Original loop: capture, detect, send and display one after another.
+    Returns the number of frames processed.
+    """
+    tracker = create_tracker(args)
+    estimator = create_estimator(args, calibration)
+    table = TargetTable(args.targets, args.priority)
     frame_count = 0
+    frames_since_print = 0
     last_print_time = time.time()
     print_interval = 1.0  # Print status every 1 second
     
@@ -129,55 +351,323 @@ def main():
             current_time = time.time()
             
             # Only print status every print_interval seconds
-            if current_time - last_print_time >= print_interval:
-                print(f"\nFrame {frame_count} - Processing...")
+            print_status = current_time - last_print_time >= print_interval
+            if print_status:
+                fps = frames_since_print / (current_time - last_print_time)
+                print(f"\nFrame {frame_count} - {fps:.1f} fps")
+                frames_since_print = 0
                 last_print_time = current_time
             
-            frame = picam2.capture_array()
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            
-            if args.upscale != 1.0:
-                frame = cv2.resize(frame, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_LINEAR)
-            
-            detections = detect_tags(frame, detector)
-            target_detected = False
-            x, y, z = 0, 0, 0
-            distance = 0
-            
-            for detection in detections:
-                if detection.getId() == args.target:
-                    rvec, tvec = estimate_pose(detection, camera_matrix, dist_coeffs, args.tag_size)
-                    if rvec is not None and tvec is not None:
-                        target_detected = True
-                        target_detected_action(detection, rvec, tvec)
-                        x, y, z = tvec.flatten()
-                        distance = np.linalg.norm(tvec)
-                        
-                        # Only print coordinates when target is detected
-                        if current_time - last_print_time >= print_interval:
-                            print(f"\n=== TARGET TAG {args.target} DETECTED ===")
-                            print(f"X: {x:.3f}m | Y: {y:.3f}m | Z: {z:.3f}m")
-                            print(f"Distance: {distance:.3f}m")
-                            print("==========================================\n")
-            
-            annotated = draw_detections(frame.copy(), detections, args.target)
-            annotated = draw_info_overlay(annotated, target_detected, args.target, x, y, z, distance)
-            
-            cv2.imshow("AprilTag Pose Estimation", annotated)
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("Quit command received")
+            with metrics.span("capture"):
+                raw, capture_time = camera.read_timed()
+            if raw is None:
+                print("End of source")
+                frame_count -= 1
+                break
+            frames_since_print += 1
+            report_startup("first frame")
+            try:
+                frame, detections, poses = process_frame(raw, detector, args,
+                                                         estimator, tracker)
+                if detections:
+                    report_startup("first detection")
+                if recorder is not None:
+                    recorder.record_frame(frame_count, capture_time, detections, poses, frame)
+                
+                targets = publish_targets(table, poses, capture_time, print_status, prediction)
+                
+                with metrics.span("display"):
+                    keep_running = display(frame, detections, targets)
+            finally:
+                # Nothing keeps the frame past display (the preview copies it)
+                camera.release(raw)
+            if not keep_running:
                 break
                 
         except Exception as e:
             print(f"Error in main loop: {e}")
             time.sleep(1)
             continue
+    print(f"Targets:\n{table.summary()}")
+    return frame_count
+
+def create_processor(args, calibration):
+    """
+    Detector, tracker and pose estimator of one detection worker, as a
+    callable mapping a raw frame to (frame, detections, poses). Module level,
+    so --processes workers can build theirs from a pickled partial. With
+    --track there is only one worker, so its tracker sees every frame it is
+    given in capture order.
+    """
+    # AprilTagDetector is not shared between threads
+    detector = create_detector(args.families, args.detector_settings)
+    tracker = create_tracker(args)
+    estimator = create_estimator(args, calibration)
+    return lambda frame: process_frame(frame, detector, args, estimator, tracker)
+
+def run_pipelined(camera, args, calibration, display, prediction=None, recorder=None):
+    """
+    Staged loop: a capture thread and `args.workers` detection threads (or
+    `args.processes` detection processes) feed the serial/display stage on
+    this thread. Returns the number of results consumed.
+    """
+    status = {"frames": 0, "last_print": time.time()}
+    table = TargetTable(args.targets, args.priority)
+    
+    def consume(result):
+        report_startup("first frame")
+        if result.detections:
+            report_startup("first detection")
+        status["frames"] += 1
+        now = time.time()
+        print_status = now - status["last_print"] >= 1.0
+        if print_status:
+            latency = (time.monotonic() - result.timestamp) * 1000
+            print(f"\nFrame {result.seq} - {status['frames']} results/s, latency {latency:.1f}ms")
+            status["frames"] = 0
+            status["last_print"] = now
+        
+        if recorder is not None:
+            recorder.record_frame(result.seq, result.timestamp, result.detections, result.poses, result.frame)
+        targets = publish_targets(table, result.poses, result.timestamp, print_status, prediction)
+        
+        with metrics.span("display"):
+            return display(result.frame, result.detections, targets)
+    
+    def capture():
+        with metrics.span("capture"):
+            return camera.read_timed()
+    
+    if args.processes:
+        stats = run_process_pipeline(capture, functools.partial(create_processor, args, calibration), consume,
+                                     num_workers=args.processes, release_fn=camera.release)
+    else:
+        stats = run_pipeline(capture, lambda: create_processor(args, calibration), consume,
+                             num_workers=args.workers, buffer_size=args.buffer_size, release_fn=camera.release)
+    print(f"Pipeline stats: {stats}")
+    print(f"Targets:\n{table.summary()}")
+    return stats["results_consumed"]
+
+def main():
+    print("Starting program initialization...")
+    parser = argparse.ArgumentParser(description="Continuous AprilTag 3D Pose Estimation using robotpy-apriltag")
+    parser.add_argument('--source', type=str, default="pi",
+                        help="Frame source: 'pi' (Pi camera), a V4L2 device index (e.g., 0), a video file, "
+                             "an image directory, 'synthetic[:ID,...]' or a URL for your Camo feed (default: pi).")
+    parser.add_argument('--loop', action='store_true',
+                        help="Restart video file and image directory sources at the end.")
+    parser.add_argument('--upscale', type=float, default=1.0,
+                        help="Upscale factor for frames (e.g., 1.5) to help detect small tags.")
+    parser.add_argument('--target', type=int, default=None,
+                        help="Desired AprilTag ID that triggers the action.")
+    parser.add_argument('--targets', type=str, default=None,
+                        help="Several target IDs and ranges instead of --target, e.g. '27,1-5', "
+                             "listed in priority order; --track follows the first one.")
+    parser.add_argument('--priority', choices=PRIORITIES, default='listed',
+                        help="Order of the targets sent each frame: as listed, nearest first, "
+                             "or most confident first (default: listed).")
+    parser.add_argument('--tag_size', type=float, default=0.0508,
+                        help="Real-world tag size in meters (default ~2 inches = 0.0508 m).")
+    parser.add_argument('--calib', type=str, default="calibration.npz",
+                        help="Path to calibration file containing 'mtx', 'dist' and the calibrated 'size' "
+                             "(older files without it are assumed to be 1280x720).")
+    parser.add_argument('--families', type=str, default="tag36h11",
+                        help="AprilTag families to detect (default: tag36h11).")
+    parser.add_argument('--detector_config', type=str, default=None, metavar='FILE',
+                        help="JSON file of detector settings, e.g. written by src.autotune.")
+    parser.add_argument('--detector', type=str, action='append', default=[], metavar='NAME=VALUE',
+                        help="Detector setting, overriding --detector_config; repeatable "
+                             "(e.g. --detector quad_decimate=1.5 --detector num_threads=2). "
+                             "num_threads applies to each --pipeline worker.")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Run capture, detection and output on separate threads.")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Number of detection threads in pipeline mode (default: 2).")
+    parser.add_argument('--processes', type=int, default=0, metavar='N',
+                        help="Run detection in N worker processes fed through shared memory instead of "
+                             "--workers threads, so pose work is not serialized on the GIL (implies --pipeline).")
+    parser.add_argument('--buffer_size', type=int, default=2,
+                        help="Ring buffer capacity between pipeline stages (default: 2).")
+    parser.add_argument('--upscale_mode', choices=['tiles', 'frame'], default='frame',
+                        help="'frame' resizes the whole frame; 'tiles' runs a native-resolution pass and "
+                             "upscales only regions holding undecoded tag-like quads (default: frame).")
+    parser.add_argument('--track', action='store_true',
+                        help="Search a window around the last target position instead of the full frame "
+                             "(in pipeline mode, with a single detection worker).")
+    parser.add_argument('--track_padding', type=float, default=1.0,
+                        help="Tracking window padding as a fraction of the tag size (default: 1.0).")
+    parser.add_argument('--track_misses', type=int, default=3,
+                        help="Window misses before falling back to a full-frame scan (default: 3).")
+    parser.add_argument('--track_period', type=int, default=30,
+                        help="Force a full-frame scan every N frames while tracking, 0 to disable (default: 30).")
+    parser.add_argument('--pnp', choices=sorted(PNP_METHODS), default='ippe_square',
+                        help="solvePnP method used for tag poses (default: ippe_square).")
+    parser.add_argument('--no_warm_start', action='store_true',
+                        help="Solve every pose from scratch instead of seeding from the previous frame.")
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='text',
+                        help="Serial message format: legacy CSV text or CRC-checked binary frames (default: text).")
+    parser.add_argument('--filter', action='store_true',
+                        help="Filter poses (Kalman, outlier rejection) and send them extrapolated "
+                             "to their arrival time, with predictions between frames.")
+    parser.add_argument('--predict_rate', type=float, default=50.0,
+                        help="With --filter, predicted poses per second between frames, 0 for none; "
+                             "--send_rate replaces it (default: 50).")
+    parser.add_argument('--lead', type=float, default=None,
+                        help="With --filter, extrapolate this many seconds past the send time "
+                             "(default: half the measured ACK round trip, binary protocol only).")
+    parser.add_argument('--serial_port', type=str, action='append', default=[], metavar='DEVICE',
+                        help="Serial device path or glob of the Arduino (repeatable; default: find it by USB ID).")
+    parser.add_argument('--usb_id', type=str, action='append', default=[], metavar='VID[:PID]',
+                        help="Extra USB ID (hex) identifying the board (repeatable).")
+    parser.add_argument('--send_rate', type=float, default=0, metavar='HZ',
+                        help="Send commands on a fixed clock of HZ ticks per second (e.g. 50-200), with keep-alive "
+                             "and stop messages while no target is seen (default: 0, send as frames arrive).")
+    parser.add_argument('--hold_time', type=float, default=0.15,
+                        help="With --send_rate, seconds the last pose is resent before the target counts as lost "
+                             "(default: 0.15).")
+    parser.add_argument('--keepalive', type=float, default=0.05,
+                        help="With --send_rate, seconds between keep-alives while no target is seen (default: 0.05).")
+    parser.add_argument('--max_reproj_error', type=float, default=3.0,
+                        help="With --filter, drop solves with a larger RMS reprojection error in pixels (default: 3).")
+    parser.add_argument('--metrics_port', type=int, default=None, metavar='PORT',
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics.")
+    parser.add_argument('--metrics_interval', type=float, default=10.0,
+                        help="Print a compact per-stage latency line every N seconds, 0 to disable (default: 10).")
+    parser.add_argument('--quiet', action='store_true',
+                        help="Do not print every target and serial message; rely on the metrics line.")
+    parser.add_argument('--record', type=str, default=None, metavar='FILE',
+                        help="Flight recorder: keep detections, poses and serial traffic in this ring file "
+                             "(inspect with python3 -m src.recorder FILE).")
+    parser.add_argument('--record_size', type=float, default=64,
+                        help="Size of the recording ring in MB (default: 64, ~100k records).")
+    parser.add_argument('--record_keyframes', type=int, default=0, metavar='N',
+                        help="Also keep every Nth frame as a 160x120 keyframe (default: 0 = none).")
+    parser.add_argument('--headless', action='store_true',
+                        help="No preview window and no annotation; combine with --stream to watch remotely.")
+    parser.add_argument('--preview_fps', type=float, default=0,
+                        help="Show the preview from its own thread at most this often "
+                             "(default: 0 = draw every frame in the loop).")
+    parser.add_argument('--stream', type=int, default=None, metavar='PORT',
+                        help="Serve the preview as MJPEG on http://127.0.0.1:PORT/ (at --preview_fps or 10 fps).")
+    parser.add_argument('--color', action='store_true',
+                        help="Capture RGB frames instead of the luminance plane (slower; color preview).")
+    args = parser.parse_args()
+    if args.processes:
+        args.pipeline = True
+    # Each worker keeps its own tracker and would predict from the corners
+    # of whatever frame it saw last, several frames back
+    if args.pipeline and args.track and max(args.workers, args.processes) > 1:
+        print("--track needs the frames in order: running a single detection worker")
+        args.workers = 1
+        args.processes = min(args.processes, 1)
+    try:
+        args.detector_settings = load_detector_config(args.detector_config, args.detector)
+    except (OSError, ValueError) as e:
+        parser.error(f"detector settings: {e}")
+    if args.targets is not None:
+        try:
+            args.targets = parse_targets(args.targets)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.target is not None:
+        args.targets = [args.target]
+    else:
+        parser.error("one of --target or --targets is required")
+    # The first target is the primary one (ROI tracking)
+    args.target = args.targets[0]
+    args.target_set = frozenset(args.targets)
+    try:
+        extra_usb_ids = [parse_usb_id(text) for text in args.usb_id]
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Arguments parsed: {args}")
+    set_protocol(args.protocol)
+    set_verbose(not args.quiet)
+    # Find and open the board in the background while everything else starts
+    set_ports(args.serial_port, extra_usb_ids)
+    initialize_serial()
+
+    # Opening the camera is the slowest part of startup, so it runs while
+    # the calibration and detector are loaded
+    # Process workers get copies of the frames in shared memory
+    pool_count = pool_size(args.workers, args.buffer_size) if args.pipeline and not args.processes else 2
+    opened = {}
+    opener = threading.Thread(target=lambda: opened.update(camera=init_camera(args, pool_count)),
+                              name="open-source", daemon=True)
+    opener.start()
+
+    calibration, detector = None, None
+    try:
+        print("Loading calibration data...")
+        calibration = CameraCalibration.load(args.calib, default_size=CAPTURE_SIZE)
+        # Build (or map from the cache) the corner lookup table off the frame path
+        calibration.point_lut()
+        print("Calibration data loaded successfully")
+    except Exception as e:
+        print(f"Error loading calibration data: {e}")
+
+    try:
+        print("Creating AprilTag detector...")
+        detector = create_detector(args.families, args.detector_settings)
+        print("AprilTag detector created successfully")
+    except Exception as e:
+        print(f"Error creating detector: {e}")
+
+    opener.join()
+    camera = opened.get("camera")
+    if getattr(camera, "camera_matrix", None) is not None:
+        # Synthetic frames are rendered with their own intrinsics
+        print("Using the synthetic source's camera matrix")
+        calibration = CameraCalibration(camera.camera_matrix, None, camera.size)
+    if camera is None or calibration is None or detector is None:
+        if camera is not None:
+            camera.close()
+        return
+
+    display, preview = create_display(args)
+    prediction = create_prediction(args)
+    scheduler = create_scheduler(args, prediction)
+    metrics_server = MetricsServer(port=args.metrics_port) if args.metrics_port else None
+    metrics_logger = MetricsLogger(interval=args.metrics_interval) if args.metrics_interval > 0 else None
+    recorder = create_recorder(args, calibration)
+    set_recorder(recorder)
+    print("Starting continuous detection. Press 'q' to quit.")
+    loop_start = time.monotonic()
+    if args.pipeline:
+        frames = run_pipelined(camera, args, calibration, display, prediction, recorder)
+    else:
+        frames = run_single_thread(camera, detector, args, calibration, display, prediction, recorder)
+    elapsed = time.monotonic() - loop_start
+    if preview is not None:
+        mode = "preview thread"
+    else:
+        mode = "headless" if args.headless else "inline display"
+    print(f"Vision loop ({mode}): {frames} frames in {elapsed:.1f}s ({frames / elapsed:.1f} fps)")
 
     print("Cleaning up...")
     try:
-        picam2.stop()
-        cv2.destroyAllWindows()
+        camera.close()
+        if recorder is not None:
+            set_recorder(None)
+            recorder.close()
+        if metrics_logger is not None:
+            metrics_logger.close()
+            print(metrics_logger.line())
+        if metrics_server is not None:
+            metrics_server.close()
+        if prediction is not None:
+            prediction.close()
+            print(f"Pose filter: {prediction.bank.summary()}; {prediction.frames_sent} frame updates, "
+                  f"{prediction.predictions_sent} predictions sent")
+        if scheduler is not None:
+            set_scheduler(None)
+            scheduler.close()
+            print(f"Command scheduler: {scheduler.summary()}")
+        if preview is not None:
+            print(f"Preview stats: {preview.stats()}")
+            preview.close()
+        elif not args.headless:
+            cv2.destroyAllWindows()
         from .send_data import cleanup_serial
         cleanup_serial()
         print("Cleanup complete")
@@ -0,0 +1,250 @@
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "vision"
+
+class Histogram:
+    """
+    Fixed-memory histogram of durations in seconds.
+
+    Log-spaced buckets, 4 per octave from 1us to about 100s, so quantiles
+    are within ~10% whatever the number of samples, and observe() is a
+    bucket index computation and a few additions.
+    """
+    MIN_VALUE = 1e-6
+    PER_OCTAVE = 4
+    BUCKETS = 27 * PER_OCTAVE + 1
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if value > self.MIN_VALUE:
+            index = min(int(math.log2(value / self.MIN_VALUE) * self.PER_OCTAVE) + 1, self.BUCKETS - 1)
+        else:
+            index = 0
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    @classmethod
+    def bucket_value(cls, index):
+        """
+        Representative value (geometric middle) of a bucket.
+        """
+        if index == 0:
+            return cls.MIN_VALUE
+        return cls.MIN_VALUE * 2 ** ((index - 0.5) / cls.PER_OCTAVE)
+
+    @classmethod
+    def quantiles(cls, counts, quantiles=QUANTILES):
+        """
+        Quantiles (ascending) of a bucket count list, 0 when it is empty.
+        """
+        total = sum(counts)
+        if not total:
+            return [0.0] * len(quantiles)
+        result = []
+        cumulative = 0
+        index = 0
+        for q in quantiles:
+            rank = q * total
+            while index < len(counts) - 1 and cumulative + counts[index] < rank:
+                cumulative += counts[index]
+                index += 1
+            result.append(cls.bucket_value(index))
+        return result
+
+class _Span:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Registry:
+    """
+    Named histograms, counters and gauges of the vision loop.
+
+    Stages are timed with `with metrics.span("detect"): ...` (monotonic
+    clock), events counted with metrics.inc("frames"). Collectors are
+    callables returning {name: value} gauges read when metrics are exported,
+    for values other code already keeps (e.g. ring buffer drop counts).
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def span(self, name):
+        return _Span(self.histogram(name))
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def collect_gauges(self):
+        gauges = dict(self.gauges)
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                gauges.update(collector())
+            except Exception as e:
+                print(f"Error in metrics collector: {e}")
+        return gauges
+
+    def prometheus_text(self):
+        """
+        All metrics in the Prometheus text exposition format. Histograms are
+        exported as one summary with a `stage` label.
+        """
+        lines = [f"# TYPE {PREFIX}_stage_seconds summary"]
+        for name, histogram in sorted(self.histograms.items()):
+            counts, count, total = histogram.snapshot()
+            for q, value in zip(QUANTILES, Histogram.quantiles(counts)):
+                lines.append(f'{PREFIX}_stage_seconds{{stage="{name}",quantile="{q}"}} {value:.6g}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total:.6g}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total {value}")
+        for name, value in sorted(self.collect_gauges().items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+# Process-wide registry used by the vision loop and the serial writer
+metrics = Registry()
+
+class MetricsServer:
+    """
+    Serves GET /metrics in the Prometheus text format. Binds to localhost
+    unless told otherwise.
+    """
+
+    def __init__(self, registry=metrics, port=9100, host="127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        print(f"Metrics at http://{host}:{self.httpd.server_address[1]}/metrics")
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class MetricsLogger:
+    """
+    Prints one compact line every `interval` seconds with the p50/p95/p99 of
+    each stage and the counter increments over that interval, e.g.
+
+      [metrics 10s] detect 27.1/30.2/41.0ms pose 0.2/0.3/0.4ms | frames 298 detections 290
+    """
+
+    def __init__(self, registry=metrics, interval=10.0):
+        self.registry = registry
+        self.interval = interval
+        self._previous = {}
+        self._previous_counters = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-log", daemon=True)
+        self._thread.start()
+
+    def line(self):
+        stages = []
+        for name, histogram in sorted(self.registry.histograms.items()):
+            counts, count, _ = histogram.snapshot()
+            previous = self._previous.get(name)
+            self._previous[name] = counts
+            if previous is not None:
+                counts = [a - b for a, b in zip(counts, previous)]
+            if not sum(counts):
+                continue
+            p50, p95, p99 = (v * 1000 for v in Histogram.quantiles(counts))
+            stages.append(f"{name} {p50:.1f}/{p95:.1f}/{p99:.1f}ms")
+        counters = []
+        for name, value in sorted(self.registry.counters.items()):
+            delta = value - self._previous_counters.get(name, 0)
+            self._previous_counters[name] = value
+            if delta:
+                counters.append(f"{name} {delta}")
+        return f"[metrics {self.interval:g}s] " + " ".join(stages) + " | " + " ".join(counters)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.line())
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
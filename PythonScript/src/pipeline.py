@@ -0,0 +1,221 @@
+import collections
+import threading
+import time
+from .metrics import metrics
+
+
+class LatestBuffer:
+    """
+    Bounded ring buffer between pipeline stages.
+
+    Producers never block: when the buffer is full the oldest item is
+    overwritten. Consumers always receive the newest item and everything
+    older is discarded, so a slow stage never works on stale frames.
+    `on_drop` is called (outside the lock) with every item discarded that
+    way, e.g. to release its frame buffer.
+    """
+
+    def __init__(self, capacity=2, on_drop=None):
+        self._items = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.on_drop = on_drop
+        self.put_count = 0
+        self.dropped = 0
+
+    def _discard(self, items):
+        if self.on_drop is not None:
+            for item in items:
+                self.on_drop(item)
+
+    def put(self, item):
+        dropped = []
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                dropped.append(self._items.popleft())
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+        self._discard(dropped)
+
+    def get(self, timeout=None):
+        """
+        Return the newest item, waiting up to `timeout` seconds.
+        Returns None on timeout or once the buffer has been closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            item = self._items.pop()
+            dropped = list(self._items)
+            self.dropped += len(dropped)
+            self._items.clear()
+        self._discard(dropped)
+        return item
+
+    def drain(self):
+        """
+        Discard every buffered item through `on_drop`, e.g. at shutdown.
+        """
+        with self._cond:
+            dropped = list(self._items)
+            self._items.clear()
+        self._discard(dropped)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class FramePacket:
+    """
+    A captured frame tagged with its sequence number and capture timestamp
+    (time.monotonic()).
+    """
+    __slots__ = ("seq", "timestamp", "frame")
+
+    def __init__(self, seq, timestamp, frame):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame
+
+
+class DetectionResult:
+    """
+    Output of a detection worker for one frame. `timestamp` is the capture
+    time of the frame the result was computed from; `raw` the captured
+    frame, released once the result has been consumed or dropped.
+    """
+    __slots__ = ("seq", "timestamp", "frame", "detections", "poses", "raw")
+
+    def __init__(self, seq, timestamp, frame, detections, poses, raw=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame
+        self.detections = detections
+        # target tag ID -> (detection, rvec, tvec, reprojection error)
+        self.poses = poses
+        self.raw = raw
+
+
+def _capture_loop(capture_fn, frames, stop_event):
+    seq = 0
+    while not stop_event.is_set():
+        try:
+            frame, timestamp = capture_fn()
+        except Exception as e:
+            print(f"Error in capture thread: {e}")
+            time.sleep(0.1)
+            continue
+        if frame is None:
+            # End of a finite source
+            break
+        seq += 1
+        frames.put(FramePacket(seq, timestamp, frame))
+    frames.close()
+
+
+def _detect_loop(process_fn, frames, results, stop_event, release_fn):
+    while not stop_event.is_set():
+        packet = frames.get(timeout=0.1)
+        if packet is None:
+            if frames.closed:
+                break
+            continue
+        try:
+            frame, detections, poses = process_fn(packet.frame)
+        except Exception as e:
+            print(f"Error in detection worker: {e}")
+            release_fn(packet.frame)
+            continue
+        results.put(DetectionResult(packet.seq, packet.timestamp, frame, detections, poses, packet.frame))
+
+
+def run_pipeline(capture_fn, make_processor, consume_fn, num_workers=2, buffer_size=2, release_fn=None):
+    """
+    Run capture, detection and output as separate stages.
+
+    Parameters:
+      capture_fn: Callable returning the next (raw frame, capture timestamp),
+        e.g. FrameSource.read_timed. A None frame ends the run once the
+        frames already captured have been processed. Runs on its own thread.
+      make_processor: Factory called once per detection worker. It must return
+        a callable mapping a raw frame to (frame, detections, poses), so each
+        worker owns its own detector.
+      consume_fn: Called on the calling thread with each DetectionResult, newest
+        first; stale and out-of-order results are skipped. Return False to stop.
+      num_workers (int): Number of detection worker threads.
+      buffer_size (int): Capacity of each ring buffer between stages.
+      release_fn: Called with every raw frame from capture_fn once no stage
+        uses it any more, e.g. FrameSource.release: after consume_fn
+        returned, or when the frame or its result was dropped.
+
+    Returns:
+      dict: Frame, result and drop counters for the run.
+    """
+    if release_fn is None:
+        release_fn = lambda frame: None
+    stop_event = threading.Event()
+    frames = LatestBuffer(buffer_size, on_drop=lambda packet: release_fn(packet.frame))
+    results = LatestBuffer(buffer_size, on_drop=lambda result: release_fn(result.raw))
+    stale = 0
+
+    def buffer_gauges():
+        return {"pipeline_frames_dropped": frames.dropped, "pipeline_results_dropped": results.dropped,
+                "pipeline_results_stale": stale}
+    metrics.add_collector(buffer_gauges)
+
+    threads = [threading.Thread(target=_capture_loop, args=(capture_fn, frames, stop_event),
+                                name="capture", daemon=True)]
+    for i in range(max(1, num_workers)):
+        threads.append(threading.Thread(target=_detect_loop,
+                                        args=(make_processor(), frames, results, stop_event, release_fn),
+                                        name=f"detect-{i}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    last_seq = 0
+    consumed = 0
+    try:
+        while True:
+            result = results.get(timeout=0.1)
+            if result is None:
+                if not any(t.is_alive() for t in threads):
+                    break
+                continue
+            # With several workers a slower one can finish after a newer frame
+            if result.seq <= last_seq:
+                stale += 1
+                release_fn(result.raw)
+                continue
+            last_seq = result.seq
+            consumed += 1
+            try:
+                if consume_fn(result) is False:
+                    break
+            finally:
+                release_fn(result.raw)
+    finally:
+        stop_event.set()
+        frames.close()
+        results.close()
+        for thread in threads:
+            thread.join(timeout=1.0)
+        frames.drain()
+        results.drain()
+        metrics.remove_collector(buffer_gauges)
+
+    return {
+        "captured": frames.put_count,
+        "frames_dropped": frames.dropped,
+        "results_dropped": results.dropped,
+        "results_stale": stale,
+        "results_consumed": consumed,
+    }
@@ -0,0 +1,187 @@
+import cv2
+import time
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .pipeline import LatestBuffer
+from .metrics import metrics
+
+WINDOW_NAME = "AprilTag Pose Estimation"
+BOUNDARY = "frame"
+
+class MJPEGServer:
+    """
+    Minimal MJPEG-over-HTTP server for watching the preview in a browser.
+
+    GET / (or /stream) streams multipart JPEG frames, GET /snapshot.jpg
+    returns the latest one. Binds to localhost unless told otherwise; use an
+    SSH tunnel to watch from another machine.
+    """
+
+    def __init__(self, port=8080, host="127.0.0.1"):
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._seq = 0
+        self._closed = False
+        self.clients = 0
+        self.frames_sent = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/snapshot.jpg":
+                    server._send_snapshot(self)
+                elif self.path in ("/", "/stream"):
+                    server._send_stream(self)
+                else:
+                    self.send_error(404)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mjpeg", daemon=True)
+        self.thread.start()
+        print(f"MJPEG preview at http://{host}:{self.httpd.server_address[1]}/")
+
+    def publish(self, jpeg):
+        with self._cond:
+            self._jpeg = jpeg
+            self._seq += 1
+            self._cond.notify_all()
+
+    def _wait_frame(self, last_seq, timeout=1.0):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != last_seq or self._closed, timeout)
+            return self._seq, self._jpeg
+
+    def _send_snapshot(self, handler):
+        with self._cond:
+            jpeg = self._jpeg
+        if jpeg is None:
+            handler.send_error(503, "No frame yet")
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "image/jpeg")
+        handler.send_header("Content-Length", str(len(jpeg)))
+        handler.end_headers()
+        handler.wfile.write(jpeg)
+
+    def _send_stream(self, handler):
+        handler.send_response(200)
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+        handler.end_headers()
+        with self._cond:
+            self.clients += 1
+        seq = 0
+        try:
+            while not self._closed:
+                new_seq, jpeg = self._wait_frame(seq)
+                if new_seq == seq or jpeg is None:
+                    continue
+                seq = new_seq
+                handler.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                    f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                handler.wfile.write(jpeg)
+                handler.wfile.write(b"\r\n")
+                self.frames_sent += 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class PreviewStage:
+    """
+    Preview that runs beside the vision loop instead of inside it.
+
+    The vision loop calls submit() every frame; it only costs a time check
+    unless a preview is due (at most `max_fps` per second) and someone is
+    watching: the HighGUI window, or at least one MJPEG client. Then the
+    frame is copied (it may come from a reused buffer) and handed to the
+    preview thread, which annotates, shows and encodes it.
+
+    Parameters:
+      annotate: Callable (frame, detections, targets) -> BGR image to show.
+      max_fps (float): Preview rate cap.
+      window (bool): Show a HighGUI window ('q' in it requests a quit).
+      stream_port (int): Serve MJPEG on this localhost port (None: no stream).
+      jpeg_quality (int): JPEG quality of streamed frames.
+    """
+
+    def __init__(self, annotate, max_fps=10.0, window=True, stream_port=None, jpeg_quality=70):
+        self.annotate = annotate
+        self.period = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.window = window
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.server = MJPEGServer(stream_port) if stream_port else None
+        self.quit_requested = threading.Event()
+        self.submitted = 0
+        self.drawn = 0
+        self._next_time = 0.0
+        self._buffer = LatestBuffer(1)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="preview", daemon=True)
+        self._thread.start()
+
+    def has_consumer(self):
+        return self.window or (self.server is not None and self.server.clients > 0)
+
+    def submit(self, frame, detections, targets):
+        """
+        Offer a processed frame. Returns False once a quit was requested.
+        """
+        now = time.monotonic()
+        if now >= self._next_time and self.has_consumer():
+            self._next_time = now + self.period
+            self._buffer.put((np.copy(frame), detections, targets))
+            self.submitted += 1
+        return not self.quit_requested.is_set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self._buffer.get(timeout=0.1)
+            if item is None:
+                if self.window:
+                    self._poll_window()
+                continue
+            with metrics.span("preview_annotate"):
+                annotated = self.annotate(*item)
+            self.drawn += 1
+            if self.window:
+                cv2.imshow(WINDOW_NAME, annotated)
+                self._poll_window()
+            if self.server is not None and self.server.clients > 0:
+                with metrics.span("preview_encode"):
+                    ok, jpeg = cv2.imencode(".jpg", annotated, self.jpeg_params)
+                if ok:
+                    self.server.publish(jpeg.tobytes())
+        if self.window:
+            cv2.destroyWindow(WINDOW_NAME)
+
+    def _poll_window(self):
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            print("Quit command received")
+            self.quit_requested.set()
+
+    def stats(self):
+        stats = {"submitted": self.submitted, "drawn": self.drawn}
+        if self.server is not None:
+            stats["streamed"] = self.server.frames_sent
+        return stats
+
+    def close(self):
+        self._stop.set()
+        self._buffer.close()
+        self._thread.join(timeout=1.0)
+        if self.server is not None:
+            self.server.close()
@@ -0,0 +1,426 @@
+import cv2
+import sys
+import time
+import signal
+import contextlib
+import threading
+import collections
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from .detector import TagDetection, get_detection_corners
+from .pipeline import DetectionResult
+from .metrics import metrics
+
+MAX_DETECTIONS = 16
+
+# What a worker reports for the frame in a slot; detections past
+# MAX_DETECTIONS are dropped, poses first
+RESULT_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("ok", "?"),
+    ("count", "<u2"),
+    ("width", "<u4"),          # size of the frame the corners refer to
+    ("height", "<u4"),
+    ("elapsed", "<f8"),        # seconds spent in the processor
+    ("tag_id", "<i4", (MAX_DETECTIONS,)),
+    ("margin", "<f4", (MAX_DETECTIONS,)),
+    ("hamming", "<i4", (MAX_DETECTIONS,)),
+    ("center", "<f4", (MAX_DETECTIONS, 2)),
+    ("corners", "<f4", (MAX_DETECTIONS, 4, 2)),
+    ("posed", "?", (MAX_DETECTIONS,)),
+    ("rvec", "<f8", (MAX_DETECTIONS, 3)),
+    ("tvec", "<f8", (MAX_DETECTIONS, 3)),
+    ("error", "<f8", (MAX_DETECTIONS,)),
+])
+
+class SharedSlots:
+    """
+    Frame buffers and result records in shared memory, `count` slots of
+    each. The process that creates them owns (and unlinks) the memory;
+    workers attach by name.
+    """
+
+    def __init__(self, shape, count, names=None):
+        self.shape = tuple(shape)
+        self.count = count
+        frame_bytes = int(np.prod(self.shape))
+        self.owner = names is None
+        if self.owner:
+            self._frames = shared_memory.SharedMemory(create=True, size=frame_bytes * count)
+            self._results = shared_memory.SharedMemory(create=True, size=RESULT_DTYPE.itemsize * count)
+        else:
+            self._frames = shared_memory.SharedMemory(name=names[0])
+            self._results = shared_memory.SharedMemory(name=names[1])
+        self.frames = np.ndarray((count,) + self.shape, dtype=np.uint8, buffer=self._frames.buf)
+        self.results = np.ndarray((count,), dtype=RESULT_DTYPE, buffer=self._results.buf)
+
+    @property
+    def names(self):
+        return self._frames.name, self._results.name
+
+    def close(self):
+        # The arrays must go before the mappings can be closed
+        del self.frames, self.results
+        for block in (self._frames, self._results):
+            block.close()
+            if self.owner:
+                block.unlink()
+
+def write_result(record, seq, frame, detections, poses, elapsed):
+    """
+    Store a processor's (frame, detections, poses) in a result record.
+    """
+    ordered = [d for d in detections if d.getId() in poses]
+    ordered += [d for d in detections if d.getId() not in poses]
+    ordered = ordered[:MAX_DETECTIONS]
+    record["seq"] = seq
+    record["ok"] = True
+    record["count"] = len(ordered)
+    record["height"], record["width"] = frame.shape[:2]
+    record["elapsed"] = elapsed
+    record["posed"] = False
+    for i, detection in enumerate(ordered):
+        tag_id = detection.getId()
+        center = detection.getCenter()
+        record["tag_id"][i] = tag_id
+        record["margin"][i] = detection.getDecisionMargin()
+        record["hamming"][i] = detection.getHamming()
+        record["center"][i] = (center.x, center.y)
+        record["corners"][i] = get_detection_corners(detection)
+        if tag_id in poses:
+            _, rvec, tvec, error = poses[tag_id]
+            record["posed"][i] = True
+            record["rvec"][i] = np.ravel(rvec)
+            record["tvec"][i] = np.ravel(tvec)
+            record["error"][i] = np.nan if error is None else error
+
+def read_result(record):
+    """
+    The detections and poses of a result record, with TagDetection objects
+    standing in for the worker's detections.
+    """
+    detections = []
+    poses = {}
+    for i in range(int(record["count"])):
+        tag_id = int(record["tag_id"][i])
+        detection = TagDetection(tag_id, record["corners"][i], record["center"][i],
+                                 float(record["margin"][i]), int(record["hamming"][i]))
+        detections.append(detection)
+        if record["posed"][i]:
+            error = float(record["error"][i])
+            poses[tag_id] = (detection, record["rvec"][i].reshape((3, 1)).copy(),
+                             record["tvec"][i].reshape((3, 1)).copy(), None if np.isnan(error) else error)
+    return detections, poses
+
+def _worker_main(processor_factory, tasks, done):
+    """
+    Worker process: build the processor, attach to the slots, then process
+    the slot of every index received and send the index back.
+    """
+    # Ctrl+C reaches the whole process group; the parent shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Results go back through the slots; stdout belongs to the parent (batch
+    # mode writes its results there)
+    with contextlib.redirect_stdout(sys.stderr):
+        _worker_loop(processor_factory, tasks, done)
+
+def _worker_loop(processor_factory, tasks, done):
+    processor = processor_factory()
+    done.send("ready")
+    message = tasks.recv()
+    if message is None:
+        return
+    slots = SharedSlots(message[0], message[1], names=message[2])
+    try:
+        while True:
+            task = tasks.recv()
+            if task is None:
+                break
+            slot, seq = task
+            record = slots.results[slot]
+            start = time.perf_counter()
+            try:
+                frame, detections, poses = processor(slots.frames[slot])
+                write_result(record, seq, frame, detections, poses, time.perf_counter() - start)
+                if frame.shape == slots.shape and not np.shares_memory(frame, slots.frames[slot]):
+                    # Converted for display (e.g. RGB to BGR): keep that version
+                    slots.frames[slot][...] = frame
+            except Exception as e:
+                print(f"Error in detection process: {e}", file=sys.stderr)
+                record["seq"] = seq
+                record["ok"] = False
+            done.send(slot)
+    finally:
+        slots.close()
+
+class ProcessPool:
+    """
+    Detection worker processes fed through shared-memory frame slots.
+
+    A captured frame is copied once into a free slot and only the slot index
+    goes to a worker, over a pipe of its own; the worker writes its
+    detections and poses into the slot's result record and sends the index
+    back. Nothing but indices is pickled, and no worker ever waits on
+    another: each pipe has a single writer and a single reader.
+
+    Each worker has one frame at a time. The newest frame waits in a pending
+    slot for the next idle worker; older pending frames are dropped (unless
+    drop_stale is False, then capture waits). Results are consumed in
+    capture order.
+
+    Parameters:
+      processor_factory: Picklable callable run once in each worker process
+        (e.g. a functools.partial of a module-level function). It must
+        return a callable mapping a frame to (frame, detections, poses).
+      num_workers (int): Number of worker processes.
+      drop_stale (bool): Replace a pending frame by a newer one instead of
+        waiting for a worker (live cameras). False processes every frame
+        (replayed frames, benchmarks).
+    """
+
+    def __init__(self, processor_factory, num_workers=2, drop_stale=True):
+        context = multiprocessing.get_context("spawn")
+        self.num_workers = max(1, num_workers)
+        self.drop_stale = drop_stale
+        self.slots = None
+        self.workers = []
+        for i in range(self.num_workers):
+            task_reader, task_writer = context.Pipe(duplex=False)
+            done_reader, done_writer = context.Pipe(duplex=False)
+            process = context.Process(target=_worker_main, args=(processor_factory, task_reader, done_writer),
+                                      name=f"detect-{i}", daemon=True)
+            process.start()
+            task_reader.close()
+            done_writer.close()
+            self.workers.append((process, task_writer, done_reader))
+        self._lock = threading.Condition()
+        self._free = collections.deque()
+        self._idle = []
+        self._pending = None
+        self._in_flight = {}   # slot -> (seq, timestamp, worker index)
+        self._order = collections.deque()
+        self.dropped = 0
+        self.failed = 0
+
+    def wait_ready(self, timeout=60.0):
+        """
+        Wait until every worker has built its processor.
+        """
+        deadline = time.monotonic() + timeout
+        for process, _, done in self.workers:
+            if not done.poll(max(0.0, deadline - time.monotonic())):
+                raise RuntimeError(f"Worker {process.name} did not start")
+            done.recv()
+        self._idle = list(range(self.num_workers))
+
+    def allocate(self, shape):
+        """
+        Create the shared slots for frames of `shape` and hand them to the
+        workers. Slots cover a frame in every worker, a received result per
+        worker, the pending and the consumed frame and the one being written.
+        """
+        count = 2 * self.num_workers + 3
+        self.slots = SharedSlots(shape, count)
+        self._free.extend(range(count))
+        for _, tasks, _ in self.workers:
+            tasks.send((self.slots.shape, count, self.slots.names))
+
+    def _dispatch(self):
+        # With self._lock held
+        while self._pending is not None and self._idle:
+            slot, seq, timestamp = self._pending
+            self._pending = None
+            worker = self._idle.pop(0)
+            self._in_flight[slot] = (seq, timestamp, worker)
+            self._order.append(slot)
+            self.workers[worker][1].send((slot, seq))
+
+    def submit(self, seq, timestamp, frame, stop_event=None):
+        """
+        Copy a frame into a free slot and queue it. Returns False if it was
+        not queued (stopped, or a frame of another size).
+        """
+        if self.slots is None:
+            self.allocate(frame.shape)
+        if frame.shape != self.slots.shape:
+            print(f"Skipping frame of shape {frame.shape}; the slots hold {self.slots.shape}", file=sys.stderr)
+            return False
+        with self._lock:
+            while not self._free:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._lock.wait(0.1)
+            slot = self._free.popleft()
+        self.slots.frames[slot][...] = frame
+        with self._lock:
+            while not self.drop_stale and self._pending is not None:
+                if stop_event is not None and stop_event.is_set():
+                    self._free.append(slot)
+                    return False
+                self._lock.wait(0.1)
+            if self._pending is not None:
+                self._free.append(self._pending[0])
+                self.dropped += 1
+            self._pending = (slot, seq, timestamp)
+            self._dispatch()
+        return True
+
+    def collect(self, timeout=0.1):
+        """
+        Receive finished slots and return the results now ready in capture
+        order, as (slot, DetectionResult, result record) triples. The caller
+        hands each slot back with release() once done with its frame.
+        """
+        with self._lock:
+            busy = [self.workers[worker][2] for _, _, worker in self._in_flight.values() if worker is not None]
+        finished = set()
+        for connection in wait(busy, timeout) if busy else []:
+            try:
+                finished.add(connection.recv())
+            except EOFError:
+                raise RuntimeError("A detection process exited unexpectedly")
+        ready = []
+        with self._lock:
+            for slot in finished:
+                seq, timestamp, worker = self._in_flight[slot]
+                self._in_flight[slot] = (seq, timestamp, None)
+                self._idle.append(worker)
+            self._dispatch()
+            while self._order and self._in_flight[self._order[0]][2] is None:
+                slot = self._order.popleft()
+                seq, timestamp, _ = self._in_flight.pop(slot)
+                record = self.slots.results[slot]
+                if not record["ok"]:
+                    self.failed += 1
+                    self._free.append(slot)
+                    continue
+                detections, poses = read_result(record)
+                frame = self.slots.frames[slot]
+                ready.append((slot, DetectionResult(seq, timestamp, frame, detections, poses), record))
+            self._lock.notify_all()
+        return ready
+
+    def release(self, slot):
+        with self._lock:
+            self._free.append(slot)
+            self._lock.notify_all()
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._in_flight) or self._pending is not None
+
+    def close(self):
+        for process, tasks, done in self.workers:
+            try:
+                tasks.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, tasks, done in self.workers:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+            tasks.close()
+            done.close()
+        if self.slots is not None:
+            self.slots.close()
+            self.slots = None
+
+def _frame_for_result(frame, record):
+    # Corners refer to the frame the worker detected on (e.g. upscaled)
+    size = (int(record["width"]), int(record["height"]))
+    if size != (frame.shape[1], frame.shape[0]):
+        return cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+    return frame
+
+def run_process_pipeline(capture_fn, processor_factory, consume_fn, num_workers=2, drop_stale=True,
+                         release_fn=None):
+    """
+    Like pipeline.run_pipeline, with detection in worker processes (see
+    ProcessPool) instead of threads, so detection and pose estimation are
+    not serialized on the GIL.
+
+    Parameters:
+      capture_fn: Callable returning the next (raw frame, capture timestamp);
+        a None frame ends the run. Runs on its own thread.
+      processor_factory: Picklable factory of the per-worker processor.
+      consume_fn: Called on the calling thread with each DetectionResult in
+        capture order. The frame is only valid until it returns. Return
+        False to stop.
+      num_workers (int): Number of worker processes.
+      drop_stale (bool): Drop frames no worker was free for (see ProcessPool).
+      release_fn: Called with every raw frame from capture_fn once it has
+        been copied into a slot (or dropped), e.g. FrameSource.release.
+
+    Returns:
+      dict: Frame, result and drop counters for the run.
+    """
+    pool = ProcessPool(processor_factory, num_workers, drop_stale)
+    stop_event = threading.Event()
+    state = {"captured": 0, "done": False}
+
+    def pool_gauges():
+        return {"pipeline_frames_dropped": pool.dropped, "pipeline_results_failed": pool.failed}
+    metrics.add_collector(pool_gauges)
+
+    def capture_loop():
+        seq = 0
+        try:
+            while not stop_event.is_set():
+                try:
+                    frame, timestamp = capture_fn()
+                except Exception as e:
+                    print(f"Error in capture thread: {e}", file=sys.stderr)
+                    time.sleep(0.1)
+                    continue
+                if frame is None:
+                    break
+                seq += 1
+                state["captured"] += 1
+                try:
+                    pool.submit(seq, timestamp, frame, stop_event)
+                finally:
+                    if release_fn is not None:
+                        release_fn(frame)
+        finally:
+            state["done"] = True
+
+    consumed = 0
+    capture_thread = None
+    try:
+        pool.wait_ready()
+        capture_thread = threading.Thread(target=capture_loop, name="capture", daemon=True)
+        capture_thread.start()
+        stopped = False
+        while not stopped:
+            ready = pool.collect(timeout=0.1)
+            if not ready and state["done"] and not pool.busy:
+                break
+            for slot, result, record in ready:
+                try:
+                    if stopped:
+                        continue
+                    metrics.observe("process", float(record["elapsed"]))
+                    metrics.inc("frames")
+                    metrics.inc("detections", len(result.detections))
+                    result.frame = _frame_for_result(result.frame, record)
+                    consumed += 1
+                    if consume_fn(result) is False:
+                        stopped = True
+                finally:
+                    pool.release(slot)
+    finally:
+        stop_event.set()
+        if capture_thread is not None:
+            capture_thread.join(timeout=1.0)
+        pool.close()
+        metrics.remove_collector(pool_gauges)
+
+    return {
+        "captured": state["captured"],
+        "frames_dropped": pool.dropped,
+        "results_failed": pool.failed,
+        "results_consumed": consumed,
+    }
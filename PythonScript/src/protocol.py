@@ -0,0 +1,415 @@
+#python3 -m src.protocol --loopback 10000
+# encode frames, push them through a pseudo-terminal and decode them again
+
+"""
+Serial message formats shared with ArduinoSketch.ino.
+
+Text (legacy): "x,y,z,rx,ry,rz\n" with three decimals, plus the control
+lines "KEEPALIVE\n" and "STOP\n".
+
+Binary: little-endian frames of the form
+
+    AA 55 | type u8 | len u8 | seq u16 | timestamp u32 | payload[len] | crc u16
+
+`timestamp` is the frame capture time in microseconds (time.monotonic(),
+wrapping every ~71 minutes) and the CRC is CRC-16/CCITT-FALSE over every
+byte from `type` to the end of the payload. A pose payload is the tag ID
+(u16) followed by x, y, z in millimetres and rx, ry, rz in 1e-4 rad (i16).
+A multi-pose payload is a tag count (u8) followed by that many pose
+payloads, highest priority first. Keep-alive and stop frames have no
+payload: a keep-alive tells the board the link is up while no target is
+seen, a stop tells it to halt now rather than when its timeout expires.
+"""
+
+import argparse
+import struct
+import time
+import numpy as np
+
+SYNC = b"\xAA\x55"
+MSG_POSE = 0x01
+MSG_MULTI_POSE = 0x02
+MSG_KEEPALIVE = 0x03
+MSG_STOP = 0x04
+CONTROL_TEXT = {MSG_KEEPALIVE: b"KEEPALIVE\n", MSG_STOP: b"STOP\n"}
+
+POSITION_SCALE = 1000.0   # metres -> millimetres
+ROTATION_SCALE = 10000.0  # radians -> 1e-4 rad
+
+HEADER_SIZE = 10  # sync, type, len, seq, timestamp
+CRC_SIZE = 2
+
+POSE_DTYPE = np.dtype([
+    ("sync", "<u2"),
+    ("type", "u1"),
+    ("length", "u1"),
+    ("seq", "<u2"),
+    ("timestamp", "<u4"),
+    ("tag_id", "<u2"),
+    ("position", "<i2", (3,)),
+    ("rotation", "<i2", (3,)),
+    ("crc", "<u2"),
+])
+POSE_FRAME_SIZE = POSE_DTYPE.itemsize
+POSE_PAYLOAD_SIZE = POSE_FRAME_SIZE - HEADER_SIZE - CRC_SIZE
+
+HEADER_DTYPE = np.dtype([
+    ("sync", "<u2"),
+    ("type", "u1"),
+    ("length", "u1"),
+    ("seq", "<u2"),
+    ("timestamp", "<u4"),
+])
+
+# One entry of a multi-pose payload
+TAG_POSE_DTYPE = np.dtype([
+    ("tag_id", "<u2"),
+    ("position", "<i2", (3,)),
+    ("rotation", "<i2", (3,)),
+])
+MAX_MULTI_TAGS = 8  # keeps the payload within the sketch's frame buffer
+MAX_PAYLOAD_SIZE = 1 + MAX_MULTI_TAGS * TAG_POSE_DTYPE.itemsize
+
+_SYNC_WORD = int.from_bytes(SYNC, "little")
+
+
+def _make_crc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[i] = crc & 0xFFFF
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+_CRC_TABLE_LIST = _CRC_TABLE.tolist()
+
+
+def crc16(data):
+    """
+    CRC-16/CCITT-FALSE of a bytes-like object.
+    """
+    crc = 0xFFFF
+    table = _CRC_TABLE_LIST
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+    return crc
+
+
+def crc16_rows(rows):
+    """
+    CRC-16/CCITT-FALSE of every row of an (N, M) uint8 array at once.
+    """
+    crc = np.full(rows.shape[0], 0xFFFF, dtype=np.uint16)
+    for column in rows.T:
+        crc = (crc << 8) ^ _CRC_TABLE[(crc >> 8) ^ column]
+    return crc
+
+
+def to_timestamp_us(timestamp):
+    """
+    Convert time.monotonic() seconds to the wrapping u32 microsecond field.
+    """
+    return (np.asarray(timestamp, dtype=np.float64) * 1e6).astype(np.int64) & 0xFFFFFFFF
+
+
+def encode_text(tvec, rvec):
+    """
+    Legacy CSV message: "x,y,z,rx,ry,rz\\n".
+    """
+    x, y, z = np.asarray(tvec, dtype=np.float64).flatten()
+    rx, ry, rz = np.asarray(rvec, dtype=np.float64).flatten()
+    return f"{x:.3f},{y:.3f},{z:.3f},{rx:.3f},{ry:.3f},{rz:.3f}\n".encode('utf-8')
+
+
+def encode_poses(seq, timestamps, tag_ids, tvecs, rvecs):
+    """
+    Pack N pose frames in one vectorised pass.
+
+    Parameters:
+      seq (int or array): Sequence number of the first frame, or one per frame.
+      timestamps (array): Capture times in seconds (time.monotonic()).
+      tag_ids (array): Tag IDs.
+      tvecs (array): (N, 3) translations in metres.
+      rvecs (array): (N, 3) rotation vectors in radians.
+
+    Returns:
+      bytes: N concatenated frames of POSE_FRAME_SIZE bytes each.
+    """
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape((-1, 3))
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape((-1, 3))
+    n = tvecs.shape[0]
+    seq = np.asarray(seq)
+    if seq.ndim == 0:
+        seq = int(seq) + np.arange(n)
+
+    frames = np.zeros(n, dtype=POSE_DTYPE)
+    frames["sync"] = _SYNC_WORD
+    frames["type"] = MSG_POSE
+    frames["length"] = POSE_PAYLOAD_SIZE
+    frames["seq"] = seq & 0xFFFF
+    frames["timestamp"] = to_timestamp_us(timestamps)
+    frames["tag_id"] = tag_ids
+    frames["position"] = np.clip(np.rint(tvecs * POSITION_SCALE), -32768, 32767)
+    frames["rotation"] = np.clip(np.rint(rvecs * ROTATION_SCALE), -32768, 32767)
+
+    rows = frames.view(np.uint8).reshape((n, POSE_FRAME_SIZE))
+    frames["crc"] = crc16_rows(rows[:, 2:-CRC_SIZE])
+    return frames.tobytes()
+
+
+def encode_pose(seq, timestamp, tag_id, tvec, rvec):
+    """
+    Pack a single pose frame.
+    """
+    return encode_poses(seq, [timestamp], [tag_id], tvec, rvec)
+
+
+def encode_multi_pose(seq, timestamp, tag_ids, tvecs, rvecs):
+    """
+    Pack up to MAX_MULTI_TAGS poses of one frame into a single message, in
+    the given (priority) order; extra tags are dropped.
+    """
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape((-1, 3))[:MAX_MULTI_TAGS]
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape((-1, 3))[:MAX_MULTI_TAGS]
+    tags = np.zeros(tvecs.shape[0], dtype=TAG_POSE_DTYPE)
+    tags["tag_id"] = np.asarray(tag_ids)[:MAX_MULTI_TAGS]
+    tags["position"] = np.clip(np.rint(tvecs * POSITION_SCALE), -32768, 32767)
+    tags["rotation"] = np.clip(np.rint(rvecs * ROTATION_SCALE), -32768, 32767)
+    payload = bytes([len(tags)]) + tags.tobytes()
+    body = struct.pack("<BBHI", MSG_MULTI_POSE, len(payload), seq & 0xFFFF,
+                       int(to_timestamp_us(timestamp))) + payload
+    return SYNC + body + struct.pack("<H", crc16(body))
+
+
+def encode_control(msg_type, seq, timestamp):
+    """
+    Pack a keep-alive or stop frame (MSG_KEEPALIVE or MSG_STOP, no payload).
+    """
+    if msg_type not in CONTROL_TEXT:
+        raise ValueError(f"Not a control message type: {msg_type}")
+    body = struct.pack("<BBHI", msg_type, 0, seq & 0xFFFF, int(to_timestamp_us(timestamp)))
+    return SYNC + body + struct.pack("<H", crc16(body))
+
+
+def decode_poses(frames):
+    """
+    Convert a structured POSE_DTYPE array into SI units.
+
+    Returns:
+      (seq, timestamp_us, tag_ids, tvecs, rvecs) arrays.
+    """
+    return (frames["seq"], frames["timestamp"], frames["tag_id"],
+            frames["position"] / POSITION_SCALE, frames["rotation"] / ROTATION_SCALE)
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for a byte stream of binary frames.
+
+    Bytes before a sync header, frames with an unknown type or length and
+    frames failing the CRC are skipped, so the decoder resynchronises on
+    its own after line noise or a partial write. Multi-pose frames are
+    expanded into one POSE_DTYPE row per tag, sharing the frame's header;
+    keep-alive and stop frames are only counted.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.frames = 0
+        self.keepalives = 0
+        self.stops = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """
+        Add received bytes.
+
+        Returns:
+          np.ndarray: Complete pose frames decoded so far (POSE_DTYPE), one
+          row per tag.
+        """
+        self._buffer += data
+        buf = self._buffer
+        decoded = []
+        pos = 0
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                # Keep a trailing 0xAA that may start the next header
+                keep = 1 if buf.endswith(SYNC[:1]) else 0
+                self.skipped_bytes += len(buf) - pos - keep
+                pos = len(buf) - keep
+                break
+            self.skipped_bytes += start - pos
+            if len(buf) - start < HEADER_SIZE:
+                pos = start
+                break
+            msg_type, length = buf[start + 2], buf[start + 3]
+            if not ((msg_type == MSG_POSE and length == POSE_PAYLOAD_SIZE) or
+                    (msg_type == MSG_MULTI_POSE and 0 < length <= MAX_PAYLOAD_SIZE and
+                     (length - 1) % TAG_POSE_DTYPE.itemsize == 0) or
+                    (msg_type in CONTROL_TEXT and length == 0)):
+                self.skipped_bytes += 1
+                pos = start + 1
+                continue
+            end = start + HEADER_SIZE + length + CRC_SIZE
+            if len(buf) < end:
+                pos = start
+                break
+            crc = int.from_bytes(buf[end - CRC_SIZE:end], "little")
+            if crc != crc16(buf[start + 2:end - CRC_SIZE]):
+                self.crc_errors += 1
+                self.skipped_bytes += 1
+                pos = start + 1
+                continue
+            if msg_type == MSG_POSE:
+                decoded.append(bytes(buf[start:end]))
+            elif msg_type == MSG_KEEPALIVE:
+                self.keepalives += 1
+            elif msg_type == MSG_STOP:
+                self.stops += 1
+            else:
+                decoded.append(self._expand(buf[start:end]))
+            self.frames += 1
+            pos = end
+        del buf[:pos]
+        return np.frombuffer(b"".join(decoded), dtype=POSE_DTYPE)
+
+    @staticmethod
+    def _expand(frame):
+        tags = np.frombuffer(bytes(frame[HEADER_SIZE + 1:-CRC_SIZE]), dtype=TAG_POSE_DTYPE)
+        rows = np.zeros(len(tags), dtype=POSE_DTYPE)
+        header = np.frombuffer(bytes(frame[:HEADER_SIZE]), dtype=HEADER_DTYPE)[0]
+        for name in header.dtype.names:
+            rows[name] = header[name]
+        for name in TAG_POSE_DTYPE.names:
+            rows[name] = tags[name]
+        rows["crc"] = int.from_bytes(frame[-CRC_SIZE:], "little")
+        return rows.tobytes()
+
+
+class LinkStats:
+    """
+    Match sent sequence numbers against acknowledgements from the board to
+    measure link latency and count lost frames.
+    """
+
+    def __init__(self, history=256):
+        self._sent = {}
+        self._history = history
+        self.sent = 0
+        self.acked = 0
+        self.lost = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self._last_acked = None
+
+    def on_sent(self, seq, send_time):
+        self.sent += 1
+        self._sent[seq & 0xFFFF] = send_time
+        if len(self._sent) > self._history:
+            self._sent.pop(next(iter(self._sent)))
+
+    def on_ack(self, seq, ack_time):
+        send_time = self._sent.pop(seq & 0xFFFF, None)
+        if send_time is None:
+            return None
+        if self._last_acked is not None:
+            gap = (seq - self._last_acked - 1) & 0xFFFF
+            if gap < 0x8000:
+                self.lost += gap
+        self._last_acked = seq
+        latency = ack_time - send_time
+        self.acked += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        return latency
+
+    @property
+    def mean_latency(self):
+        """
+        Mean send-to-ACK round trip in seconds (0 before the first ACK).
+        """
+        return self.latency_sum / self.acked if self.acked else 0.0
+
+    def summary(self):
+        mean = self.mean_latency
+        return (f"sent {self.sent}, acked {self.acked}, lost {self.lost}, "
+                f"latency mean {mean * 1000:.1f}ms max {self.latency_max * 1000:.1f}ms")
+
+
+def loopback_check(count=1000, chunk=64):
+    """
+    Encode `count` random poses, write them through a pseudo-terminal with
+    pyserial and decode what comes out of the other end.
+
+    Returns:
+      bool: True if every frame came back intact.
+    """
+    import os
+    import pty
+    import serial
+
+    rng = np.random.default_rng(0)
+    tvecs = rng.uniform(-2.0, 2.0, (count, 3))
+    rvecs = rng.uniform(-np.pi, np.pi, (count, 3))
+    tag_ids = rng.integers(0, 587, count)
+    timestamps = time.monotonic() + np.arange(count) * 0.01
+
+    start = time.perf_counter()
+    data = encode_poses(0, timestamps, tag_ids, tvecs, rvecs)
+    encode_time = time.perf_counter() - start
+
+    master, slave = pty.openpty()
+    os.set_blocking(master, False)
+    port = serial.Serial(os.ttyname(slave), 115200, timeout=0.1)
+    decoder = FrameDecoder()
+    received = []
+    try:
+        tty_start = time.perf_counter()
+        for i in range(0, len(data), chunk):
+            port.write(data[i:i + chunk])
+            port.flush()
+            while True:
+                try:
+                    received.append(decoder.feed(os.read(master, 4096)))
+                except BlockingIOError:
+                    break
+        deadline = time.monotonic() + 1.0
+        while decoder.frames < count and time.monotonic() < deadline:
+            try:
+                received.append(decoder.feed(os.read(master, 4096)))
+            except BlockingIOError:
+                time.sleep(0.001)
+        tty_time = time.perf_counter() - tty_start
+    finally:
+        port.close()
+        os.close(master)
+        os.close(slave)
+
+    frames = np.concatenate(received) if received else np.zeros(0, dtype=POSE_DTYPE)
+    ok = len(frames) == count
+    if ok:
+        seq, _, ids, out_t, out_r = decode_poses(frames)
+        ok = (np.array_equal(seq, np.arange(count) & 0xFFFF) and np.array_equal(ids, tag_ids)
+              and np.abs(out_t - tvecs).max() <= 0.5 / POSITION_SCALE
+              and np.abs(out_r - rvecs).max() <= 0.5 / ROTATION_SCALE)
+
+    text_size = sum(len(encode_text(t, r)) for t, r in zip(tvecs, rvecs)) / count
+    print(f"Frames: {count} sent, {len(frames)} decoded, {decoder.crc_errors} CRC errors")
+    print(f"Frame size: {POSE_FRAME_SIZE} bytes (text: {text_size:.1f} bytes average)")
+    print(f"Encode: {encode_time * 1e6 / count:.2f}us/frame, pty round trip: {tty_time:.3f}s")
+    print("Loopback OK" if ok else "Loopback FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Binary serial protocol tools.")
+    parser.add_argument('--loopback', type=int, metavar='N', default=1000,
+                        help="Send N frames through a pty and verify them (default: 1000).")
+    args = parser.parse_args()
+    raise SystemExit(0 if loopback_check(args.loopback) else 1)
@@ -1,8 +1,28 @@
-#python PythonScript/src/ReadApril.py --mode static --image [image in root].png
+#python3 -m src.read_april --mode static --image [image in root].png
+#python3 -m src.read_april --mode batch --input logs/run1 "logs/**/*.png" flight.mp4 --output audit.jsonl
+#python3 -m src.read_april --mode batch --input flight.mp4 --calib calibration.npz --output audit.npz --workers 4
+import os
+import sys
 import cv2
+import csv
+import glob
+import json
+import time
+import queue
+import threading
+import functools
+import contextlib
+import multiprocessing
 import numpy as np
 from robotpy_apriltag import AprilTagDetector
 import argparse
+from .detector import (create_detector, run_detector, to_gray, get_detection_corners, PoseEstimator,
+                       PNP_METHODS, load_detector_config)
+from .process_pool import run_process_pipeline
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".h264", ".mjpeg")
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines
 
 def detect_tags(image, detector: AprilTagDetector):
     """
@@ -111,12 +131,355 @@ def process_live_video():
     cap.release()
     cv2.destroyAllWindows()
 
-if __name__ == "__main__":
+def expand_inputs(inputs):
+    """
+    Turn directories, globs and file names into a list of ("image", path)
+    and ("video", path) sources, in the order given.
+    """
+    sources = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = sorted(os.path.join(item, name) for name in os.listdir(item))
+        elif glob.has_magic(item):
+            paths = sorted(glob.glob(item, recursive=True))
+        else:
+            paths = [item]
+        for path in paths:
+            extension = os.path.splitext(path)[1].lower()
+            if extension in VIDEO_EXTENSIONS:
+                sources.append(("video", path))
+            elif extension in IMAGE_EXTENSIONS:
+                sources.append(("image", path))
+            elif not os.path.isdir(path) and path == item:
+                print(f"Skipping {path}: not an image or video file", file=sys.stderr)
+    return sources
+
+def create_batch_processor(family, detector_settings, calibration=None, tag_size=0.0508, pnp="ippe_square"):
+    """
+    Detector (and pose solver, with a calibration) of one batch worker, as
+    a callable mapping a frame to (gray frame, detections, poses). Module
+    level so worker processes can build their own.
+    """
+    detector = create_detector(family, detector_settings)
+    estimator = None
+    if calibration is not None:
+        estimator = PoseEstimator(calibration.camera_matrix, None, tag_size, method=pnp, warm_start=False,
+                                  calibration=calibration)
+
+    def process(frame):
+        gray = to_gray(frame)
+        detections = run_detector(detector, gray)
+        poses = {}
+        if estimator is not None:
+            estimator.set_frame_size((gray.shape[1], gray.shape[0]))
+            for detection in detections:
+                rvec, tvec, error = estimator.estimate(detection)
+                if rvec is not None:
+                    poses[detection.getId()] = (detection, rvec, tvec, error)
+        return gray, detections, poses
+    return process
+
+def tag_records(detections, poses):
+    """
+    Plain (JSON-ready) description of every detection of a frame.
+    """
+    records = []
+    for detection in detections:
+        center = detection.getCenter()
+        record = {
+            "id": detection.getId(),
+            "center": [round(center.x, 3), round(center.y, 3)],
+            "corners": np.round(get_detection_corners(detection).astype(np.float64), 3).tolist(),
+            "margin": round(detection.getDecisionMargin(), 3),
+            "hamming": detection.getHamming(),
+        }
+        pose = poses.get(detection.getId())
+        if pose is not None:
+            _, rvec, tvec, error = pose
+            record["rvec"] = np.ravel(rvec).tolist()
+            record["tvec"] = np.ravel(tvec).tolist()
+            record["error"] = error
+        records.append(record)
+    return records
+
+# The processor of an image worker process, built once by _init_image_worker
+_image_worker = {}
+
+# Results go back over pipes; worker messages (e.g. calibration warnings)
+# stay off stdout, which may carry the batch output
+def _init_image_worker(processor_factory):
+    with contextlib.redirect_stdout(sys.stderr):
+        _image_worker["process"] = processor_factory()
+
+def _process_image(path):
+    # Decoding happens in the worker too; only the path and results are pickled
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return path, None
+    with contextlib.redirect_stdout(sys.stderr):
+        _, detections, poses = _image_worker["process"](image)
+    return path, tag_records(detections, poses)
+
+class JsonlWriter:
+    """
+    One JSON object per frame: {"source", "frame", "tags": [...]}, or
+    "error" instead of "tags" for unreadable frames.
+    """
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == "-" else open(path, "w")
+
+    def write(self, source, frame, tags):
+        entry = {"source": source, "frame": frame}
+        if tags is None:
+            entry["error"] = "unreadable"
+        else:
+            entry["tags"] = tags
+        self.file.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class CsvWriter:
+    """
+    One row per detection; frames without any get a row with an empty
+    tag_id, so every frame appears.
+    """
+    CORNERS = [f"corner{i}_{axis}" for i in range(4) for axis in "xy"]
+    POSE = ["rvec_x", "rvec_y", "rvec_z", "tvec_x", "tvec_y", "tvec_z", "reproj_error"]
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == "-" else open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["source", "frame", "tag_id", "center_x", "center_y"] + self.CORNERS +
+                             ["margin", "hamming"] + self.POSE)
+
+    def write(self, source, frame, tags):
+        if not tags:
+            self.writer.writerow([source, frame] + [""] * (len(self.CORNERS) + len(self.POSE) + 5))
+            return
+        for tag in tags:
+            pose = tag.get("rvec", [""] * 3) + tag.get("tvec", [""] * 3) + [tag.get("error", "")]
+            self.writer.writerow([source, frame, tag["id"]] + tag["center"] +
+                                 [v for corner in tag["corners"] for v in corner] +
+                                 [tag["margin"], tag["hamming"]] + pose)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class NpzWriter:
+    """
+    Columnar arrays written on close: one entry per frame (source, frame,
+    ok, first detection, detection count) and one per detection (frame
+    index, id, center, corners, margin, hamming and, NaN when unsolved,
+    rvec, tvec, error).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = {"source": [], "frame": [], "ok": [], "first": [], "count": []}
+        self.tags = {"frame_index": [], "tag_id": [], "center": [], "corners": [], "margin": [],
+                     "hamming": [], "rvec": [], "tvec": [], "error": []}
+
+    def write(self, source, frame, tags):
+        self.frames["source"].append(source)
+        self.frames["frame"].append(frame)
+        self.frames["ok"].append(tags is not None)
+        self.frames["first"].append(len(self.tags["tag_id"]))
+        self.frames["count"].append(len(tags or ()))
+        for tag in tags or ():
+            self.tags["frame_index"].append(len(self.frames["frame"]) - 1)
+            self.tags["tag_id"].append(tag["id"])
+            self.tags["center"].append(tag["center"])
+            self.tags["corners"].append(tag["corners"])
+            self.tags["margin"].append(tag["margin"])
+            self.tags["hamming"].append(tag["hamming"])
+            self.tags["rvec"].append(tag.get("rvec", [np.nan] * 3))
+            self.tags["tvec"].append(tag.get("tvec", [np.nan] * 3))
+            error = tag.get("error")
+            self.tags["error"].append(np.nan if error is None else error)
+
+    def close(self):
+        np.savez_compressed(
+            self.path,
+            frame_source=np.array(self.frames["source"], dtype=str),
+            frame_number=np.array(self.frames["frame"], dtype=np.int64),
+            frame_ok=np.array(self.frames["ok"], dtype=bool),
+            frame_first=np.array(self.frames["first"], dtype=np.int64),
+            frame_count=np.array(self.frames["count"], dtype=np.int32),
+            frame_index=np.array(self.tags["frame_index"], dtype=np.int64),
+            tag_id=np.array(self.tags["tag_id"], dtype=np.int32),
+            center=np.array(self.tags["center"], dtype=np.float32).reshape((-1, 2)),
+            corners=np.array(self.tags["corners"], dtype=np.float32).reshape((-1, 4, 2)),
+            margin=np.array(self.tags["margin"], dtype=np.float32),
+            hamming=np.array(self.tags["hamming"], dtype=np.int32),
+            rvec=np.array(self.tags["rvec"], dtype=np.float64).reshape((-1, 3)),
+            tvec=np.array(self.tags["tvec"], dtype=np.float64).reshape((-1, 3)),
+            error=np.array(self.tags["error"], dtype=np.float64),
+        )
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "npz": NpzWriter}
+
+def open_writer(path, output_format=None):
+    if output_format is None:
+        extension = os.path.splitext(path)[1].lower().lstrip(".")
+        output_format = extension if extension in WRITERS else "jsonl"
+    return WRITERS[output_format](path)
+
+class BatchProgress:
+    """
+    Frame, tag and throughput counters, printed every PROGRESS_INTERVAL
+    seconds and summarized at the end.
+    """
+
+    def __init__(self, total=None):
+        self.total = total
+        self.frames = 0
+        self.unreadable = 0
+        self.tags = 0
+        self.start = time.perf_counter()
+        self._next_print = self.start + PROGRESS_INTERVAL
+
+    def add(self, tags):
+        self.frames += 1
+        if tags is None:
+            self.unreadable += 1
+        else:
+            self.tags += len(tags)
+        now = time.perf_counter()
+        if now >= self._next_print:
+            self._next_print = now + PROGRESS_INTERVAL
+            total = f"/{self.total}" if self.total else ""
+            print(f"{self.frames}{total} frames, {self.frames / (now - self.start):.1f} fps, "
+                  f"{self.tags} tags", file=sys.stderr)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return (f"{self.frames} frames ({self.unreadable} unreadable) in {elapsed:.1f}s, "
+                f"{self.frames / elapsed if elapsed else 0:.1f} fps, {self.tags} tags")
+
+def _video_reader(path, frames, stop_event):
+    """
+    Decode a video ahead of the detectors into the bounded `frames` queue,
+    converting to grayscale here so workers get a third of the bytes.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        while not stop_event.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.put(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame)
+    finally:
+        cap.release()
+        frames.put(None)
+
+def process_video(path, processor_factory, writer, progress, workers, read_ahead):
+    """
+    Detect tags in every frame of a video: one thread decodes ahead, worker
+    processes detect, results are written in frame order.
+    """
+    frames = queue.Queue(maxsize=max(1, read_ahead))
+    stop_event = threading.Event()
+    reader = threading.Thread(target=_video_reader, args=(path, frames, stop_event), name="decode", daemon=True)
+    reader.start()
+
+    def capture():
+        return frames.get(), time.monotonic()
+
+    def consume(result):
+        tags = tag_records(result.detections, result.poses)
+        writer.write(path, result.seq - 1, tags)
+        progress.add(tags)
+
+    try:
+        run_process_pipeline(capture, processor_factory, consume, num_workers=workers, drop_stale=False)
+    finally:
+        stop_event.set()
+        # Unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                reader.join(timeout=0.1)
+
+def run_batch(sources, processor_factory, writer, workers, read_ahead):
+    """
+    Detect tags in every source. Images are decoded and processed by a pool
+    of worker processes, each keeping its detector; only file names and
+    results cross between processes.
+
+    Returns:
+      BatchProgress: the counters of the run.
+    """
+    total = 0
+    for kind, path in sources:
+        if kind == "image":
+            total += 1
+        else:
+            cap = cv2.VideoCapture(path)
+            total += max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+            cap.release()
+    progress = BatchProgress(total)
+    image_pool = None
+    try:
+        i = 0
+        while i < len(sources):
+            kind, path = sources[i]
+            if kind == "video":
+                print(f"Processing video {path}", file=sys.stderr)
+                process_video(path, processor_factory, writer, progress, workers, read_ahead)
+                i += 1
+                continue
+            # A run of consecutive images
+            j = i
+            while j < len(sources) and sources[j][0] == "image":
+                j += 1
+            if image_pool is None:
+                image_pool = multiprocessing.get_context("spawn").Pool(
+                    workers, initializer=_init_image_worker, initargs=(processor_factory,))
+            paths = [path for _, path in sources[i:j]]
+            for path, tags in image_pool.imap(_process_image, paths, chunksize=max(1, read_ahead // 2)):
+                writer.write(path, 0, tags)
+                progress.add(tags)
+            i = j
+    finally:
+        if image_pool is not None:
+            image_pool.close()
+            image_pool.join()
+    return progress
+
+def main():
     parser = argparse.ArgumentParser(description="AprilTag detection using robotpy-apriltag.")
-    parser.add_argument('--mode', choices=['static', 'live'], default='static',
-                        help="Choose 'static' to process an image file or 'live' for video capture.")
+    parser.add_argument('--mode', choices=['static', 'live', 'batch'], default='static',
+                        help="Choose 'static' to process an image file, 'live' for video capture or "
+                             "'batch' to audit many images and videos without a display.")
     parser.add_argument('--image', type=str, default='test_image.png',
                         help="Path to the test image (used in static mode).")
+    parser.add_argument('--input', type=str, nargs='+', default=[],
+                        help="Batch mode: image files, directories, globs (quote them) and video files.")
+    parser.add_argument('--output', type=str, default='-',
+                        help="Batch mode: results file, .jsonl, .csv or .npz (default: JSONL on stdout).")
+    parser.add_argument('--format', choices=sorted(WRITERS), default=None,
+                        help="Batch mode: output format when the extension does not say.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Batch mode: detection worker processes (default: one per CPU).")
+    parser.add_argument('--read_ahead', type=int, default=8,
+                        help="Batch mode: frames decoded ahead of the detectors (default: 8).")
+    parser.add_argument('--family', type=str, default="tag36h11",
+                        help="Batch mode: AprilTag family (default: tag36h11).")
+    parser.add_argument('--detector_config', type=str, default=None, metavar='FILE',
+                        help="Batch mode: JSON file of detector settings, e.g. written by src.autotune.")
+    parser.add_argument('--detector', type=str, action='append', default=[], metavar='NAME=VALUE',
+                        help="Batch mode: detector setting; repeatable.")
+    parser.add_argument('--calib', type=str, default=None,
+                        help="Batch mode: calibration file; adds tag poses to the results.")
+    parser.add_argument('--tag_size', type=float, default=0.0508,
+                        help="Batch mode: tag size in meters for poses (default ~2 inches = 0.0508 m).")
+    parser.add_argument('--pnp', choices=sorted(PNP_METHODS), default='ippe_square',
+                        help="Batch mode: solvePnP method for poses (default: ippe_square).")
     
     args = parser.parse_args()
     
@@ -124,3 +487,29 @@ if __name__ == "__main__":
         process_static_image(args.image)
     elif args.mode == 'live':
         process_live_video()
+    elif args.mode == 'batch':
+        try:
+            detector_settings = load_detector_config(args.detector_config, args.detector)
+        except (OSError, ValueError) as e:
+            parser.error(f"detector settings: {e}")
+        sources = expand_inputs(args.input)
+        if not sources:
+            parser.error("batch mode needs --input with at least one image or video")
+        calibration = None
+        if args.calib:
+            from config.calibration import CameraCalibration
+            with contextlib.redirect_stdout(sys.stderr):
+                calibration = CameraCalibration.load(args.calib, default_size=(1280, 720))
+        factory = functools.partial(create_batch_processor, args.family, detector_settings, calibration,
+                                    args.tag_size, args.pnp)
+        writer = open_writer(args.output, args.format)
+        try:
+            # The writer keeps the real stdout; every other message goes to stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                progress = run_batch(sources, factory, writer, max(1, args.workers), args.read_ahead)
+        finally:
+            writer.close()
+        print(f"Batch done: {progress.report()}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
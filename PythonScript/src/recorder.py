@@ -0,0 +1,486 @@
+#python3 -m src.recorder run.rec                       (summary of a recording)
+#python3 -m src.recorder run.rec --export run.npz      (all records as NumPy arrays)
+#python3 -m src.recorder run.rec --replay --pnp iterative --filter
+# record with: python3 -m src.main --target 27 --record run.rec --record_keyframes 30
+
+import cv2
+import json
+import time
+import struct
+import queue
+import argparse
+import threading
+import numpy as np
+from .detector import TagDetection, get_detection_corners, PoseEstimator, PNP_METHODS
+from .tracker import TargetTable, PRIORITIES
+from .filtering import PoseFilterBank
+
+MAGIC = b"BZREC001"
+HEADER_FORMAT = "<8sIII"  # magic, record size, capacity, metadata length; JSON metadata follows
+HEADER_SIZE = 4096
+RECORD_SIZE = 640
+MAX_TAGS = 8
+
+# Record kinds
+KIND_EMPTY = 0
+KIND_DETECTIONS = 1
+KIND_SERIAL_TX = 2
+KIND_SERIAL_RX = 3
+
+# Common to every record; `seq` orders the records in the ring
+RECORD_HEADER = [
+    ("kind", "u1"),
+    ("count", "u1"),          # tags in a detections record
+    ("length", "<u2"),        # bytes in a data record
+    ("seq", "<u4"),           # record number, 1-based
+    ("timestamp", "<f8"),     # time.monotonic()
+]
+
+DETECTION_DTYPE = np.dtype({
+    "names": [name for name, _ in RECORD_HEADER] + [
+        "frame_seq", "keyframe", "tag_id", "margin", "corners", "rvec", "tvec", "error"],
+    "formats": [fmt for _, fmt in RECORD_HEADER] + [
+        "<u4", "<i4", ("<i2", MAX_TAGS), ("<f4", MAX_TAGS), ("<f4", (MAX_TAGS, 4, 2)),
+        ("<f4", (MAX_TAGS, 3)), ("<f4", (MAX_TAGS, 3)), ("<f4", MAX_TAGS)],
+    "itemsize": RECORD_SIZE,
+})
+
+DATA_DTYPE = np.dtype({
+    "names": [name for name, _ in RECORD_HEADER] + ["data"],
+    "formats": [fmt for _, fmt in RECORD_HEADER] + [("u1", RECORD_SIZE - 16)],
+    "itemsize": RECORD_SIZE,
+})
+
+KEYFRAME_HEADER = [
+    ("frame_seq", "<u4"),
+    ("seq", "<u4"),           # keyframe number, 1-based; 0 = empty slot
+    ("timestamp", "<f8"),
+]
+
+def _keyframe_dtype(size):
+    width, height = size
+    return np.dtype(KEYFRAME_HEADER + [("image", "u1", (height, width))])
+
+def _write_header(path, capacity, meta):
+    meta = json.dumps(meta).encode()
+    header = struct.pack(HEADER_FORMAT, MAGIC, RECORD_SIZE, capacity, len(meta)) + meta
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Recording metadata too large")
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        # Preallocate the ring so writes never extend the file
+        f.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    magic, record_size, capacity, meta_len = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a recording")
+    if record_size != RECORD_SIZE:
+        raise ValueError(f"Unsupported record size {record_size}")
+    start = struct.calcsize(HEADER_FORMAT)
+    return capacity, json.loads(header[start:start + meta_len].decode())
+
+class FlightRecorder:
+    """
+    Appends fixed-size records to a preallocated, memory-mapped ring file:
+    the detections and poses of every frame, the serial bytes sent and the
+    lines received from the Arduino. Once the ring is full the oldest
+    records are overwritten, so the file always holds the last few minutes.
+
+    The record_* methods only queue references; packing and writing happen
+    on a background thread. If that thread falls behind, records are dropped
+    (and counted) instead of blocking the vision loop.
+
+    Optionally every Nth frame is also kept as a small gray keyframe in a
+    second ring file (`path + ".frames"`).
+
+    Parameters:
+      path (str): Recording file, created or overwritten.
+      size_mb (float): Size of the record ring (640 bytes per record).
+      meta (dict): JSON-serializable metadata stored in the header
+        (camera matrix, tag size, targets...) for replay.
+      keyframe_interval (int): Keep every Nth frame, 0 for none.
+      keyframe_size (tuple): (width, height) of the keyframes.
+      keyframe_count (int): Capacity of the keyframe ring.
+      queue_size (int): Records waiting for the writer before drops start.
+    """
+
+    def __init__(self, path, size_mb=64, meta=None, keyframe_interval=0, keyframe_size=(160, 120),
+                 keyframe_count=512, queue_size=1024):
+        self.path = path
+        self.capacity = max(int(size_mb * 1024 * 1024) // RECORD_SIZE, 1)
+        meta = dict(meta or {})
+        meta.update(created=time.time(), keyframe_size=list(keyframe_size),
+                    keyframe_count=keyframe_count if keyframe_interval else 0)
+        _write_header(path, self.capacity, meta)
+        self._records = np.memmap(path, dtype=np.uint8, mode="r+", offset=HEADER_SIZE,
+                                  shape=(self.capacity, RECORD_SIZE))
+        self._detections = self._records.view(DETECTION_DTYPE).reshape(self.capacity)
+        self._data = self._records.view(DATA_DTYPE).reshape(self.capacity)
+
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_size = tuple(keyframe_size)
+        self._keyframes = None
+        if keyframe_interval:
+            self._keyframes = np.memmap(path + ".frames", dtype=_keyframe_dtype(keyframe_size),
+                                        mode="w+", shape=(keyframe_count,))
+        self.seq = 0
+        self.keyframe_seq = 0
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def _post(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_frame(self, frame_seq, timestamp, detections, poses, frame=None):
+        """
+        Queue one frame's detections and the poses of its targets.
+
+        Parameters:
+          frame_seq (int): Frame number.
+          timestamp (float): Capture time (time.monotonic()).
+          detections (list): All detections of the frame.
+          poses (dict): tag ID -> (detection, rvec, tvec, error).
+          frame (np.ndarray): The frame, used when a keyframe is due. It is
+            downscaled here, since capture buffers are reused.
+        """
+        keyframe = None
+        if frame is not None and self.keyframe_interval and frame_seq % self.keyframe_interval == 0:
+            small = cv2.resize(frame, self.keyframe_size, interpolation=cv2.INTER_AREA)
+            if small.ndim == 3:
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            keyframe = small
+        self._post((KIND_DETECTIONS, timestamp, (frame_seq, list(detections), dict(poses), keyframe)))
+
+    def record_serial_tx(self, data, timestamp=None):
+        self._post((KIND_SERIAL_TX, time.monotonic() if timestamp is None else timestamp, bytes(data)))
+
+    def record_serial_rx(self, line, timestamp=None):
+        self._post((KIND_SERIAL_RX, time.monotonic() if timestamp is None else timestamp,
+                    line.encode("utf-8", "replace")))
+
+    def _next_slot(self):
+        self.seq += 1
+        return (self.seq - 1) % self.capacity
+
+    def _write_detections(self, timestamp, frame_seq, detections, poses, keyframe):
+        keyframe_index = -1
+        if keyframe is not None:
+            keyframe_index = self._write_keyframe(frame_seq, timestamp, keyframe)
+        # Targets first so they are never cut off, then the other tags
+        ordered = [d for d in detections if d.getId() in poses]
+        ordered += [d for d in detections if d.getId() not in poses]
+        while True:
+            chunk, ordered = ordered[:MAX_TAGS], ordered[MAX_TAGS:]
+            slot = self._next_slot()
+            record = self._detections[slot]
+            # Invalidate the slot while it is being rewritten
+            record["kind"] = KIND_EMPTY
+            record["seq"] = self.seq
+            record["timestamp"] = timestamp
+            record["frame_seq"] = frame_seq
+            record["keyframe"] = keyframe_index
+            record["count"] = len(chunk)
+            record["length"] = 0
+            record["rvec"] = np.nan
+            record["tvec"] = np.nan
+            record["error"] = np.nan
+            for i, detection in enumerate(chunk):
+                tag_id = detection.getId()
+                record["tag_id"][i] = tag_id
+                record["margin"][i] = detection.getDecisionMargin()
+                record["corners"][i] = get_detection_corners(detection)
+                if tag_id in poses:
+                    _, rvec, tvec, error = poses[tag_id]
+                    record["rvec"][i] = np.ravel(rvec)
+                    record["tvec"][i] = np.ravel(tvec)
+                    record["error"][i] = np.nan if error is None else error
+            record["kind"] = KIND_DETECTIONS
+            self.written += 1
+            if not ordered:
+                break
+
+    def _write_keyframe(self, frame_seq, timestamp, image):
+        self.keyframe_seq += 1
+        index = (self.keyframe_seq - 1) % len(self._keyframes)
+        slot = self._keyframes[index]
+        slot["seq"] = 0
+        slot["frame_seq"] = frame_seq
+        slot["timestamp"] = timestamp
+        slot["image"] = image
+        slot["seq"] = self.keyframe_seq
+        return self.keyframe_seq
+
+    def _write_data(self, kind, timestamp, data):
+        # Long messages span several records
+        size = DATA_DTYPE["data"].shape[0]
+        for start in range(0, max(len(data), 1), size):
+            chunk = data[start:start + size]
+            record = self._data[self._next_slot()]
+            record["kind"] = KIND_EMPTY
+            record["seq"] = self.seq
+            record["timestamp"] = timestamp
+            record["count"] = 0
+            record["length"] = len(chunk)
+            record["data"][:len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            record["kind"] = kind
+            self.written += 1
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                kind, timestamp, payload = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+            try:
+                if kind == KIND_DETECTIONS:
+                    self._write_detections(timestamp, *payload)
+                else:
+                    self._write_data(kind, timestamp, payload)
+            except Exception as e:
+                print(f"Error in recorder: {e}")
+            now = time.monotonic()
+            if now - last_flush > 1.0:
+                self._records.flush()
+                last_flush = now
+
+    def close(self):
+        """
+        Write what is queued, flush and close the files.
+        """
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        self._records.flush()
+        if self._keyframes is not None:
+            self._keyframes.flush()
+        print(f"Recorder: {self.written} records written to {self.path}, {self.dropped} dropped")
+
+class RecordReader:
+    """
+    Reads a recording written by FlightRecorder, oldest record first.
+
+    Parameters:
+      path (str): Recording file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.capacity, self.meta = _read_header(path)
+        self._records = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE,
+                                  shape=(self.capacity, RECORD_SIZE))
+        seq = self._records.view(DETECTION_DTYPE).reshape(self.capacity)["seq"]
+        kind = self._records[:, 0]
+        valid = np.flatnonzero(kind != KIND_EMPTY)
+        # Ring order: by record number
+        self._order = valid[np.argsort(seq[valid], kind="stable")]
+        self._keyframes = None
+        if self.meta.get("keyframe_count"):
+            self._keyframes = np.memmap(path + ".frames", mode="r",
+                                        dtype=_keyframe_dtype(self.meta["keyframe_size"]),
+                                        shape=(self.meta["keyframe_count"],))
+
+    def __len__(self):
+        return len(self._order)
+
+    def _of_kind(self, kind):
+        rows = self._order[self._records[self._order, 0] == kind]
+        return rows
+
+    def detections(self):
+        """
+        Detection records as a DETECTION_DTYPE array. Entries beyond `count`
+        in each record are unused; rvec/tvec are NaN for non-target tags.
+        """
+        return np.array(self._records[self._of_kind(KIND_DETECTIONS)]).view(DETECTION_DTYPE).ravel()
+
+    def _data(self, kind):
+        return np.array(self._records[self._of_kind(kind)]).view(DATA_DTYPE).ravel()
+
+    def serial_tx(self):
+        """
+        Serial writes as a DATA_DTYPE array; see messages() for the bytes.
+        """
+        return self._data(KIND_SERIAL_TX)
+
+    def serial_rx(self):
+        """
+        Lines received from the Arduino as a DATA_DTYPE array.
+        """
+        return self._data(KIND_SERIAL_RX)
+
+    @staticmethod
+    def messages(records):
+        """
+        (timestamp, bytes) of DATA_DTYPE records.
+        """
+        return [(float(r["timestamp"]), r["data"][:r["length"]].tobytes()) for r in records]
+
+    def keyframes(self):
+        """
+        Stored keyframes in order, as a structured array with frame_seq,
+        timestamp and image fields, or None if none were recorded.
+        """
+        if self._keyframes is None:
+            return None
+        frames = np.array(self._keyframes)
+        frames = frames[frames["seq"] > 0]
+        return frames[np.argsort(frames["seq"], kind="stable")]
+
+    def __iter__(self):
+        """
+        Stream all records in order as (kind, record) with the record viewed
+        in its kind's dtype.
+        """
+        detections = self._records.view(DETECTION_DTYPE).reshape(self.capacity)
+        data = self._records.view(DATA_DTYPE).reshape(self.capacity)
+        for row in self._order:
+            kind = int(self._records[row, 0])
+            yield kind, (detections[row] if kind == KIND_DETECTIONS else data[row])
+
+    def frames(self):
+        """
+        Rebuild each recorded frame: yields (frame_seq, timestamp, detections)
+        with TagDetection objects, merging records of frames with more than
+        MAX_TAGS tags.
+        """
+        current = None
+        for record in self.detections():
+            if current is not None and record["frame_seq"] != current[0]:
+                yield current
+                current = None
+            if current is None:
+                current = (int(record["frame_seq"]), float(record["timestamp"]), [])
+            for i in range(record["count"]):
+                corners = record["corners"][i].astype(np.float64)
+                current[2].append(TagDetection(int(record["tag_id"][i]), corners, corners.mean(axis=0),
+                                               float(record["margin"][i])))
+        if current is not None:
+            yield current
+
+    def export(self, path):
+        """
+        Save all records as NumPy arrays in one .npz file.
+        """
+        arrays = {"detections": self.detections(), "serial_tx": self.serial_tx(),
+                  "serial_rx": self.serial_rx(), "meta": np.array(json.dumps(self.meta))}
+        keyframes = self.keyframes()
+        if keyframes is not None:
+            arrays["keyframes"] = keyframes
+        np.savez(path, **arrays)
+
+def replay(reader, targets=None, camera_matrix=None, dist_coeffs=None, tag_size=None, pnp="ippe_square",
+           priority="listed", use_filter=False):
+    """
+    Deterministically re-run pose estimation, the target table and
+    (optionally) the pose filter on recorded detections, with the recorded
+    timestamps.
+
+    Defaults come from the recording's metadata.
+
+    Yields:
+      (frame_seq, timestamp, targets) with targets as published by
+      TargetTable.update.
+    """
+    meta = reader.meta
+    targets = targets or meta["targets"]
+    camera_matrix = np.array(meta["camera_matrix"]) if camera_matrix is None else camera_matrix
+    if dist_coeffs is None and meta.get("dist_coeffs") is not None:
+        dist_coeffs = np.array(meta["dist_coeffs"])
+    tag_size = tag_size or meta["tag_size"]
+    calibration = None
+    if "image_size" in meta:
+        # Same corner undistortion and intrinsics scaling as the live loop
+        from config.calibration import CameraCalibration
+        calibration = CameraCalibration(camera_matrix, dist_coeffs, meta["image_size"])
+    estimator = PoseEstimator(camera_matrix, dist_coeffs, tag_size, method=pnp, calibration=calibration)
+    if calibration is not None:
+        scale = meta.get("frame_upscale", 1.0)
+        width, height = calibration.image_size
+        estimator.set_frame_size((round(width * scale), round(height * scale)))
+    table = TargetTable(targets, priority)
+    bank = PoseFilterBank() if use_filter else None
+    target_set = set(targets)
+    for frame_seq, timestamp, detections in reader.frames():
+        poses = {}
+        for detection in detections:
+            if detection.getId() in target_set:
+                rvec, tvec, error = estimator.estimate(detection, now=timestamp)
+                if rvec is not None:
+                    poses[detection.getId()] = (detection, rvec, tvec, error)
+        if bank is not None:
+            poses = bank.update(poses, timestamp)
+        yield frame_seq, timestamp, table.update(poses, timestamp)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, export or replay a flight recording")
+    parser.add_argument('path', help="Recording file written with --record.")
+    parser.add_argument('--export', type=str, default=None, help="Save all records to this .npz file.")
+    parser.add_argument('--serial', action='store_true', help="Print the serial traffic.")
+    parser.add_argument('--replay', action='store_true',
+                        help="Re-solve the recorded corners and compare with the recorded poses.")
+    parser.add_argument('--pnp', choices=sorted(PNP_METHODS), default='ippe_square',
+                        help="solvePnP method for --replay (default: ippe_square).")
+    parser.add_argument('--priority', choices=PRIORITIES, default='listed',
+                        help="Target order for --replay (default: listed).")
+    parser.add_argument('--filter', action='store_true', help="Run the pose filter in --replay.")
+    args = parser.parse_args()
+
+    reader = RecordReader(args.path)
+    detections = reader.detections()
+    serial_tx = reader.serial_tx()
+    serial_rx = reader.serial_rx()
+    keyframes = reader.keyframes()
+    print(f"{args.path}: {len(reader)} of {reader.capacity} records")
+    if len(detections):
+        span = detections["timestamp"][-1] - detections["timestamp"][0]
+        frames = len(np.unique(detections["frame_seq"]))
+        print(f"  {frames} frames over {span:.1f}s, {int(detections['count'].sum())} detections")
+    print(f"  {len(serial_tx)} serial writes ({int(serial_tx['length'].sum())} bytes), "
+          f"{len(serial_rx)} lines from the Arduino")
+    if keyframes is not None:
+        print(f"  {len(keyframes)} keyframes")
+
+    if args.serial:
+        start = detections["timestamp"][0] if len(detections) else 0.0
+        tx = [(t, "TX", data.hex(" ")) for t, data in reader.messages(serial_tx)]
+        rx = [(t, "RX", data.decode("utf-8", "replace")) for t, data in reader.messages(serial_rx)]
+        for t, direction, text in sorted(tx + rx):
+            print(f"{t - start:9.3f} {direction} {text}")
+
+    if args.export:
+        reader.export(args.export)
+        print(f"Exported to {args.export}")
+
+    if args.replay:
+        recorded = {}
+        for record in detections:
+            for i in range(record["count"]):
+                if not np.isnan(record["tvec"][i][0]):
+                    recorded[(int(record["frame_seq"]), int(record["tag_id"][i]))] = record["tvec"][i]
+        differences = []
+        published = 0
+        for frame_seq, _, targets in replay(reader, pnp=args.pnp, priority=args.priority,
+                                            use_filter=args.filter):
+            for tag_id, _, tvec in targets:
+                published += 1
+                if (frame_seq, tag_id) in recorded:
+                    differences.append(np.linalg.norm(tvec.ravel() - recorded[(frame_seq, tag_id)]))
+        print(f"Replay: {published} target poses")
+        if differences:
+            differences = np.array(differences) * 1000
+            print(f"  position vs recorded: mean {differences.mean():.2f}mm, max {differences.max():.2f}mm")
+
+if __name__ == "__main__":
+    main()
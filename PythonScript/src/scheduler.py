@@ -0,0 +1,223 @@
+#python3 -m src.scheduler --rate 200 --duration 10
+# run the clock with no serial port attached and print its jitter statistics
+
+import time
+import argparse
+import threading
+import collections
+import numpy as np
+from .protocol import MSG_KEEPALIVE, MSG_STOP
+from .metrics import metrics
+
+
+class CommandScheduler:
+    """
+    Sends motion commands to the board on a fixed-rate clock, independent of
+    when camera frames arrive.
+
+    Tick k is due at start + k / rate. Every tick sends the newest pose posted
+    (or, with `predict`, the pose extrapolated to the tick), a stop message
+    for the first few ticks after the target is lost, and keep-alives while
+    nothing is tracked, so the board can tell a lost target from a dead link.
+    Ticks whose slot has already passed are skipped rather than sent in a
+    burst, and counted as missed deadlines.
+
+    Parameters:
+      rate (float): Ticks per second.
+      send_poses: Callable (poses, timestamp) writing (tag_id, rvec, tvec)
+        tuples, e.g. send_data.send_poses. Only called from the clock thread.
+      send_control: Callable (msg_type, timestamp) writing a keep-alive or
+        stop message, e.g. send_data.send_control.
+      predict: Optional callable now -> (poses, timestamp) returning the
+        poses to send at time `now`; replaces the posted poses.
+      hold_time (float): Seconds a posted pose is resent before the target
+        counts as lost.
+      keepalive_interval (float): Seconds between keep-alives while no
+        target is tracked.
+      stop_repeats (int): Stop messages sent after a target is lost, so one
+        corrupted message does not leave the robot driving.
+      tolerance (float): Fraction of a period a tick may start late before
+        it counts as a missed deadline.
+      spin (float): Seconds before each deadline spent polling the clock
+        instead of sleeping, for sub-millisecond timing.
+    """
+
+    def __init__(self, rate, send_poses, send_control, predict=None, hold_time=0.15, keepalive_interval=0.05,
+                 stop_repeats=3, tolerance=0.5, spin=0.0005, history=4096):
+        if rate <= 0:
+            raise ValueError(f"Bad scheduler rate: {rate}")
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.send_poses = send_poses
+        self.send_control = send_control
+        self.predict = predict
+        self.hold_time = hold_time
+        self.keepalive_interval = keepalive_interval
+        self.stop_repeats = stop_repeats
+        self.tolerance = tolerance
+        self.spin = spin
+        self.stats = {"ticks": 0, "poses": 0, "keepalives": 0, "stops": 0, "skipped": 0, "late": 0,
+                      "send_errors": 0}
+        self._lateness = collections.deque(maxlen=history)
+        self._intervals = collections.deque(maxlen=history)
+        self._latest = (None, None, 0.0)
+        # Start halted: the first ticks tell the board to stop
+        self._stops_left = stop_repeats
+        self._last_control = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+        self._thread.start()
+
+    def post(self, poses, timestamp=None):
+        """
+        Hand over the newest poses (tag_id, rvec, tvec), highest priority
+        first; sent from the next tick on. Same signature as
+        send_data.targets_detected_action and never blocks.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._latest = (list(poses), now if timestamp is None else timestamp, now)
+
+    def _wait_until(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > self.spin:
+            self._stop.wait(remaining - self.spin)
+        while time.monotonic() < deadline and not self._stop.is_set():
+            pass
+
+    def _send(self, now):
+        if self.predict is not None:
+            poses, timestamp = self.predict(now)
+        else:
+            with self._lock:
+                poses, timestamp, posted = self._latest
+            if poses and now - posted > self.hold_time:
+                poses = None
+        if poses:
+            self._stops_left = self.stop_repeats
+            self._last_control = None
+            sent = self.send_poses(poses, timestamp)
+            kind = "poses"
+        elif self._stops_left > 0:
+            self._stops_left -= 1
+            self._last_control = now
+            sent = self.send_control(MSG_STOP, now)
+            kind = "stops"
+        elif self._last_control is None or now - self._last_control >= self.keepalive_interval - self.period / 2:
+            self._last_control = now
+            sent = self.send_control(MSG_KEEPALIVE, now)
+            kind = "keepalives"
+        else:
+            return
+        if sent is False:
+            self.stats["send_errors"] += 1
+        else:
+            self.stats[kind] += 1
+
+    def _run(self):
+        start = time.monotonic()
+        tick = 0
+        previous = None
+        while True:
+            deadline = start + tick * self.period
+            self._wait_until(deadline)
+            if self._stop.is_set():
+                break
+            now = time.monotonic()
+            late = now - deadline
+            if late >= self.period:
+                # Whole slots went by (slow write, descheduled): drop them
+                skipped = int(late // self.period)
+                tick += skipped
+                late -= skipped * self.period
+                self.stats["skipped"] += skipped
+                metrics.inc("sched_deadline_misses", skipped)
+            if late > self.tolerance * self.period:
+                self.stats["late"] += 1
+                metrics.inc("sched_deadline_misses")
+            self.stats["ticks"] += 1
+            self._lateness.append(late)
+            metrics.observe("sched_lateness", late)
+            if previous is not None:
+                self._intervals.append(now - previous)
+            previous = now
+            try:
+                self._send(now)
+            except Exception as e:
+                self.stats["send_errors"] += 1
+                print(f"Error in command scheduler: {e}")
+            tick += 1
+
+    @property
+    def missed_deadlines(self):
+        return self.stats["skipped"] + self.stats["late"]
+
+    def jitter(self):
+        """
+        Timing of the recent ticks in seconds.
+
+        Returns:
+          dict: lateness_mean, lateness_p50, lateness_p99, lateness_max (tick
+          start after its deadline) and interval_std (spread of the time
+          between tick starts).
+        """
+        lateness = np.array(self._lateness)
+        intervals = np.array(self._intervals)
+        if not len(lateness):
+            return {"lateness_mean": 0.0, "lateness_p50": 0.0, "lateness_p99": 0.0, "lateness_max": 0.0,
+                    "interval_std": 0.0}
+        p50, p99 = np.percentile(lateness, [50, 99])
+        return {"lateness_mean": float(lateness.mean()), "lateness_p50": float(p50), "lateness_p99": float(p99),
+                "lateness_max": float(lateness.max()),
+                "interval_std": float(intervals.std()) if len(intervals) > 1 else 0.0}
+
+    def summary(self):
+        stats = self.stats
+        jitter = self.jitter()
+        return (f"{stats['ticks']} ticks at {self.rate:g}Hz: {stats['poses']} poses, "
+                f"{stats['keepalives']} keep-alives, {stats['stops']} stops, {stats['send_errors']} send errors; "
+                f"{self.missed_deadlines} missed deadlines ({stats['skipped']} skipped, {stats['late']} late); "
+                f"lateness p50 {jitter['lateness_p50'] * 1e3:.3f}ms p99 {jitter['lateness_p99'] * 1e3:.3f}ms "
+                f"max {jitter['lateness_max'] * 1e3:.3f}ms, interval std {jitter['interval_std'] * 1e3:.3f}ms")
+
+    def close(self, final_stop=True):
+        """
+        Stop the clock and, by default, send one last stop message so the
+        robot does not keep driving on its final command.
+        """
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        if final_stop:
+            try:
+                if self.send_control(MSG_STOP, time.monotonic()) is not False:
+                    self.stats["stops"] += 1
+            except Exception as e:
+                print(f"Error sending final stop: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the command scheduler's timing without a serial port.")
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help="Ticks per second (default: 100).")
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="Seconds to run (default: 5).")
+    parser.add_argument('--spin', type=float, default=0.0005,
+                        help="Seconds polled before each deadline instead of sleeping (default: 0.0005).")
+    parser.add_argument('--write_time', type=float, default=0.0,
+                        help="Simulated duration of each serial write in seconds (default: 0).")
+    args = parser.parse_args()
+
+    def send(*message):
+        if args.write_time > 0:
+            time.sleep(args.write_time)
+        return True
+
+    scheduler = CommandScheduler(args.rate, send, send, spin=args.spin)
+    time.sleep(args.duration)
+    scheduler.close()
+    print(scheduler.summary())
+
+
+if __name__ == "__main__":
+    main()
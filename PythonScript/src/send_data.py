@@ -1,148 +1,458 @@
-import serial
 import time
 import threading
 from datetime import datetime
+from .protocol import (encode_text, encode_pose, encode_multi_pose, encode_control, LinkStats, CONTROL_TEXT,
+                       MSG_STOP)
+from .pipeline import LatestBuffer
+from .connection import ConnectionManager, ARDUINO_USB_IDS
+from .metrics import metrics
 
-# Global serial connection
+# Global serial connection, published by the connection manager thread
 ser = None
+connection = None  # ConnectionManager finding and (re)opening the board
 debug_thread = None
+writer_thread = None
 should_stop = False
-last_error_time = 0
-error_cooldown = 5  # seconds to wait between retries
-thread_lock = threading.Lock()
+thread_lock = threading.Lock()  # guards opening/closing `ser`, never held during I/O
 last_send_time = 0
+serial_ports = None  # explicit device paths/globs; None: find boards by USB ID
+usb_ids = list(ARDUINO_USB_IDS)
 min_send_interval = 0.05  # 50ms between sends (20Hz)
+protocol = "text"  # "text" (CSV line) or "binary" (see protocol.py)
+send_seq = 0
+link_stats = LinkStats()
+verbose = True  # print every pose sent; the metrics log line covers quiet runs
+verbose_interval = 0.5  # with a scheduler, seconds between printed reports
+next_report_time = 0.0
+recorder = None  # FlightRecorder receiving the serial traffic, if any
+scheduler = None  # CommandScheduler owning the writes instead of the writer thread, if any
+
+# Single-slot "latest pose wins" mailbox between the vision loop and the writer
+pose_mailbox = LatestBuffer(1)
+writer_stats = {
+    "posted": 0,
+    "written": 0,
+    "replaced": 0,
+    "write_errors": 0,
+    "offline": 0,
+    "write_time_total": 0.0,
+    "write_time_max": 0.0,
+}
+
+def _link_gauges():
+    return {"serial_mailbox_dropped": pose_mailbox.dropped, "link_sent": link_stats.sent,
+            "link_acked": link_stats.acked, "link_lost": link_stats.lost,
+            "serial_connected": int(ser is not None)}
+
+metrics.add_collector(_link_gauges)
+
+def set_protocol(name):
+    """
+    Select the wire format used by target_detected_action: "text" or "binary".
+    """
+    global protocol
+    if name not in ("text", "binary"):
+        raise ValueError(f"Unknown protocol: {name}")
+    protocol = name
+
+def set_recorder(flight_recorder):
+    """
+    Record every message sent and every line received (FlightRecorder or None).
+    """
+    global recorder
+    recorder = flight_recorder
+
+def set_scheduler(command_scheduler):
+    """
+    Route the poses handed to target(s)_detected_action to a
+    CommandScheduler, which sends them on its own clock, instead of the
+    writer thread (None restores the writer thread).
+    """
+    global scheduler
+    scheduler = command_scheduler
+
+def set_ports(ports=None, extra_usb_ids=()):
+    """
+    Choose where the connection manager looks for the board: explicit
+    device paths or globs (e.g. a simulator's pty), or None to enumerate
+    USB serial ports by ID, with `extra_usb_ids` (vid, pid) added to the
+    known Arduino IDs. Takes effect when the manager starts.
+    """
+    global serial_ports, usb_ids
+    serial_ports = list(ports) if ports else None
+    usb_ids = list(ARDUINO_USB_IDS) + list(extra_usb_ids)
+
+def set_verbose(flag):
+    """
+    Enable or disable the per-message prints of the writer thread. With a
+    CommandScheduler they are limited to one per verbose_interval.
+    """
+    global verbose
+    verbose = flag
+
+def set_send_rate(rate):
+    """
+    Set the maximum number of messages per second the writer sends.
+    """
+    global min_send_interval
+    if rate <= 0:
+        raise ValueError(f"Bad send rate: {rate}")
+    min_send_interval = 1.0 / rate
+
+def link_latency():
+    """
+    Estimated one-way latency of the serial link in seconds: half the mean
+    ACK round trip of the binary protocol, 0 until ACKs have been seen.
+    """
+    return link_stats.mean_latency / 2
 
 def read_debug_messages():
     """
     Continuously read and print debug messages from the Arduino.
+    Runs without taking any lock; the writer thread owns all writes.
     """
-    global ser, should_stop
+    global should_stop
     while not should_stop:
+        port = ser
         try:
-            with thread_lock:
-                if ser is None or not ser.is_open:
-                    time.sleep(0.1)  # Wait a bit before retrying
-                    continue
-                
-                if ser.in_waiting:
-                    try:
-                        line = ser.readline().decode('utf-8').strip()
-                        # Print all messages from Arduino with timestamp
-                        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-                        print(f"[{timestamp}] Arduino: {line}")
-                    except Exception as e:
-                        print(f"Error reading message: {e}")
-                        time.sleep(0.1)  # Wait before retrying
+            if port is None or not port.is_open:
+                time.sleep(0.1)  # Wait a bit before retrying
+                continue
+
+            if port.in_waiting:
+                try:
+                    line = port.readline().decode('utf-8').strip()
+                    if recorder is not None:
+                        recorder.record_serial_rx(line)
+                    if line == "PONG":
+                        continue
+                    if line == "READY":
+                        # setup() ran again: the board was reset under us
+                        print("Arduino reset detected")
+                        metrics.inc("serial_board_resets")
+                        continue
+                    if line.startswith("ACK "):
+                        # Acknowledgement of a binary frame: "ACK <seq>"
+                        try:
+                            latency = link_stats.on_ack(int(line[4:]), time.monotonic())
+                            if latency is not None:
+                                metrics.observe("link_rtt", latency)
+                        except ValueError:
+                            pass
                         continue
-                
-            time.sleep(0.01)  # Small delay to prevent CPU overuse
-            
+                    # Print all messages from Arduino with timestamp
+                    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+                    print(f"[{timestamp}] Arduino: {line}")
+                except UnicodeDecodeError as e:
+                    print(f"Error reading message: {e}")
+                    continue
+            else:
+                time.sleep(0.01)  # Small delay to prevent CPU overuse
+
         except Exception as e:
-            print(f"Error in debug thread: {e}")
+            # The port failed (usually unplugged): let the manager reconnect
+            _connection_lost(port, str(e))
             time.sleep(0.1)  # Wait before retrying
             continue
 
-def initialize_serial():
+def _on_connect(port, device):
+    global ser
+    if metrics.counter("serial_connects"):
+        metrics.inc("serial_reconnects")
+    metrics.inc("serial_connects")
+    with thread_lock:
+        ser = port
+
+def _on_disconnect(port, device, reason):
+    global ser
+    with thread_lock:
+        if ser is port:
+            ser = None
+
+def _connection_lost(port, reason):
+    """
+    Hand a failed port back to the connection manager, which closes it and
+    starts looking for the board again.
+    """
+    manager = connection
+    if manager is not None:
+        manager.lost(port, reason)
+
+def initialize_serial(wait=0.0):
+    """
+    Start the connection manager thread, which finds the board by USB ID
+    (or the ports given to set_ports), waits for its READY/PONG handshake
+    and reconnects with backoff when it is lost, and the debug reader.
+    Never blocks longer than `wait` seconds.
+
+    Returns:
+      bool: True if a board is connected.
     """
-    Initialize the serial connection.
-    Returns True if successful, False otherwise.
+    global connection, debug_thread, should_stop
+    should_stop = False
+    if connection is None:
+        connection = ConnectionManager(_on_connect, _on_disconnect, usb_ids=usb_ids, ports=serial_ports)
+    if debug_thread is None or not debug_thread.is_alive():
+        debug_thread = threading.Thread(target=read_debug_messages)
+        debug_thread.daemon = True
+        debug_thread.start()
+    if wait > 0:
+        connection.wait_connected(wait)
+    return connection.connected
+
+def connection_state():
     """
-    global ser, debug_thread, should_stop, last_error_time
+    Current link state as one consistent snapshot.
+
+    Returns:
+      (state, device, since): state is "searching", "connecting",
+      "connected", "backoff" or "stopped" ("stopped" also before
+      initialize_serial), device the port in use or being tried, since the
+      time.monotonic() of the last change.
+    """
+    manager = connection
+    if manager is None:
+        return ("stopped", None, 0.0)
+    return manager.state
+
+def _ensure_connection():
+    """
+    Returns True if a connection is available; never waits for one. The
+    first call starts the connection manager.
+    """
+    if connection is None:
+        initialize_serial()
+    port = ser
+    return port is not None and port.is_open
+
+def _report_due(current_time):
+    """
+    Whether to print the verbose report of the message being sent. The
+    writer thread reports every message; the CommandScheduler sends one
+    every tick (100-200 per second) and console writes would delay its
+    clock, so then only one message per verbose_interval is reported.
+    """
+    global next_report_time
+    if not verbose:
+        return False
+    if scheduler is None:
+        return True
+    if current_time < next_report_time:
+        return False
+    next_report_time = current_time + verbose_interval
+    return True
+
+def _write_message(message, current_time, description, report):
+    """
+    Write one encoded message, update the counters and, for the binary
+    protocol, advance the sequence number. On errors the port goes back to
+    the connection manager to reconnect. `report` prints what was sent.
+    """
+    global last_send_time, send_seq
+    port = ser
     try:
-        # Try different common port names
-        ports = ['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyACM0', '/dev/ttyACM1']
-        for port in ports:
-            try:
-                with thread_lock:
-                    if ser is not None and ser.is_open:
-                        ser.close()
-                    ser = serial.Serial(port, 115200, timeout=0.1)  # Reduced timeout
-                    print(f"Successfully connected to {port}")
-                    time.sleep(2)  # Give time for the connection to establish
-                    
-                    # Start debug message reading thread
-                    should_stop = False
-                    if debug_thread is None or not debug_thread.is_alive():
-                        debug_thread = threading.Thread(target=read_debug_messages)
-                        debug_thread.daemon = True
-                        debug_thread.start()
-                    
-                    return True
-            except serial.SerialException as e:
-                print(f"Failed to connect to {port}: {e}")
-                continue
-        
-        raise Exception("Could not find Arduino on any common ports")
+        if port is None or not port.is_open:
+            raise Exception("Serial connection not available")
+        write_start = time.perf_counter()
+        port.write(message)
+        port.flush()  # Ensure the data is sent
+        write_time = time.perf_counter() - write_start
+        metrics.observe("serial_write", write_time)
+        metrics.inc("serial_messages")
+        metrics.inc("serial_bytes", len(message))
+        if recorder is not None:
+            recorder.record_serial_tx(message)
+        last_send_time = current_time
+        writer_stats["written"] += 1
+        writer_stats["write_time_total"] += write_time
+        writer_stats["write_time_max"] = max(writer_stats["write_time_max"], write_time)
+        if protocol == "binary":
+            link_stats.on_sent(send_seq, time.monotonic())
+            if report:
+                print(f"Sent {description} {send_seq} ({len(message)} bytes)")
+            send_seq = (send_seq + 1) & 0xFFFF
+        elif report:
+            print(f"Sent data: {message.decode('utf-8').strip()}")
+        return True
+
     except Exception as e:
-        print(f"Error establishing serial connection: {e}")
+        print(f"Error sending data: {e}")
+        writer_stats["write_errors"] += 1
+        metrics.inc("serial_write_errors")
+        _connection_lost(port, str(e))
         return False
 
-def target_detected_action(detection, rvec, tvec):
+def send_poses(poses, timestamp):
     """
-    Action executed when the target AprilTag is detected.
-    Sends the tag's position and orientation data over serial.
+    Encode and write the poses of one frame, highest priority first. Only
+    called from the thread that owns the writes: the writer thread, or the
+    CommandScheduler when one is running.
+
+    The binary protocol sends a single tag as a pose frame and several as
+    one multi-pose frame; the text protocol only carries the first tag.
+
+    Returns:
+      bool: True if the message was written.
     """
-    global ser, last_error_time, last_send_time
-    
     current_time = time.time()
-    
-    # Rate limit the sending of data
-    if current_time - last_send_time < min_send_interval:
-        return
-    
-    print("\n==== TARGET DETECTED ====")
-    print(f"Tag ID: {detection.getId()}")
-    print(f"Translation (meters): {tvec.ravel()}")
-    print(f"Rotation vector: {rvec.ravel()}")
-    
-    # Check if we need to retry connection
-    if ser is None or not ser.is_open or (current_time - last_error_time) > error_cooldown:
-        if not initialize_serial():
-            print("Failed to send data: No serial connection")
-            return
-    
-    try:
-        # Get x, y, z coordinates and rotation vector components
-        x, y, z = tvec.flatten()
-        rx, ry, rz = rvec.flatten()
-        
-        # Format the message as a comma-separated string ending with a newline
+    report = _report_due(current_time)
+
+    if report:
+        for tag_id, rvec, tvec in poses:
+            print("\n==== TARGET DETECTED ====")
+            print(f"Tag ID: {tag_id}")
+            print(f"Translation (meters): {tvec.ravel()}")
+            print(f"Rotation vector: {rvec.ravel()}")
+
+    if not _ensure_connection():
+        # The manager is reconnecting; drop rather than wait
+        writer_stats["offline"] += 1
+        metrics.inc("serial_dropped_offline")
+        return False
+
+    if protocol == "binary" and len(poses) > 1:
+        tag_ids, rvecs, tvecs = zip(*poses)
+        message = encode_multi_pose(send_seq, timestamp, tag_ids, tvecs, rvecs)
+    elif protocol == "binary":
+        tag_id, rvec, tvec = poses[0]
+        message = encode_pose(send_seq, timestamp, tag_id, tvec, rvec)
+    else:
         # Format: x,y,z,rx,ry,rz
-        message = f"{x:.3f},{y:.3f},{z:.3f},{rx:.3f},{ry:.3f},{rz:.3f}\n"
-        
-        with thread_lock:
-            if ser is not None and ser.is_open:
-                ser.write(message.encode('utf-8'))
-                ser.flush()  # Ensure the data is sent
-                last_send_time = current_time
-                print(f"Sent data: {message.strip()}")
-            else:
-                raise Exception("Serial connection not available")
-                
-    except Exception as e:
-        print(f"Error sending data: {e}")
-        last_error_time = current_time
-        with thread_lock:
-            if ser is not None and ser.is_open:
-                try:
-                    ser.close()
-                except:
-                    pass
-                ser = None
+        tag_id, rvec, tvec = poses[0]
+        message = encode_text(tvec, rvec)
+    return _write_message(message, current_time, "frame", report)
+
+def send_control(msg_type, timestamp=None):
+    """
+    Write a keep-alive (MSG_KEEPALIVE) or stop (MSG_STOP) message in the
+    selected protocol. Same threading rules as send_poses.
+
+    Returns:
+      bool: True if the message was written.
+    """
+    current_time = time.time()
+    if timestamp is None:
+        timestamp = time.monotonic()
+    if not _ensure_connection():
+        writer_stats["offline"] += 1
+        metrics.inc("serial_dropped_offline")
+        return False
+    if protocol == "binary":
+        message = encode_control(msg_type, send_seq, timestamp)
+    else:
+        message = CONTROL_TEXT[msg_type]
+    return _write_message(message, current_time, "stop" if msg_type == MSG_STOP else "keep-alive",
+                          _report_due(current_time))
+
+def write_loop():
+    """
+    Writer thread: send the newest poses from the mailbox, at most once per
+    min_send_interval. Poses posted while waiting replace older ones.
+    """
+    while not should_stop:
+        item = pose_mailbox.get(timeout=0.1)
+        if item is None:
+            continue
+        wait = min_send_interval - (time.time() - last_send_time)
+        if wait > 0:
+            time.sleep(wait)
+            newer = pose_mailbox.get(timeout=0)
+            if newer is not None:
+                writer_stats["replaced"] += 1
+                metrics.inc("serial_coalesced")
+                item = newer
+        try:
+            send_poses(*item)
+        except Exception as e:
+            print(f"Error in writer thread: {e}")
+
+def start_writer():
+    """
+    Start the serial writer thread if it is not already running.
+    """
+    global writer_thread, should_stop
+    if writer_thread is None or not writer_thread.is_alive():
+        should_stop = False
+        writer_thread = threading.Thread(target=write_loop, name="serial-writer")
+        writer_thread.daemon = True
+        writer_thread.start()
+
+def get_writer_stats():
+    """
+    Return writer counters: posted and written poses, poses overwritten in
+    the mailbox before they were sent (coalesced), errors and write latency.
+    """
+    stats = dict(writer_stats)
+    stats["coalesced"] = pose_mailbox.dropped + stats.pop("replaced")
+    written = stats["written"]
+    stats["write_time_mean"] = stats["write_time_total"] / written if written else 0.0
+    return stats
+
+def target_detected_action(detection, rvec, tvec, timestamp=None):
+    """
+    Action executed when the target AprilTag is detected.
+    Hands the tag's position and orientation to the serial writer thread
+    (or the CommandScheduler); never blocks on serial I/O.
+
+    Parameters:
+      detection: The detected target tag.
+      rvec, tvec (np.ndarray): Pose from estimate_pose.
+      timestamp (float): Capture time of the frame (time.monotonic());
+        defaults to now. Only transmitted by the binary protocol.
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    if scheduler is not None:
+        scheduler.post([(detection.getId(), rvec, tvec)], timestamp)
+        return
+    start_writer()
+    writer_stats["posted"] += 1
+    pose_mailbox.put(([(detection.getId(), rvec, tvec)], timestamp))
+
+def targets_detected_action(poses, timestamp=None):
+    """
+    Hand the poses of several targets seen in one frame to the serial
+    writer thread (or the CommandScheduler) as one message; never blocks
+    on serial I/O.
+
+    Parameters:
+      poses (list): (tag_id, rvec, tvec) tuples, highest priority first.
+      timestamp (float): Capture time of the frame (time.monotonic());
+        defaults to now.
+    """
+    if not poses:
+        return
+    if timestamp is None:
+        timestamp = time.monotonic()
+    if scheduler is not None:
+        scheduler.post(poses, timestamp)
+        return
+    start_writer()
+    writer_stats["posted"] += 1
+    pose_mailbox.put((list(poses), timestamp))
 
 def cleanup_serial():
     """
     Clean up the serial connection.
     """
-    global ser, debug_thread, should_stop
+    global ser, connection, debug_thread, should_stop
     should_stop = True
+    if writer_thread is not None:
+        writer_thread.join(timeout=1.0)
     if debug_thread is not None:
         debug_thread.join(timeout=1.0)
+    was_open = ser is not None
     with thread_lock:
-        if ser is not None and ser.is_open:
-            try:
-                ser.close()
-            except:
-                pass
-            print("Serial connection closed") 
\ No newline at end of file
+        ser = None
+    if connection is not None:
+        connection.close()
+        connection = None
+        if was_open:
+            print("Serial connection closed")
+    stats = get_writer_stats()
+    if stats["posted"]:
+        print(f"Writer stats: {stats['posted']} posted, {stats['written']} written, "
+              f"{stats['coalesced']} coalesced, {stats['write_errors']} errors, {stats['offline']} dropped offline, "
+              f"write mean {stats['write_time_mean'] * 1000:.2f}ms max {stats['write_time_max'] * 1000:.2f}ms")
+    if link_stats.sent:
+        print(f"Link stats: {link_stats.summary()}")
@@ -0,0 +1,576 @@
+#python3 -m src.sim_arduino --rate 100 --duration 10 --protocol binary
+# drive a simulated ArduinoSketch over a pty through the real send_data code; report throughput, latency and drops
+#python3 -m src.sim_arduino --rate 200 --send_rate 200 --unplug_every 4   (unplug the board every 4s to exercise reconnects)
+
+import os
+import pty
+import sys
+import tty
+import time
+import argparse
+import tempfile
+import threading
+import collections
+import numpy as np
+from .protocol import (SYNC, MSG_POSE, MSG_MULTI_POSE, MSG_KEEPALIVE, MSG_STOP, HEADER_SIZE, CRC_SIZE,
+                       MAX_PAYLOAD_SIZE, TAG_POSE_DTYPE, crc16)
+from .metrics import metrics, Histogram
+
+# ArduinoSketch.ino constants
+CENTER_THRESHOLD = 0.05
+APPROACH_THRESHOLD = 0.07
+MAX_SPEED = 150
+MIN_SPEED = 50
+MOVEMENT_TIMEOUT = 100  # ms
+LINK_TIMEOUT = 500  # ms
+POSE_SIZE = TAG_POSE_DTYPE.itemsize
+
+
+def _constrain(value, low, high):
+    return min(max(value, low), high)
+
+
+def _map(x, in_min, in_max, out_min, out_max):
+    # map() on the board truncates its arguments to long; this is the float
+    # formula the sketch means, so the speeds differ but the lines printed
+    # (and so the serial timing) are the same size
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+
+class SimulatedArduino:
+    """
+    ArduinoSketch.ino's side of the serial link on a pseudo-terminal.
+
+    Parses text and binary messages byte by byte as the sketch does, runs
+    its drive logic and thresholds, and prints the same debug and ACK lines.
+    Both directions are paced at `baud` (10 bits per byte). Like the board,
+    it has 64-byte receive and transmit buffers. A print that does not fit
+    the transmit buffer blocks the loop, and bytes arriving while the
+    receive buffer is full are lost.
+
+    The host opens `port`, a symlink to the current pty, so unplug() and a
+    replug show up to it as a disconnect followed by the same device path
+    coming back.
+
+    Parameters:
+      baud (int): Simulated line rate.
+      debug (bool): Print the sketch's debug lines (speeds, halts); ACKs
+        are always sent.
+      port (str): Path of the symlink to create (default: a temp file name).
+      boot_time (float): Seconds after a (re)plug before setup() has run and
+        READY is printed; input is ignored until then, as by the bootloader.
+    """
+    RX_BUFFER = 64
+    TX_BUFFER = 64
+
+    def __init__(self, baud=115200, debug=True, port=None, boot_time=0.0):
+        self.baud = baud
+        self.boot_time = boot_time
+        self.byte_time = 10.0 / baud
+        self.debug = debug
+        self.port = port or os.path.join(tempfile.gettempdir(), f"sim-arduino-{os.getpid()}")
+        self.stats = collections.Counter()
+        self.latencies = collections.deque(maxlen=100000)
+        self._master = None
+        self._slave = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._plug()
+        self._thread = threading.Thread(target=self._run, name="sim-arduino", daemon=True)
+        self._thread.start()
+
+    # -- the pty ------------------------------------------------------------
+
+    def _plug(self):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        tmp = self.port + ".tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.ttyname(slave), tmp)
+        os.replace(tmp, self.port)
+        self._reset()
+        with self._lock:
+            # The board keeps its own handle on the slave so reads do not
+            # fail while the host is between connections
+            self._master, self._slave = master, slave
+
+    def unplug(self):
+        """
+        Pull the cable: the host's open port starts failing and the path
+        disappears until replug().
+        """
+        with self._lock:
+            master, slave = self._master, self._slave
+            self._master = self._slave = None
+        if master is not None:
+            os.close(master)
+            os.close(slave)
+            os.remove(self.port)
+            self.stats["unplugs"] += 1
+
+    def replug(self):
+        """
+        Plug the cable back in; the board starts from reset.
+        """
+        if self._master is None:
+            self._plug()
+
+    def _reset(self):
+        self._boot = time.monotonic()
+        self._booted = False
+        self._rx = collections.deque()
+        self._tx = bytearray()
+        self._rx_credit = 0.0
+        self._tx_credit = 0.0
+        self._block_budget = 0
+        self._last_pump = time.monotonic()
+        self._frame = bytearray()
+        self._text = bytearray()
+        self.last_x = 0.0
+        self.last_z = 0.0
+        self.left_speed = 0.0
+        self.right_speed = 0.0
+        self._last_update = 0
+        self._last_message = 0
+        self._keepalive_seen = False
+        self._link_lost = False
+
+    def _pump(self, blocked=False):
+        """
+        Move bytes across the simulated line in both directions, as many as
+        `baud` allows since the last call.
+
+        Only while the loop is blocked in a print can the receive buffer
+        overflow; otherwise the loop drains it as fast as bytes arrive.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_pump
+        self._last_pump = now
+        with self._lock:
+            master = self._master
+            if master is None:
+                return
+            self._rx_credit += elapsed / self.byte_time
+            wanted = int(self._rx_credit)
+            if blocked:
+                # A stall of this process must not look like a longer block
+                wanted = min(wanted, self._block_budget)
+            if wanted > 0:
+                try:
+                    data = os.read(master, wanted)
+                except (BlockingIOError, OSError):
+                    data = b""
+                if len(data) < wanted:
+                    # The line went idle: nothing to catch up on
+                    self._rx_credit = 0.0
+                else:
+                    self._rx_credit -= len(data)
+                self.stats["bytes_received"] += len(data)
+                if blocked:
+                    self._block_budget -= len(data)
+                for b in data:
+                    if not blocked or len(self._rx) < self.RX_BUFFER:
+                        self._rx.append(b)
+                    else:
+                        self.stats["rx_overflow"] += 1
+            if not self._tx:
+                self._tx_credit = 0.0
+                return
+            self._tx_credit += elapsed / self.byte_time
+            count = min(int(self._tx_credit), len(self._tx))
+            if count > 0:
+                try:
+                    os.write(master, bytes(self._tx[:count]))
+                except (BlockingIOError, OSError):
+                    # Nobody is reading the port: the USB bridge drops it
+                    self.stats["tx_discarded"] += count
+                self.stats["bytes_sent"] += count
+                del self._tx[:count]
+                self._tx_credit -= count
+
+    def _wait(self, duration):
+        end = time.monotonic() + duration
+        self._block_budget = int(duration / self.byte_time) + 1
+        while not self._stop.is_set():
+            self._pump(blocked=True)
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.0005))
+
+    def _println(self, text):
+        data = text.encode() + b"\r\n"
+        excess = len(self._tx) + len(data) - self.TX_BUFFER
+        if excess > 0:
+            # Serial.print blocks the loop until the buffer has room
+            self.stats["tx_blocked"] += 1
+            self._wait(excess * self.byte_time)
+        self._tx += data
+        self.stats["lines"] += 1
+
+    def _millis(self):
+        return int((time.monotonic() - self._boot) * 1000)
+
+    # -- the sketch -----------------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._pump()
+            if self._master is None:
+                time.sleep(0.01)
+                continue
+            if not self._booted:
+                if time.monotonic() - self._boot < self.boot_time:
+                    self._rx.clear()
+                    time.sleep(0.001)
+                    continue
+                self._booted = True
+                self._println("READY")
+            self._loop()
+            time.sleep(0.0002)
+
+    def _loop(self):
+        current = self._millis()
+        if self._keepalive_seen and not self._link_lost and current - self._last_message > LINK_TIMEOUT:
+            if self.debug:
+                self._println("Link timeout. Halting...")
+            self._link_lost = True
+            self.last_z = 0.0
+            self._halt()
+            self.stats["link_timeouts"] += 1
+        if current - self._last_update > MOVEMENT_TIMEOUT and self.last_z > APPROACH_THRESHOLD:
+            self._move(self.last_x, self.last_z)
+        while self._rx and not self._stop.is_set():
+            self._handle_byte(self._rx.popleft(), current)
+
+    def _handle_byte(self, b, current):
+        # Binary frames start with 0xAA, which never appears in the text format
+        if self._frame or (b == SYNC[0] and not self._text):
+            frame = self._frame
+            frame.append(b)
+            n = len(frame)
+            if (n == 2 and b != SYNC[1]) or (n == 4 and b > MAX_PAYLOAD_SIZE):
+                self.stats["bad_headers"] += 1
+                frame.clear()
+                return
+            if n >= HEADER_SIZE and n == HEADER_SIZE + frame[3] + CRC_SIZE:
+                self._handle_frame(bytes(frame), current)
+                frame.clear()
+            return
+        if b == 0x0A:
+            self._handle_text(self._text.decode("ascii", "replace"), current)
+            self._text.clear()
+        elif len(self._text) < 63:
+            self._text.append(b)
+
+    def _handle_frame(self, frame, current):
+        length = frame[3]
+        crc = int.from_bytes(frame[HEADER_SIZE + length:HEADER_SIZE + length + CRC_SIZE], "little")
+        if crc != crc16(frame[2:HEADER_SIZE + length]):
+            self.stats["crc_errors"] += 1
+            self._println("CRC error")
+            return
+        self.stats["frames"] += 1
+        msg_type = frame[2]
+        seq = int.from_bytes(frame[4:6], "little")
+        timestamp = int.from_bytes(frame[6:10], "little")
+        payload = frame[HEADER_SIZE:HEADER_SIZE + length]
+        pose = None
+        if msg_type == MSG_POSE and length >= POSE_SIZE:
+            pose = payload
+        elif msg_type == MSG_MULTI_POSE and length >= 1 + POSE_SIZE and payload[0] > 0:
+            # Drive towards the first (highest priority) target
+            pose = payload[1:]
+        elif msg_type in (MSG_KEEPALIVE, MSG_STOP):
+            self._control(msg_type)
+        if pose is not None:
+            # Host and simulator share the monotonic clock
+            now_us = int(time.monotonic() * 1e6) & 0xFFFFFFFF
+            self.latencies.append(((now_us - timestamp) & 0xFFFFFFFF) / 1e6)
+            x = int.from_bytes(pose[2:4], "little", signed=True) / 1000.0
+            z = int.from_bytes(pose[6:8], "little", signed=True) / 1000.0
+            self._apply_pose(x, z, current)
+        self._last_message = current
+        self._link_lost = False
+        # Lets the host measure latency and count dropped frames
+        self._println(f"ACK {seq}")
+
+    def _handle_text(self, line, current):
+        if line == "PING":
+            self.stats["pings"] += 1
+            self._println("PONG")
+            self._last_message = current
+            self._link_lost = False
+            return
+        if line in ("KEEPALIVE", "STOP"):
+            self.stats["text_lines"] += 1
+            self._control(MSG_STOP if line == "STOP" else MSG_KEEPALIVE)
+            self._last_message = current
+            self._link_lost = False
+            return
+        fields = line.split(",")
+        if len(fields) < 6 or not all(fields[:3]):
+            # Includes binary bytes read as text after a frame was broken
+            self.stats["bad_lines"] += 1
+            return
+        self.stats["text_lines"] += 1
+
+        def to_float(text):
+            # String.toFloat() returns 0 for garbage
+            try:
+                return float(text)
+            except ValueError:
+                return 0.0
+
+        self._apply_pose(to_float(fields[0]), to_float(fields[2]), current)
+        self._last_message = current
+        self._link_lost = False
+
+    def _control(self, msg_type):
+        self._keepalive_seen = True
+        if msg_type == MSG_STOP:
+            self.stats["stops"] += 1
+            if self.last_z != 0 and self.debug:
+                self._println("Stop received. Halting...")
+            self.last_z = 0.0
+            self._halt()
+        else:
+            self.stats["keepalives"] += 1
+
+    def _apply_pose(self, x, z, current):
+        self.stats["poses"] += 1
+        self.last_x = x
+        self.last_z = z
+        self._last_update = current
+        if z > APPROACH_THRESHOLD:
+            self._move(x, z)
+        else:
+            # Tag is close enough, so stop.
+            if self.debug:
+                self._println("Tag reached. Halting...")
+            self._halt()
+
+    def _move(self, x, z):
+        base = _constrain(_map(z, APPROACH_THRESHOLD, 1.0, MIN_SPEED, MAX_SPEED), MIN_SPEED, MAX_SPEED)
+        turn = _constrain(_map(x, -CENTER_THRESHOLD, CENTER_THRESHOLD, -1.0, 1.0), -1.0, 1.0)
+        self.left_speed = _constrain(base * (1.0 + turn), 0, MAX_SPEED)
+        self.right_speed = _constrain(base * (1.0 - turn), 0, MAX_SPEED)
+        if self.debug:
+            self._println(f"Speeds - Left: {self.left_speed:.2f} Right: {self.right_speed:.2f}")
+
+    def _halt(self):
+        self.left_speed = self.right_speed = 0.0
+        self.stats["halts"] += 1
+
+    @property
+    def messages(self):
+        """
+        Messages the sketch accepted: valid binary frames and text lines.
+        """
+        return self.stats["frames"] + self.stats["text_lines"]
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self.unplug()
+
+
+def target_poses(t, tags=1):
+    """
+    Poses of `tags` targets weaving towards the camera, at time t seconds.
+    """
+    poses = []
+    for i in range(tags):
+        x = 0.1 * np.sin(2.0 * t + i)
+        z = 0.3 + 1.2 * (0.5 + 0.5 * np.cos(0.3 * t + i))
+        poses.append((i, np.array([[0.0], [0.2 * np.sin(t)], [0.0]]), np.array([[x], [0.0], [z]])))
+    return poses
+
+
+class _DebugCounter:
+    """
+    Stand-in for stdout while the load runs: counts the "Arduino:" lines
+    the debug reader prints and passes everything else through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.arduino_lines = 0
+        self._swallow_newline = False
+
+    def write(self, text):
+        # print() writes the line and its end separately
+        if "Arduino:" in text or (self._swallow_newline and text == "\n"):
+            self.arduino_lines += text.count("Arduino:")
+            self._swallow_newline = text != "\n"
+            return len(text)
+        self._swallow_newline = False
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_load(rate=100.0, duration=10.0, protocol="binary", send_rate=None, scheduler_rate=0.0, tags=1,
+             baud=115200, debug=True, unplug_every=0.0, unplug_time=1.0, boot_time=0.0):
+    """
+    Post poses at `rate` Hz for `duration` seconds through the real
+    send_data path (writer thread, or CommandScheduler with
+    scheduler_rate) to a SimulatedArduino, and print what got through.
+
+    Returns:
+      dict: Throughput, drop and latency figures.
+    """
+    from . import send_data
+    from .scheduler import CommandScheduler
+
+    board = SimulatedArduino(baud=baud, debug=debug, boot_time=boot_time)
+    send_data.set_ports([board.port])
+    send_data.set_protocol(protocol)
+    send_data.set_verbose(False)
+    if send_rate:
+        send_data.set_send_rate(send_rate)
+    scheduler = None
+    stdout = sys.stdout
+    counter = _DebugCounter(stdout)
+    sys.stdout = counter
+    posted = 0
+    try:
+        if not send_data.initialize_serial(wait=5.0):
+            raise RuntimeError(f"Could not open the simulator at {board.port}")
+        if scheduler_rate > 0:
+            scheduler = CommandScheduler(scheduler_rate, send_data.send_poses, send_data.send_control)
+            send_data.set_scheduler(scheduler)
+        start = time.monotonic()
+        next_unplug = start + unplug_every if unplug_every > 0 else None
+        replug_at = None
+        tick = 0
+        while True:
+            now = time.monotonic()
+            if now - start >= duration:
+                break
+            if next_unplug is not None and now >= next_unplug:
+                board.unplug()
+                replug_at = now + unplug_time
+                next_unplug += unplug_every
+            if replug_at is not None and now >= replug_at:
+                board.replug()
+                replug_at = None
+            send_data.targets_detected_action(target_poses(now - start, tags), timestamp=now)
+            posted += 1
+            tick += 1
+            delay = start + tick / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.monotonic() - start
+        if scheduler is not None:
+            # Its keep-alives would never let the line go quiet
+            send_data.set_scheduler(None)
+            scheduler.close()
+        board.replug()
+        # Let the messages still queued (an overloaded line backs up) and
+        # their ACKs cross the line
+        drain_end = time.monotonic() + 10.0
+        parsed = -1
+        while parsed != board.messages and time.monotonic() < drain_end:
+            parsed = board.messages
+            time.sleep(0.3)
+    finally:
+        if scheduler is not None and send_data.scheduler is scheduler:
+            send_data.set_scheduler(None)
+            scheduler.close()
+        send_data.cleanup_serial()
+        sys.stdout = stdout
+    board.close()
+
+    writer = send_data.get_writer_stats()
+    link = send_data.link_stats
+    written = writer["written"]
+    rtt = Histogram.quantiles(metrics.histogram("link_rtt").snapshot()[0], (0.5, 0.99))
+    latencies = np.array(board.latencies)
+    report = {
+        "posted": posted,
+        "written": written,
+        "coalesced": writer["coalesced"],
+        "write_errors": writer["write_errors"],
+        "reconnects": metrics.counter("serial_reconnects"),
+        "elapsed": elapsed,
+        "messages_per_second": written / elapsed,
+        "board_messages": board.messages,
+        "drop_rate": max(written - board.messages, 0) / written if written else 0.0,
+        "rx_overflow": board.stats["rx_overflow"],
+        "crc_errors": board.stats["crc_errors"],
+        "bad_headers": board.stats["bad_headers"],
+        "bad_lines": board.stats["bad_lines"],
+        "debug_lines": board.stats["lines"],
+        "host_lines": counter.arduino_lines + link.acked,
+        "tx_blocked": board.stats["tx_blocked"],
+        "rx_load": metrics.counter("serial_bytes") / elapsed / (baud / 10.0),
+        "tx_load": board.stats["bytes_sent"] / elapsed / (baud / 10.0),
+        "rtt_p50": rtt[0],
+        "rtt_p99": rtt[1],
+        "rtt_max": link.latency_max,
+        "acked": link.acked,
+        "lost": link.lost,
+        "post_to_board_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "post_to_board_p99": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+    }
+    if scheduler is not None:
+        report["scheduler"] = scheduler.summary()
+
+    mode = f"scheduler at {scheduler_rate:g}Hz" if scheduler is not None else \
+        f"writer thread, {1.0 / send_data.min_send_interval:g} msg/s max"
+    print(f"\nLoad: {posted} posts at {rate:g}Hz over {elapsed:.1f}s ({protocol}, {tags} tag(s), {mode}, "
+          f"{baud} baud)")
+    print(f"Host: {written} written ({report['messages_per_second']:.1f} msg/s, line "
+          f"{report['rx_load'] * 100:.0f}% busy), {report['coalesced']} coalesced, {report['write_errors']} write errors, "
+          f"{report['reconnects']} reconnects")
+    print(f"Board: {board.messages} messages parsed, {report['rx_overflow']} bytes lost to RX overflow, "
+          f"{report['crc_errors']} CRC errors, {report['bad_headers']} bad headers, "
+          f"{report['bad_lines']} unparsable lines")
+    print(f"Board output: {report['debug_lines']} lines printed ({report['tx_blocked']} blocked the loop), "
+          f"TX line {report['tx_load'] * 100:.0f}% busy; host read {report['host_lines']} (ACKs and debug lines)")
+    print(f"Drop rate: {report['drop_rate'] * 100:.2f}% of written messages not parsed by the board")
+    if protocol == "binary":
+        print(f"Round trip (ACK): {report['acked']} acked, {report['lost']} lost, p50 {rtt[0] * 1e3:.1f}ms "
+              f"p99 {rtt[1] * 1e3:.1f}ms max {link.latency_max * 1e3:.1f}ms")
+        print(f"Post to board: p50 {report['post_to_board_p50'] * 1e3:.1f}ms "
+              f"p99 {report['post_to_board_p99'] * 1e3:.1f}ms")
+    if scheduler is not None:
+        print(f"Scheduler: {report['scheduler']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test send_data against a simulated Arduino on a pty.")
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help="Poses posted per second, like a camera's frame rate (default: 100).")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="Seconds to run (default: 10).")
+    parser.add_argument('--protocol', choices=['text', 'binary'], default='binary',
+                        help="Wire format (default: binary; only binary has ACKs and timestamps).")
+    parser.add_argument('--send_rate', type=float, default=None,
+                        help="Writer thread's maximum messages per second (default: send_data's 20).")
+    parser.add_argument('--scheduler', type=float, default=0, metavar='HZ',
+                        help="Send through a CommandScheduler at HZ instead of the writer thread.")
+    parser.add_argument('--tags', type=int, default=1,
+                        help="Targets per message; more than one uses multi-pose frames (default: 1).")
+    parser.add_argument('--baud', type=int, default=115200,
+                        help="Simulated line rate (default: 115200).")
+    parser.add_argument('--no_debug', action='store_true',
+                        help="The board only sends ACKs, no speed or halt lines.")
+    parser.add_argument('--unplug_every', type=float, default=0,
+                        help="Unplug the board every N seconds (default: never).")
+    parser.add_argument('--unplug_time', type=float, default=1.0,
+                        help="Seconds the board stays unplugged (default: 1).")
+    parser.add_argument('--boot_time', type=float, default=0.0,
+                        help="Seconds the board takes to boot after a plug, like the bootloader (default: 0).")
+    args = parser.parse_args()
+    run_load(args.rate, args.duration, args.protocol, args.send_rate, args.scheduler, args.tags, args.baud,
+             not args.no_debug, args.unplug_every, args.unplug_time, args.boot_time)
+
+
+if __name__ == "__main__":
+    main()
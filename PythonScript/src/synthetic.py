@@ -0,0 +1,122 @@
+import cv2
+import numpy as np
+from .detector import tag_object_points
+
+# Stand-in intrinsics for a 1280x720 capture when no calibration is given
+DEFAULT_CAMERA_MATRIX = np.array([
+    [900.0, 0.0, 640.0],
+    [0.0, 900.0, 360.0],
+    [0.0, 0.0, 1.0],
+])
+
+_marker_cache = {}
+
+def tag_image(tag_id, cell_px=16):
+    """
+    Image of a tag36h11 tag with a one-cell white quiet zone.
+
+    Returns:
+      (image, corners): uint8 image and the outer corners of the black border
+      in the order robotpy reports detection corners.
+    """
+    key = (tag_id, cell_px)
+    if key not in _marker_cache:
+        dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36h11)
+        marker = cv2.aruco.generateImageMarker(dictionary, tag_id, 8 * cell_px)
+        image = cv2.copyMakeBorder(marker, cell_px, cell_px, cell_px, cell_px,
+                                   cv2.BORDER_CONSTANT, value=255)
+        lo, hi = cell_px - 0.5, 9 * cell_px - 0.5
+        # robotpy order for an upright tag: top-right, top-left, bottom-left, bottom-right
+        corners = np.array([[hi, lo], [lo, lo], [lo, hi], [hi, hi]], dtype=np.float32)
+        _marker_cache[key] = (image, corners)
+    return _marker_cache[key]
+
+def render_scene(tags, camera_matrix=DEFAULT_CAMERA_MATRIX, size=(1280, 720), background=160,
+                 noise=0.0, blur=0, rng=None, out=None):
+    """
+    Render tags at known poses into a grayscale frame.
+
+    Parameters:
+      tags (list): (tag_id, rvec, tvec, tag_size) tuples in the pose convention
+        of detector.PoseEstimator.
+      camera_matrix (np.ndarray): Intrinsics used for the projection (no distortion).
+      size (tuple): (width, height) of the frame.
+      background (int): Background gray level.
+      noise (float): Standard deviation of added Gaussian pixel noise.
+      blur (int): Gaussian blur kernel size (odd), 0 for none.
+      rng (np.random.Generator): Random source for the noise.
+      out (np.ndarray): Optional (height, width) uint8 buffer to render into.
+
+    Returns:
+      (frame, truth): the uint8 frame and a dict of tag ID -> (rvec, tvec, corners)
+      with the projected 4x2 corners of every rendered tag.
+    """
+    width, height = size
+    if out is None:
+        frame = np.full((height, width), background, dtype=np.uint8)
+    else:
+        frame = out
+        frame.fill(background)
+    truth = {}
+    for tag_id, rvec, tvec, tag_size in tags:
+        rvec = np.asarray(rvec, dtype=np.float64).reshape((3, 1))
+        tvec = np.asarray(tvec, dtype=np.float64).reshape((3, 1))
+        corners, _ = cv2.projectPoints(tag_object_points(tag_size), rvec, tvec, camera_matrix, None)
+        corners = corners.reshape((4, 2)).astype(np.float32)
+        image, src = tag_image(tag_id)
+        # Include the quiet zone by warping the whole tag image
+        H = cv2.getPerspectiveTransform(src, corners)
+        cv2.warpPerspective(image, H, (width, height), dst=frame,
+                            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_TRANSPARENT)
+        truth[tag_id] = (rvec, tvec, corners)
+    if blur:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+    if noise:
+        rng = rng or np.random.default_rng()
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return frame, truth
+
+def random_pose(rng, distance=(0.3, 2.0), max_tilt=50.0, fov=(0.6, 0.35)):
+    """
+    Random tag pose facing the camera: distance in metres, tilt in degrees,
+    and lateral position as a fraction of the distance.
+    """
+    z = rng.uniform(*distance)
+    tvec = np.array([rng.uniform(-fov[0], fov[0]) * z, rng.uniform(-fov[1], fov[1]) * z, z])
+    # The tag frame faces the camera when rotated 180 degrees about y
+    facing = cv2.Rodrigues(np.array([0.0, np.pi, 0.0]))[0]
+    tilt = np.radians(rng.uniform(-max_tilt, max_tilt, 2))
+    spin = np.radians(rng.uniform(-180, 180))
+    R = facing @ cv2.Rodrigues(np.array([tilt[0], tilt[1], 0.0]))[0] @ cv2.Rodrigues(np.array([0.0, 0.0, spin]))[0]
+    return cv2.Rodrigues(R)[0], tvec.reshape((3, 1))
+
+def random_scenes(count, tag_ids=(0, 1, 2, 3), tag_size=0.0508, tags_per_frame=2, seed=0,
+                  camera_matrix=DEFAULT_CAMERA_MATRIX, size=(1280, 720), noise=2.0, blur=3,
+                  distance=(0.3, 2.0)):
+    """
+    Generate `count` scenes with random tags at random poses.
+
+    Yields:
+      (frame, truth) as returned by render_scene.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    for _ in range(count):
+        ids = rng.choice(tag_ids, size=min(tags_per_frame, len(tag_ids)), replace=False)
+        tags = []
+        placed = []
+        for tag_id in ids:
+            # Retry until the tag is in frame and does not overlap the others
+            for _ in range(50):
+                rvec, tvec = random_pose(rng, distance)
+                corners, _ = cv2.projectPoints(tag_object_points(tag_size * 1.25), rvec, tvec, camera_matrix, None)
+                corners = corners.reshape((4, 2))
+                lo, hi = corners.min(axis=0), corners.max(axis=0)
+                if lo.min() < 0 or hi[0] >= width or hi[1] >= height:
+                    continue
+                if any(not (hi[0] < a[0] or lo[0] > b[0] or hi[1] < a[1] or lo[1] > b[1]) for a, b in placed):
+                    continue
+                placed.append((lo, hi))
+                tags.append((int(tag_id), rvec, tvec, tag_size))
+                break
+        yield render_scene(tags, camera_matrix, size, noise=noise, blur=blur, rng=rng)
@@ -0,0 +1,175 @@
+import numpy as np
+
+# One row per requested tag ID
+STATE_DTYPE = np.dtype([
+    ("tag_id", "<i4"),
+    ("position", "<f8", (3,)),   # tvec of the last sighting (m)
+    ("rotation", "<f8", (3,)),   # rvec of the last sighting (rad)
+    ("velocity", "<f8", (3,)),   # smoothed (m/s)
+    ("last_seen", "<f8"),        # capture time of the last sighting, NaN before the first
+    ("age", "<i4"),              # frames since the last sighting, -1 before the first
+    ("hits", "<i4"),             # total sightings
+    ("confidence", "<f4"),       # 0..1, rises while seen and decays while missing
+    ("margin", "<f4"),           # decision margin of the last detection
+])
+
+PRIORITIES = ("listed", "nearest", "confidence")
+
+def parse_targets(spec):
+    """
+    Parse a target list such as "27", "1-5,27" or "40-42, 3" into tag IDs,
+    keeping the order given (the "listed" priority) and dropping repeats.
+    """
+    tag_ids = []
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = (int(v) for v in part.split("-", 1))
+            if last < first:
+                raise ValueError(f"Bad tag ID range: {part}")
+            ids = range(first, last + 1)
+        else:
+            ids = [int(part)]
+        for tag_id in ids:
+            if tag_id < 0:
+                raise ValueError(f"Bad tag ID: {tag_id}")
+            if tag_id not in tag_ids:
+                tag_ids.append(tag_id)
+    if not tag_ids:
+        raise ValueError(f"No tag IDs in '{spec}'")
+    return tag_ids
+
+class TargetTable:
+    """
+    Per-tag state for a fixed set of target IDs, stored as one structured
+    array (STATE_DTYPE) with an ID -> row lookup array, so per-frame
+    bookkeeping is a handful of vector operations however many tags are
+    tracked.
+
+    Parameters:
+      tag_ids (list): Target IDs, in "listed" priority order.
+      priority (str): Ordering of the published tags: "listed" (order of
+        tag_ids), "nearest" (smallest distance first) or "confidence".
+      max_age (float): Seconds after which a sighting no longer seeds the
+        velocity estimate.
+      smoothing (float): Weight of the previous velocity in the update (0..1).
+      confidence_gain (float): Step of the confidence towards 1 on a
+        sighting and towards 0 on a miss.
+    """
+
+    def __init__(self, tag_ids, priority="listed", max_age=0.5, smoothing=0.5, confidence_gain=0.3):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.tag_ids = list(tag_ids)
+        self.priority = priority
+        self.max_age = max_age
+        self.smoothing = smoothing
+        self.confidence_gain = confidence_gain
+        self.state = np.zeros(len(self.tag_ids), dtype=STATE_DTYPE)
+        self.state["tag_id"] = self.tag_ids
+        self.state["last_seen"] = np.nan
+        self.state["age"] = -1
+        self._rows = np.full(max(self.tag_ids) + 1, -1, dtype=np.int32)
+        self._rows[self.tag_ids] = np.arange(len(self.tag_ids))
+        self._seen = np.zeros(len(self.tag_ids), dtype=bool)
+
+    def row(self, tag_id):
+        """
+        Row of a tag ID in `state`, or -1 if it is not a target.
+        """
+        if 0 <= tag_id < len(self._rows):
+            return int(self._rows[tag_id])
+        return -1
+
+    def __contains__(self, tag_id):
+        return self.row(tag_id) >= 0
+
+    def update(self, poses, timestamp):
+        """
+        Record one frame's poses.
+
+        Parameters:
+          poses (dict): tag ID -> (detection, rvec, tvec, error) for the
+            targets found in the frame; other IDs are ignored.
+          timestamp (float): Capture time of the frame (time.monotonic()).
+
+        Returns:
+          list: (tag_id, rvec, tvec) of the targets seen in this frame, in
+          priority order.
+        """
+        state = self.state
+        seen = self._seen
+        seen[:] = False
+        for tag_id, (detection, rvec, tvec, _) in poses.items():
+            i = self.row(tag_id)
+            if i < 0:
+                continue
+            position = np.asarray(tvec, dtype=np.float64).ravel()
+            dt = timestamp - state["last_seen"][i]
+            if 0 < dt <= self.max_age:
+                velocity = (position - state["position"][i]) / dt
+                if state["age"][i] == 0:
+                    # Consecutive frames: smooth; otherwise start over
+                    velocity = self.smoothing * state["velocity"][i] + (1 - self.smoothing) * velocity
+                state["velocity"][i] = velocity
+            else:
+                state["velocity"][i] = 0.0
+            state["position"][i] = position
+            state["rotation"][i] = np.asarray(rvec, dtype=np.float64).ravel()
+            state["last_seen"][i] = timestamp
+            state["margin"][i] = detection.getDecisionMargin()
+            seen[i] = True
+
+        gain = self.confidence_gain
+        started = state["age"] >= 0
+        state["age"] = np.where(seen, 0, np.where(started, state["age"] + 1, -1))
+        state["hits"] += seen
+        state["confidence"] = np.where(seen, state["confidence"] + gain * (1 - state["confidence"]),
+                                       state["confidence"] * (1 - gain))
+        return self._publish(np.flatnonzero(seen))
+
+    def _order(self, rows):
+        if self.priority == "nearest":
+            return rows[np.argsort(np.linalg.norm(self.state["position"][rows], axis=1), kind="stable")]
+        if self.priority == "confidence":
+            return rows[np.argsort(-self.state["confidence"][rows], kind="stable")]
+        return rows
+
+    def _publish(self, rows):
+        state = self.state
+        return [(int(state["tag_id"][i]), state["rotation"][i].reshape((3, 1)).copy(),
+                 state["position"][i].reshape((3, 1)).copy()) for i in self._order(rows)]
+
+    def tracked(self, max_frames=None):
+        """
+        (tag_id, rvec, tvec) of every target seen so far (or within the last
+        `max_frames` frames), in priority order, with the last known pose.
+        """
+        age = self.state["age"]
+        mask = age >= 0 if max_frames is None else (age >= 0) & (age <= max_frames)
+        return self._publish(np.flatnonzero(mask))
+
+    def predict(self, tag_id, timestamp):
+        """
+        Constant-velocity position of a target at `timestamp`, or None if it
+        has not been seen.
+        """
+        i = self.row(tag_id)
+        if i < 0 or self.state["age"][i] < 0:
+            return None
+        return self.state["position"][i] + self.state["velocity"][i] * (timestamp - self.state["last_seen"][i])
+
+    def summary(self):
+        """
+        One line per target: ID, frames since seen, sightings and confidence.
+        """
+        lines = []
+        for row in self.state:
+            if row["age"] < 0:
+                lines.append(f"  ID {row['tag_id']}: never seen")
+            else:
+                lines.append(f"  ID {row['tag_id']}: seen {row['age']} frames ago, {row['hits']} hits, "
+                             f"confidence {row['confidence']:.2f}")
+        return "\n".join(lines)